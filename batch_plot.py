@@ -0,0 +1,169 @@
+"""
+Graficado en lote de muchos archivos FITS con un pool de procesos (backend Agg, sin ventanas).
+
+El manifiesto es un CSV con encabezado y una fila por figura. Columnas:
+    image    (obligatoria): Archivo FITS de la imagen base.
+    output   (obligatoria): Archivo de salida (PNG, PDF, SVG...).
+    contour  (opcional):    Archivo FITS de los contornos.
+    moment   (opcional):    'm0', 'm1', 'm2' o 'continuo'.
+    label    (opcional):    Nombre de la región.
+    title    (opcional):    Título de la figura.
+    channel  (opcional):    Canal a graficar (activa el modo lazy de FITSPlotter).
+
+Uso:
+    python batch_plot.py <manifest.csv> [--workers N] [--lazy]
+
+Ejemplo de manifiesto:
+    image,contour,moment,label,output
+    m17_m0.fits,m17_m0_contornos.fits,m0,M17SW,figuras/m17_m0.png
+    m17_m1.fits,,m1,M17SW,figuras/m17_m1.png
+
+Uso desde Python:
+    from batch_plot import read_manifest, render_batch
+    results = render_batch(read_manifest("manifest.csv"), workers=32)
+
+Cada proceso reutiliza una misma figura (export.FigureTemplate): en cada fila solo se
+actualizan la imagen, los contornos y las anotaciones, sin pyplot ni plt.show().
+Si una figura falla, el error se reporta y el lote continúa con las demás.
+"""
+
+import os
+import sys
+import csv
+import time
+import argparse
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+REQUIRED_COLUMNS = ("image", "output")
+
+# Variables de entorno que limitan los hilos de BLAS/OpenMP en cada proceso, para que
+# N procesos no compitan por N x N hilos (la escalabilidad viene de los procesos).
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+
+
+def read_manifest(manifest_file):
+    """Lee el manifiesto CSV y retorna una lista de diccionarios (una fila por figura)."""
+    with open(manifest_file, newline="") as f:
+        rows = list(csv.DictReader(f))
+    for number, row in enumerate(rows, start=2):
+        missing = [column for column in REQUIRED_COLUMNS if not (row.get(column) or "").strip()]
+        if missing:
+            raise ValueError(f"Fila {number} del manifiesto sin columnas obligatorias: {missing}")
+    return rows
+
+
+# Plantilla de figura reutilizada por todas las figuras de un mismo proceso (ver export.py)
+_template = None
+
+
+def _init_worker():
+    """Inicializa cada proceso con el backend Agg (sin pantalla)."""
+    import matplotlib
+    matplotlib.use("Agg", force=True)
+
+
+def _get_template():
+    """Plantilla de figura del proceso actual (se crea en la primera figura)."""
+    global _template
+    if _template is None:
+        from export import FigureTemplate
+        _template = FigureTemplate(figsize=(10, 8), dpi=300)
+    return _template
+
+
+def render_row(row, lazy=False):
+    """
+    Genera y guarda una figura a partir de una fila del manifiesto.
+    Retorna un diccionario con el archivo de salida, el estado y el tiempo empleado.
+    """
+    from fits_plotter import FITSPlotter
+
+    start = time.perf_counter()
+    result = {"output": row["output"], "ok": True, "error": None}
+    try:
+        channel = (row.get("channel") or "").strip()
+        output_dir = os.path.dirname(row["output"])
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+
+        with FITSPlotter(
+            image_fits=row["image"],
+            contour_fits=(row.get("contour") or "").strip() or None,
+            moment=(row.get("moment") or "").strip() or None,
+            region_label=(row.get("label") or "").strip() or None,
+            lazy=lazy or bool(channel),
+            channel=int(channel) if channel else 0,
+        ) as plotter:
+            template = _get_template()
+            template.update(plotter, title=row.get("title") or "")
+            template.savefig(row["output"])
+    except Exception as error:
+        result["ok"] = False
+        result["error"] = f"{type(error).__name__}: {error}"
+        result["traceback"] = traceback.format_exc()
+        # Una figura a medio dibujar no se reutiliza
+        if _template is not None:
+            _template.close()
+    result["time_s"] = time.perf_counter() - start
+    return result
+
+
+def render_batch(rows, workers=None, lazy=False, verbose=True):
+    """
+    Genera en paralelo todas las figuras del manifiesto.
+
+    Parámetros:
+        rows (list): Filas del manifiesto (ver read_manifest).
+        workers (int, opcional): Número de procesos (por defecto, todos los núcleos).
+        lazy (bool, opcional): Usa el modo lazy de FITSPlotter en todas las figuras.
+        verbose (bool, opcional): Imprime el progreso y los tiempos de cada figura.
+
+    Retorna:
+        Lista de resultados (output, ok, error, time_s) en el orden del manifiesto.
+    """
+    workers = workers or os.cpu_count() or 1
+    for var in THREAD_ENV_VARS:
+        os.environ.setdefault(var, "1")
+
+    start = time.perf_counter()
+    results = [None] * len(rows)
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker) as pool:
+        futures = {pool.submit(render_row, row, lazy): i for i, row in enumerate(rows)}
+        for done, future in enumerate(as_completed(futures), start=1):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except Exception as error:  # El proceso murió (p. ej. sin memoria)
+                results[i] = {"output": rows[i]["output"], "ok": False, "time_s": None,
+                              "error": f"{type(error).__name__}: {error}"}
+            if verbose:
+                r = results[i]
+                status = f"{r['time_s']:.2f} s" if r["ok"] else f"ERROR {r['error']}"
+                print(f"[{done}/{len(rows)}] {r['output']} ({status})")
+
+    elapsed = time.perf_counter() - start
+    if verbose:
+        failed = [r for r in results if not r["ok"]]
+        print(f"\nCompletado: {len(rows) - len(failed)} figuras en {elapsed:.1f} s "
+              f"con {workers} procesos ({len(failed)} con error).")
+        for r in failed:
+            print(f"  - {r['output']}: {r['error']}")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Graficado en lote de archivos FITS")
+    parser.add_argument("manifest", help="Archivo CSV con columnas image, contour, moment, label, output")
+    parser.add_argument("--workers", type=int, default=None, help="Número de procesos (por defecto, todos los núcleos)")
+    parser.add_argument("--lazy", action="store_true", help="Usa el modo lazy (memory-mapped) de FITSPlotter")
+    args = parser.parse_args(argv)
+
+    results = render_batch(read_manifest(args.manifest), workers=args.workers, lazy=args.lazy)
+    sys.exit(0 if all(r["ok"] for r in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""
+Beams de imágenes y cubos FITS como arreglos NumPy: el beam del header (BMAJ/BMIN/BPA) o la
+tabla BEAMS que CASA escribe en los cubos con un beam por canal y polarización.
+
+Cada beam se representa también como la matriz 2x2 de su elipse FWHM en coordenadas
+(este, norte), en arcsec^2 (ver beam_matrices). Con esa representación las operaciones sobre
+todos los canales son vectorizadas:
+    - convolucionar dos beams es sumar sus matrices;
+    - un beam A contiene a B (B se puede llevar a A convolucionando) si A - B es semidefinida
+      positiva, es decir si el mayor autovalor generalizado de B respecto de A es <= 1;
+    - el beam común (la elipse de área mínima que contiene a todos los beams) se obtiene
+      con common_beam;
+    - llevar la elipse a píxeles es T @ E @ T.T con T la matriz (este, norte) -> (x, y) del
+      WCS, lo que incluye matrices CD/PC, rotación y píxeles no cuadrados.
+
+Uso:
+    from beams import Beams, beam_pixel_ellipse
+    beams = Beams.read("cubo.fits")                 # tabla BEAMS o BMAJ/BMIN/BPA del header
+    beams.beam(channel=12)                          # {'bmaj': ..., 'bmin': ..., 'bpa': ...}
+    beams.common()                                  # beam común de todos los canales
+    width, height, angle = beam_pixel_ellipse(beams.beam(12), wcs)
+"""
+
+import numpy as np
+import astropy.units as u
+from astropy.io import fits
+from astropy.wcs.utils import proj_plane_pixel_scales
+
+BEAMS_EXTENSION = "BEAMS"
+ENVELOPE_POINTS = 180  # Direcciones en que se muestrea el borde de la unión de los beams
+COMMON_BEAM_TOL = 1e-5  # Tolerancia relativa de contención (y de convergencia de Khachiyan)
+
+
+def beam_matrices(bmaj, bmin, bpa):
+    """
+    Matrices (..., 2, 2) de las elipses FWHM (semiejes bmaj/2 y bmin/2) en coordenadas
+    (este, norte). bmaj y bmin en arcsec, bpa en grados desde el norte hacia el este.
+    """
+    bmaj, bmin, theta = np.broadcast_arrays(np.asarray(bmaj, dtype=float), np.asarray(bmin, dtype=float),
+                                            np.radians(np.asarray(bpa, dtype=float)))
+    major = np.stack([np.sin(theta), np.cos(theta)], axis=-1)
+    minor = np.stack([np.cos(theta), -np.sin(theta)], axis=-1)
+    return ((bmaj / 2)[..., None, None] ** 2 * major[..., :, None] * major[..., None, :]
+            + (bmin / 2)[..., None, None] ** 2 * minor[..., :, None] * minor[..., None, :])
+
+
+def matrix_beams(matrices):
+    """Inversa de beam_matrices: (bmaj, bmin, bpa) de matrices (..., 2, 2) en coordenadas (este, norte)."""
+    a, b, c = matrices[..., 0, 0], matrices[..., 0, 1], matrices[..., 1, 1]
+    mean = (a + c) / 2
+    delta = np.sqrt(((a - c) / 2) ** 2 + b ** 2)
+    bmaj = 2 * np.sqrt(mean + delta)
+    bmin = 2 * np.sqrt(np.maximum(mean - delta, 0.0))
+    bpa = np.degrees(0.5 * np.arctan2(2 * b, c - a))
+    return bmaj, bmin, bpa
+
+
+def max_ratio(outer, inner):
+    """
+    Mayor autovalor generalizado de `inner` respecto de `outer` (matrices (..., 2, 2), con
+    broadcasting): `outer` contiene a `inner` si es <= 1, y escalar `outer` por este valor
+    basta para contenerlo.
+    """
+    det_outer = outer[..., 0, 0] * outer[..., 1, 1] - outer[..., 0, 1] ** 2
+    det_inner = inner[..., 0, 0] * inner[..., 1, 1] - inner[..., 0, 1] ** 2
+    trace = (outer[..., 0, 0] * inner[..., 1, 1] + outer[..., 1, 1] * inner[..., 0, 0]
+             - 2 * outer[..., 0, 1] * inner[..., 0, 1])
+    discriminant = np.maximum(trace ** 2 - 4 * det_outer * det_inner, 0.0)
+    return (trace + np.sqrt(discriminant)) / (2 * det_outer)
+
+
+def _envelope_points(matrices, npoints=ENVELOPE_POINTS):
+    """
+    Borde de la unión de las elipses (n, 2, 2): en cada una de `npoints` direcciones, el punto
+    más lejano de todas ellas (y su opuesto). Vectorizado sobre los beams.
+    """
+    phi = np.linspace(0, np.pi, npoints, endpoint=False)
+    directions = np.stack([np.cos(phi), np.sin(phi)], axis=-1)
+    # Radio de cada elipse en cada dirección: 1 / sqrt(u^T E^-1 u)
+    quadratic = np.einsum("ki,nij,kj->nk", directions, np.linalg.inv(matrices), directions)
+    points = directions / np.sqrt(quadratic.min(axis=0))[:, None]
+    return np.concatenate([points, -points])
+
+
+def _enclosing_ellipse(points, tol=COMMON_BEAM_TOL, max_iter=100000):
+    """
+    Elipse centrada en el origen de área mínima que contiene a `points` (algoritmo de
+    Khachiyan con pasos de alejamiento de Todd y Yildirim, que converge mucho más rápido
+    cuando la solución queda sostenida por pocos puntos). Retorna su matriz 2x2 (borde:
+    p^T E^-1 p = 1).
+    """
+    weights = np.full(len(points), 1.0 / len(points))
+    for _ in range(max_iter):
+        scatter = (points * weights[:, None]).T @ points
+        distances = np.einsum("ni,ij,nj->n", points, np.linalg.inv(scatter), points)
+        j = np.argmax(distances)
+        active = np.flatnonzero(weights > 0)
+        k = active[np.argmin(distances[active])]
+        if distances[j] <= 2 * (1 + tol) and distances[k] >= 2 * (1 - tol):
+            break
+        if distances[j] - 2 >= 2 - distances[k]:
+            # Se acerca al punto más lejano
+            step = (distances[j] - 2) / (2 * (distances[j] - 1))
+            weights *= 1 - step
+            weights[j] += step
+        else:
+            # Se aleja del punto con peso más cercano al centro
+            step = min((2 - distances[k]) / (2 * (distances[k] - 1)), weights[k] / (1 - weights[k]))
+            weights *= 1 + step
+            weights[k] -= step
+            weights[k] = max(weights[k], 0.0)
+    return 2 * scatter
+
+
+def common_beam(bmaj, bmin, bpa):
+    """
+    Beam común: la elipse de área mínima que contiene a todos los beams (todos se pueden
+    llevar a él convolucionando). Vectorizado sobre los canales; los beams no válidos
+    (NaN o cero) se ignoran. Retorna (bmaj, bmin, bpa).
+
+    Si el beam de mayor área contiene a los demás es el beam común; si no, se calcula la
+    elipse mínima que contiene el borde de la unión de los beams (muestreado en
+    ENVELOPE_POINTS direcciones) y se agranda lo justo para que los contenga exactamente.
+    """
+    bmaj, bmin, bpa = (np.ravel(value) for value in np.broadcast_arrays(bmaj, bmin, bpa))
+    valid = np.isfinite(bmaj) & np.isfinite(bmin) & np.isfinite(bpa) & (bmaj > 0) & (bmin > 0)
+    if not valid.any():
+        raise ValueError("No hay beams válidos.")
+    matrices = beam_matrices(bmaj[valid], bmin[valid], bpa[valid])
+
+    largest = matrices[np.argmax(bmaj[valid] * bmin[valid])]
+    outside = max_ratio(largest, matrices) > 1 + COMMON_BEAM_TOL
+    if outside.any():
+        candidates = np.concatenate([largest[None], matrices[outside]])
+        common = _enclosing_ellipse(_envelope_points(candidates))
+        common = common * max(1.0, float(max_ratio(common, matrices).max()))
+    else:
+        common = largest
+    return tuple(float(value) for value in matrix_beams(common))
+
+
+def pixel_scales(wcs):
+    """Tamaño del píxel (arcsec) en x e y del WCS celeste (CDELT, CD o PC; píxeles no cuadrados)."""
+    return proj_plane_pixel_scales(wcs.celestial) * 3600
+
+
+def sky_to_pixel_matrix(wcs):
+    """Matriz 2x2 que lleva desplazamientos (este, norte) en arcsec a desplazamientos (x, y) en píxeles."""
+    celestial = wcs.celestial
+    matrix = celestial.pixel_scale_matrix * 3600  # filas: ejes del mundo en el orden del WCS
+    if celestial.wcs.lng == 1:
+        matrix = matrix[::-1]  # latitud primero: se reordena a (longitud, latitud)
+    return np.linalg.inv(matrix)
+
+
+def beam_pixel_ellipse(beam, wcs):
+    """
+    Elipse del beam en píxeles como (ancho, alto, ángulo) para matplotlib.patches.Ellipse:
+    `ancho` es el eje mayor y `ángulo` su dirección en grados desde el eje x. `beam` es un
+    diccionario {'bmaj', 'bmin', 'bpa'} (arcsec y grados) o una tupla en ese orden.
+    """
+    if isinstance(beam, dict):
+        beam = (beam['bmaj'], beam['bmin'], beam['bpa'])
+    transform = sky_to_pixel_matrix(wcs)
+    eigenvalues, eigenvectors = np.linalg.eigh(transform @ beam_matrices(*beam) @ transform.T)
+    minor, major = 2 * np.sqrt(np.maximum(eigenvalues, 0.0))
+    angle = np.degrees(np.arctan2(eigenvectors[1, 1], eigenvectors[0, 1]))
+    return float(major), float(minor), float(angle)
+
+
+def beam_dict(bmaj, bmin, bpa):
+    """Beam en el formato de FITSPlotter.get_beam_params (arcsec, arcsec, grados)."""
+    return {'bmaj': float(bmaj), 'bmin': float(bmin), 'bpa': float(bpa)}
+
+
+class Beams:
+    def __init__(self, bmaj, bmin, bpa, chan=None, pol=None):
+        """
+        Beams de un cubo, uno por fila (canal y polarización), como arreglos NumPy.
+
+        Parámetros:
+            bmaj, bmin (array): Ejes FWHM en arcsec.
+            bpa (array): Ángulo de posición en grados (del norte hacia el este).
+            chan, pol (array, opcional): Canal y polarización de cada beam (por defecto,
+                un beam por canal en la polarización 0).
+        """
+        self.bmaj = np.atleast_1d(np.asarray(bmaj, dtype=float))
+        self.bmin = np.atleast_1d(np.asarray(bmin, dtype=float))
+        self.bpa = np.atleast_1d(np.asarray(bpa, dtype=float))
+        self.chan = np.arange(len(self.bmaj)) if chan is None else np.atleast_1d(np.asarray(chan, dtype=int))
+        self.pol = np.zeros(len(self.bmaj), dtype=int) if pol is None else np.atleast_1d(np.asarray(pol, dtype=int))
+        self.single = False  # True si es el beam único del header (vale para todos los canales)
+
+    @classmethod
+    def from_header(cls, header):
+        """Beam único del header (BMAJ/BMIN en grados, BPA); None si no está."""
+        if 'BMAJ' not in header or 'BMIN' not in header:
+            return None
+        beams = cls(header['BMAJ'] * 3600, header['BMIN'] * 3600, header.get('BPA', 0.0))
+        beams.single = True
+        return beams
+
+    @classmethod
+    def from_table(cls, hdu):
+        """Tabla BEAMS de CASA (columnas BMAJ, BMIN, BPA, CHAN, POL, con sus unidades)."""
+        columns = hdu.columns
+        data = hdu.data
+
+        def column(name, unit):
+            values = np.asarray(data[name], dtype=float)
+            column_unit = columns[name].unit
+            return values * u.Unit(column_unit).to(unit) if column_unit else values
+
+        names = [name.upper() for name in columns.names]
+        chan = data['CHAN'] if 'CHAN' in names else None
+        pol = data['POL'] if 'POL' in names else None
+        return cls(column('BMAJ', u.arcsec), column('BMIN', u.arcsec), column('BPA', u.deg), chan=chan, pol=pol)
+
+    @classmethod
+    def from_hdul(cls, hdul):
+        """Tabla BEAMS si el archivo la tiene; si no, el beam del header primario (o None)."""
+        for hdu in hdul[1:]:
+            if hdu.name.upper() == BEAMS_EXTENSION and isinstance(hdu, fits.BinTableHDU):
+                return cls.from_table(hdu)
+        return cls.from_header(hdul[0].header)
+
+    @classmethod
+    def read(cls, filename):
+        """Beams de un archivo FITS (ver from_hdul)."""
+        with fits.open(filename, memmap=True, lazy_load_hdus=True) as hdul:
+            return cls.from_hdul(hdul)
+
+    def __len__(self):
+        return len(self.bmaj)
+
+    def select(self, channels=None, stokes=None):
+        """Máscara de los beams de los canales `channels` (todos si es None) y la polarización `stokes`."""
+        if self.single:
+            return np.ones(len(self), dtype=bool)
+        mask = np.ones(len(self), dtype=bool)
+        if channels is not None:
+            mask &= np.isin(self.chan, np.atleast_1d(channels))
+        if stokes is not None:
+            mask &= self.pol == stokes
+        return mask
+
+    def beam(self, channel=0, stokes=0):
+        """Beam de un canal como {'bmaj', 'bmin', 'bpa'}; None si la tabla no lo tiene."""
+        rows = np.flatnonzero(self.select(channel, stokes))
+        if rows.size == 0:
+            return None
+        i = rows[0]
+        return beam_dict(self.bmaj[i], self.bmin[i], self.bpa[i])
+
+    def common(self, channels=None, stokes=None):
+        """Beam común (ver common_beam) de los canales `channels` (todos si es None)."""
+        mask = self.select(channels, stokes)
+        return beam_dict(*common_beam(self.bmaj[mask], self.bmin[mask], self.bpa[mask]))
+
+    def matrices(self):
+        """Matrices (n, 2, 2) de las elipses de todos los beams (ver beam_matrices)."""
+        return beam_matrices(self.bmaj, self.bmin, self.bpa)
+
+    def areas(self):
+        """Área de cada beam en arcsec^2 (pi * bmaj * bmin / (4 ln 2))."""
+        return np.pi * self.bmaj * self.bmin / (4 * np.log(2))
+
+    def is_uniform(self, rtol=1e-6):
+        """True si todos los beams son iguales (dentro de rtol)."""
+        matrices = self.matrices()
+        return bool(np.allclose(matrices, matrices[:1], rtol=rtol, atol=0))
@@ -0,0 +1,1586 @@
+"""
+Benchmarks de rendimiento para fits_plotter.py y contcal.py.
+
+Uso:
+    python benchmarks.py <benchmark> [opciones]
+
+Benchmarks disponibles:
+    lazy:     Compara la carga normal vs. la carga lazy (memory-mapped) de FITSPlotter,
+              midiendo el pico de memoria (RSS) y el tiempo hasta la primera figura.
+    contcal:  Compara el backend NumPy de contcal.py (searchsorted, una pasada) con la
+              suma de N comparaciones (equivalente a immath) y, si casatasks está
+              instalado, con el backend CASA. Verifica que las salidas sean idénticas.
+    batch:    Mide el throughput (figuras/s) de batch_plot.py con 1, 2, 4, ... procesos.
+    reproject: Compara velocidad y exactitud de los métodos de reprojection.py contra el
+              valor analítico de una fuente gaussiana sin ruido (incluye el caso en caché
+              de los métodos "pixelmap").
+    tiles:    Reproyecta un mosaico de --size px a una grilla del mismo tamaño en una pasada
+              vs. por bloques (reprojection.reproject_tiled) en 1, 2, 4, ... hilos y en
+              procesos, con la entrada y la salida memory-mapped. Mide tiempo y pico de RSS y
+              la diferencia máxima con la reproyección en una pasada.
+    pyramid:  Construye la pirámide de teselas (pyramid.py) de un mapa de --size px con
+              contornos en PNG, WebP y Zarr: tiempo, pico de RSS, archivos y tamaño en disco,
+              y el tiempo de cargar una vista de 1024x768 px a resolución completa y en el
+              nivel más reducido, frente a un render completo con export().
+    beams:    Lee tablas BEAMS de --nchan, 10x y 100x canales (beams.py) como arreglos vs.
+              fila por fila, y calcula el beam común de todos los canales; verifica que el
+              beam común contenga a todos los beams.
+    smooth:   Convoluciona un mapa de --size px del beam 1"x0.7" a 2"x1.5" por FFT (smoothing.py)
+              con 1, 2, 4, ... hilos, un cubo de --nchan canales por bloques, y como referencia
+              astropy.convolution.convolve_fft y, si casatasks está instalado, imsmooth de CASA.
+              Mide tiempo y pico de RSS y la diferencia máxima (relativa al pico) con smoothing.py.
+    stats:    Estadísticas de un mapa de --size px (mínimo, máximo, RMS, NaN y percentiles):
+              nanmin/nanmax/nanpercentile sobre el plano completo vs. una pasada por bloques
+              (streaming_stats.py) y la lectura desde StatsCache. Mide tiempo, pico de RSS y el
+              error relativo de los percentiles. Verifica que, con el backend dask, StatsCache y
+              ReprojectionCache no devuelvan a un canal de un cubo los resultados de otro.
+    moments:  Calcula m0/m1/m2 por bloques (moments.py) sobre cubos de tamaño creciente y
+              muestra que el pico de RSS no crece con el número de canales.
+    noise:    Tiempo y exactitud de los estimadores de ruido de noise.py sobre un mapa
+              memory-mapped con una fuente extensa (ruido verdadero conocido).
+    lod:      Tiempo de render y pico de RSS de FITSPlotter.plot a resolución completa
+              vs. con downsample='auto' (promedio por bloques antes de imshow/contour).
+    cutout:   Tiempo de carga + reproyección de FITSPlotter con recortes de tamaño
+              creciente vs. la imagen completa.
+    export:   Tiempo por figura y crecimiento de memoria al exportar N figuras con
+              plot() (figura nueva cada vez), con FITSPlotter.export y con una
+              FigureTemplate reutilizada (export.py).
+    grid:     Mapa de canales de --nchan paneles con GridPlotter (cubo abierto una vez,
+              lectura en hilos, contornos reproyectados una vez) vs. un FITSPlotter
+              por panel.
+    index:    Indexa --nfiles archivos con fits_index.py, re-escanea sin cambios y compara
+              una búsqueda por posición en el índice con abrir todos los headers.
+    catalog:  Tiempo de superposición de catálogos de 10^2 a 10^5 objetos (catalog.py)
+              vs. un SkyCoord/scatter/annotate por objeto (como la estrella UC1).
+    contours: Redibuja --nfiles veces los contornos de un mapa: ax.contour sobre la grilla
+              reproyectada en cada figura vs. polilíneas trazadas una vez (contour_lines.py),
+              y la lectura desde la caché en disco.
+    levels:   Umbraliza un mapa con 7 niveles: mapa de índice de nivel, máscaras por nivel y
+              estadísticas (área, flujo, pico, centroide) en una pasada por bloques
+              (contour_engine.contour_products) vs. imagen completa en memoria y una
+              pasada por nivel. Mide tiempo y pico de RSS.
+    server:   Secuencia de ajustes (sigma, niveles, momento, colormap) sobre un mismo par
+              imagen/contornos: FITSPlotter nuevo por ajuste (como cada celda del notebook)
+              vs. el servidor de render persistente (render_server.py).
+    redraw:   Ajustes sucesivos (título, colormap, etiqueta, momento, niveles, sigma) de una
+              misma figura: draw() completo en una figura nueva vs. el redibujo incremental
+              de una FigureTemplate, que solo rehace lo que cambió. Verifica que el PNG sea idéntico.
+    dask:     Estadísticas, mapa de niveles y promedio por bloques (downsample) de un mosaico
+              con el backend NumPy vs. dask_backend.py con 1, 2, 4, ... hilos y con procesos.
+              Verifica que los resultados sean idénticos y mide tiempo y pico de RSS.
+    suite:    Suite reproducible del flujo completo sobre imágenes sintéticas de --sizes px
+              (512,2048,8192 por defecto) con contornos a la mitad de resolución, y un cubo de
+              (--size/4)^2 x --nchan canales. La reproyección a 8192² necesita ~6 GB de RAM y a
+              16384² ~24 GB; si un caso muere por falta de memoria se registra y se sigue. Mide por etapa
+              (profiling.py) la construcción de FITSPlotter (fits.open, WCS, reproyección,
+              sigma), los niveles de contcal y la exportación (render, contornos, savefig),
+              con tiempo, CPU y pico de RSS. Guarda los resultados en JSON con el commit y
+              las versiones de las dependencias; --baseline compara con una corrida anterior.
+    compare:  Compara dos corridas guardadas de la suite (--baseline y --results) y marca
+              las etapas más de un 10% más lentas o con más memoria.
+
+Cada caso se ejecuta en un proceso independiente para que el pico de RSS medido
+corresponda solo a ese caso.
+
+Ejemplos de uso:
+    python benchmarks.py lazy
+    python benchmarks.py lazy --nchan 64 --size 4096
+    python benchmarks.py contcal --size 4096
+    python benchmarks.py batch --size 1024 --nfiles 64
+    python benchmarks.py reproject --size 2048
+    python benchmarks.py tiles --size 10240
+    python benchmarks.py pyramid --size 16384
+    python benchmarks.py beams --nchan 100
+    python benchmarks.py smooth --size 4096
+    python benchmarks.py stats --size 16384
+    python benchmarks.py moments --size 2048 --nchan 256
+    python benchmarks.py noise --size 16384
+    python benchmarks.py lod --size 8192
+    python benchmarks.py cutout --size 8192
+    python benchmarks.py export --size 1024 --nfiles 100
+    python benchmarks.py grid --size 1024 --nchan 25
+    python benchmarks.py index --size 256 --nfiles 500
+    python benchmarks.py catalog --size 1024
+    python benchmarks.py contours --size 2048 --nfiles 10
+    python benchmarks.py levels --size 8192
+    python benchmarks.py server --size 2048
+    python benchmarks.py redraw --size 4096
+    python benchmarks.py dask --size 8192
+    python benchmarks.py suite
+    python benchmarks.py suite --sizes 512,2048,8192,16384 --nchan 256 --baseline benchmark_results/v1.json
+    python benchmarks.py compare --baseline benchmark_results/v1.json --results benchmark_results/v2.json
+"""
+
+import os
+import sys
+import time
+import json
+import hashlib
+import argparse
+import resource
+import tempfile
+import importlib.util
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+from astropy.io import fits
+
+
+def synthetic_header(nx, ny, nchan=1, nstokes=1, bmaj_arcsec=1.0, bmin_arcsec=0.7, bpa=30.0,
+                     cdelt_arcsec=0.1, ra=275.1034, dec=-16.1930):
+    """
+    Construye un header FITS realista (RA/DEC SIN + FREQ + STOKES, orden CASA) con beam.
+    """
+    header = fits.Header()
+    header["SIMPLE"] = True
+    header["BITPIX"] = -32
+    header["NAXIS"] = 4
+    header["NAXIS1"] = nx
+    header["NAXIS2"] = ny
+    header["NAXIS3"] = nchan
+    header["NAXIS4"] = nstokes
+    header["CTYPE1"] = "RA---SIN"
+    header["CRVAL1"] = ra
+    header["CDELT1"] = -cdelt_arcsec / 3600
+    header["CRPIX1"] = nx / 2 + 1
+    header["CUNIT1"] = "deg"
+    header["CTYPE2"] = "DEC--SIN"
+    header["CRVAL2"] = dec
+    header["CDELT2"] = cdelt_arcsec / 3600
+    header["CRPIX2"] = ny / 2 + 1
+    header["CUNIT2"] = "deg"
+    header["CTYPE3"] = "FREQ"
+    header["CRVAL3"] = 2.30538e11
+    header["CDELT3"] = 2.44e5
+    header["CRPIX3"] = 1.0
+    header["CUNIT3"] = "Hz"
+    header["RESTFRQ"] = 2.30538e11  # CO (2-1)
+    header["CTYPE4"] = "STOKES"
+    header["CRVAL4"] = 1.0
+    header["CDELT4"] = 1.0
+    header["CRPIX4"] = 1.0
+    header["BMAJ"] = bmaj_arcsec / 3600
+    header["BMIN"] = bmin_arcsec / 3600
+    header["BPA"] = bpa
+    header["BUNIT"] = "Jy/beam"
+    header["RADESYS"] = "ICRS"
+    header["EQUINOX"] = 2000.0
+    return header
+
+
+def write_synthetic_cube(filename, nx, ny, nchan=1, nstokes=1, noise=1e-3, seed=0, **header_kw):
+    """
+    Escribe un cubo sintético (ruido gaussiano + fuente gaussiana) por franjas de filas,
+    usando StreamingHDU para no tener nunca el cubo (ni un plano completo) en memoria.
+    """
+    rng = np.random.default_rng(seed)
+    header = synthetic_header(nx, ny, nchan=nchan, nstokes=nstokes, **header_kw)
+    # Fuente gaussiana circular: separable en un perfil por filas y otro por columnas
+    width = 2 * (nx / 20) ** 2
+    profile_y = np.exp(-((np.arange(ny) - ny / 2) ** 2) / width)[:, None]
+    profile_x = np.exp(-((np.arange(nx) - nx / 2) ** 2) / width)[None, :]
+    rows = max(1, (16 * 1024 ** 2) // (nx * 8))
+
+    stream = fits.StreamingHDU(filename, header)
+    for _ in range(nstokes):
+        for chan in range(nchan):
+            amplitude = np.exp(-((chan - nchan / 2) ** 2) / (2 * max(nchan / 8, 1) ** 2))
+            for y0 in range(0, ny, rows):
+                y1 = min(ny, y0 + rows)
+                band = amplitude * (profile_y[y0:y1] * profile_x) + rng.normal(0.0, noise, size=(y1 - y0, nx))
+                stream.write(band.astype(">f4"))
+    stream.close()
+    return filename
+
+
+def peak_rss_mb():
+    """Pico de memoria residente (RSS) del proceso actual, en MB."""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reporta KB, macOS reporta bytes
+    return maxrss / 1024 if sys.platform != "darwin" else maxrss / 1024 ** 2
+
+
+def run_isolated(func, *args, **kwargs):
+    """
+    Ejecuta `func(*args, **kwargs)` en un proceso nuevo (spawn) y retorna su resultado.
+    Si el proceso muere (p. ej. por falta de memoria) se lanza BrokenProcessPool en vez de
+    esperar indefinidamente; el proceso puede a su vez crear procesos (dask "processes").
+    """
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(func, *args, **kwargs).result()
+
+
+def _first_plot(image_fits, contour_fits, lazy, output):
+    """Construye un FITSPlotter y genera/guarda la primera figura (backend Agg)."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from fits_plotter import FITSPlotter
+
+    start = time.perf_counter()
+    plotter = FITSPlotter(image_fits, contour_fits, moment="m0", lazy=lazy)
+    t_load = time.perf_counter() - start
+    plotter.plot(save_as=output)
+    t_total = time.perf_counter() - start
+    plotter.close()
+    plt.close("all")
+    return {"lazy": lazy, "t_load_s": t_load, "t_first_plot_s": t_total, "peak_rss_mb": peak_rss_mb()}
+
+
+def bench_lazy(args):
+    """Benchmark de carga normal vs. lazy sobre cubos sintéticos grandes."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        image = os.path.join(tmpdir, "cubo_base.fits")
+        contour = os.path.join(tmpdir, "cubo_contornos.fits")
+        print(f"Generando cubos sintéticos {args.nstokes}x{args.nchan}x{args.size}x{args.size} ...")
+        write_synthetic_cube(image, args.size, args.size, nchan=args.nchan, nstokes=args.nstokes)
+        write_synthetic_cube(contour, args.size, args.size, nchan=args.nchan, nstokes=args.nstokes,
+                             seed=1, cdelt_arcsec=0.12)
+        size_mb = os.path.getsize(image) / 1024 ** 2
+        print(f"Tamaño de cada cubo: {size_mb:.1f} MB", '\n')
+
+        results = []
+        for lazy in (False, True):
+            if not lazy and args.nchan * args.nstokes > 1:
+                # El modo normal no puede graficar cubos (squeeze deja un arreglo 3-D):
+                # se mide solo la carga completa en memoria.
+                result = run_isolated(_full_load, image, contour)
+            else:
+                result = run_isolated(_first_plot, image, contour, lazy,
+                                      os.path.join(tmpdir, "figura.png"))
+            results.append(result)
+
+    print(f"{'modo':<8} {'carga (s)':>10} {'1a figura (s)':>14} {'pico RSS (MB)':>14}")
+    for r in results:
+        t_plot = f"{r['t_first_plot_s']:.2f}" if r['t_first_plot_s'] is not None else "-"
+        print(f"{'lazy' if r['lazy'] else 'normal':<8} {r['t_load_s']:>10.2f} {t_plot:>14} "
+              f"{r['peak_rss_mb']:>14.1f}")
+    return results
+
+
+def _full_load(image_fits, contour_fits):
+    """Carga completa de ambos cubos como lo hace el modo normal de FITSPlotter."""
+    # Se importan las mismas librerías que en _first_plot para que el RSS sea comparable
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot  # noqa: F401
+    import reproject  # noqa: F401
+
+    start = time.perf_counter()
+    with fits.open(image_fits) as hdul_base, fits.open(contour_fits) as hdul_contour:
+        data_base = np.array(hdul_base[0].data.squeeze())
+        data_contour = np.array(hdul_contour[0].data.squeeze())
+        np.nanmin(data_contour), np.nanmax(data_contour), data_base.sum()
+    t_load = time.perf_counter() - start
+    return {"lazy": False, "t_load_s": t_load, "t_first_plot_s": None, "peak_rss_mb": peak_rss_mb()}
+
+
+def bench_contcal(args):
+    """Benchmark del cálculo de contornos de contcal.py (NumPy vs. N pasadas vs. CASA)."""
+    from contour_engine import make_contour_fits, level_count_map
+
+    multipliers = "-3,3,5,10,20,40,80"
+    with tempfile.TemporaryDirectory() as tmpdir:
+        image = os.path.join(tmpdir, "mapa_m0.fits")
+        write_synthetic_cube(image, args.size, args.size)
+        print(f"Mapa sintético {args.size}x{args.size}", '\n')
+        results = {}
+
+        start = time.perf_counter()
+        output_numpy = os.path.join(tmpdir, "contornos_numpy.fits")
+        levels = make_contour_fits(image, 0, "sigma", "auto", multipliers, output_numpy)
+        results["numpy (searchsorted)"] = time.perf_counter() - start
+        counts_numpy = fits.getdata(output_numpy)
+
+        # Referencia: una comparación completa por nivel, como la expresión iif de immath
+        start = time.perf_counter()
+        data = fits.getdata(image)
+        counts_naive = sum((data > level).astype(np.float32) for level in levels)
+        results["numpy (N pasadas)"] = time.perf_counter() - start
+        identical = np.array_equal(counts_numpy, counts_naive)
+        print(f"searchsorted vs. N pasadas idénticos: {identical}")
+        assert np.array_equal(level_count_map(data, levels), counts_naive)
+
+        try:
+            import casatasks  # noqa: F401
+        except ImportError:
+            print("casatasks no está instalado: se omite el backend CASA.")
+        else:
+            from contcal import run_casa
+            cwd = os.getcwd()
+            os.chdir(tmpdir)
+            try:
+                start = time.perf_counter()
+                run_casa(image, 0, "sigma", "auto", multipliers, "contornos_casa.fits")
+                results["casa"] = time.perf_counter() - start
+                counts_casa = fits.getdata("contornos_casa.fits")
+            finally:
+                os.chdir(cwd)
+            identical = np.array_equal(counts_numpy, counts_casa, equal_nan=True)
+            print(f"NumPy vs. CASA idénticos: {identical}")
+
+    print()
+    print(f"{'backend':<22} {'tiempo (s)':>10}")
+    for name, elapsed in results.items():
+        print(f"{name:<22} {elapsed:>10.3f}")
+    return results
+
+
+def bench_batch(args):
+    """Benchmark de escalabilidad del graficado en lote con el número de procesos."""
+    from batch_plot import render_batch
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        image = os.path.join(tmpdir, "mapa_m0.fits")
+        contour = os.path.join(tmpdir, "contornos_m0.fits")
+        write_synthetic_cube(image, args.size, args.size)
+        write_synthetic_cube(contour, args.size, args.size, seed=1, cdelt_arcsec=0.12)
+        rows = [{"image": image, "contour": contour, "moment": "m0", "label": f"Fuente {i}",
+                 "output": os.path.join(tmpdir, f"figura_{i}.png")} for i in range(args.nfiles)]
+
+        cpus = os.cpu_count() or 1
+        worker_counts = sorted({w for w in (1, 2, 4, 8, 16, 32, cpus) if w <= cpus})
+        results = []
+        for workers in worker_counts:
+            start = time.perf_counter()
+            render_batch(rows, workers=workers, verbose=False)
+            elapsed = time.perf_counter() - start
+            results.append({"workers": workers, "time_s": elapsed, "files_per_s": args.nfiles / elapsed})
+
+    base = results[0]["files_per_s"]
+    print(f"{'procesos':>8} {'tiempo (s)':>10} {'figuras/s':>10} {'speedup':>8}")
+    for r in results:
+        print(f"{r['workers']:>8} {r['time_s']:>10.2f} {r['files_per_s']:>10.2f} {r['files_per_s'] / base:>8.2f}")
+    return results
+
+
+def bench_reproject(args):
+    """Benchmark velocidad vs. exactitud de los métodos de reproyección."""
+    from astropy.wcs import WCS
+    from astropy.wcs.utils import pixel_to_pixel
+    from reprojection import METHODS, reproject_array, clear_pixel_maps
+
+    n_out = args.size
+    n_in = int(args.size * 0.8)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        base = os.path.join(tmpdir, "base.fits")
+        contour = os.path.join(tmpdir, "contornos.fits")
+        write_synthetic_cube(base, n_out, n_out, noise=0.0)
+        write_synthetic_cube(contour, n_in, n_in, noise=0.0, cdelt_arcsec=0.125, ra=275.10345)
+        data = fits.getdata(contour).squeeze().astype(np.float64)
+        wcs_in = WCS(fits.getheader(contour), naxis=2)
+        wcs_out = WCS(fits.getheader(base), naxis=2)
+
+    # Valor verdadero: la misma gaussiana de write_synthetic_cube evaluada en las coordenadas
+    # de entrada que corresponden a cada píxel de salida
+    yy, xx = np.mgrid[0:n_out, 0:n_out]
+    x_in, y_in = pixel_to_pixel(wcs_out, wcs_in, xx, yy)
+    amplitude = np.exp(-0.5 ** 2 / 2)  # Amplitud del único canal (chan=0, nchan=1)
+    truth = amplitude * np.exp(-((x_in - n_in / 2) ** 2 + (y_in - n_in / 2) ** 2) / (2 * (n_in / 20) ** 2))
+    del xx, yy
+
+    results = []
+    cases = [(method, False) for method in METHODS]
+    cases += [("pixelmap", True), ("pixelmap-nearest", True)]
+    for method, warm in cases:
+        if not warm:
+            clear_pixel_maps()
+        start = time.perf_counter()
+        reprojected, _ = reproject_array(data, wcs_in, wcs_out, (n_out, n_out), method=method)
+        elapsed = time.perf_counter() - start
+        valid = np.isfinite(reprojected) & np.isfinite(truth)
+        error = np.abs(reprojected[valid] - truth[valid]) / amplitude
+        results.append({"method": method + (" (en caché)" if warm else ""), "time_s": elapsed,
+                        "rms_rel_error": float(np.sqrt(np.mean(error ** 2))),
+                        "max_rel_error": float(error.max())})
+
+    print(f"Reproyección {n_in}x{n_in} -> {n_out}x{n_out}", '\n')
+    print(f"{'método':<28} {'tiempo (s)':>10} {'error rms':>11} {'error máx':>11}")
+    for r in results:
+        print(f"{r['method']:<28} {r['time_s']:>10.3f} {r['rms_rel_error']:>11.2e} {r['max_rel_error']:>11.2e}")
+    return results
+
+
+def _tiles_worker(base, contour, tile_size, workers, executor, output):
+    """Reproyecta los contornos (memory-mapped) a la grilla base, en una pasada o por bloques."""
+    from astropy.wcs import WCS
+    from reprojection import reproject_array
+
+    start = time.perf_counter()
+    header = fits.getheader(base)
+    wcs_out = WCS(header, naxis=2)
+    with fits.open(contour, memmap=True) as hdul:
+        data = hdul[0].data.reshape(hdul[0].data.shape[-2:])
+        wcs_in = WCS(hdul[0].header, naxis=2)
+        reprojected, _ = reproject_array(data, wcs_in, wcs_out, (header["NAXIS2"], header["NAXIS1"]),
+                                         tile_size=tile_size, workers=workers, executor=executor)
+        del data
+    elapsed = time.perf_counter() - start
+    np.save(output, reprojected)
+    return {"time_s": elapsed, "peak_rss_mb": peak_rss_mb()}
+
+
+def bench_tiles(args):
+    """Benchmark de la reproyección por bloques: una pasada vs. bloques en 1, 2, 4, ... hilos y en procesos."""
+    ncpu = os.cpu_count() or 1
+    tile_size = min(2048, max(args.size // 4, 256))
+    cases = [(None, 1, "threads")]
+    workers = 1
+    while workers <= ncpu:
+        cases.append((tile_size, workers, "threads"))
+        workers *= 2
+    cases.append((tile_size, ncpu, "processes"))
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        base = os.path.join(tmpdir, "base.fits")
+        contour = os.path.join(tmpdir, "contornos.fits")
+        run_isolated(write_synthetic_cube, base, args.size, args.size)
+        run_isolated(write_synthetic_cube, contour, args.size, args.size, seed=1, cdelt_arcsec=0.45)
+        for tiles, n, executor in cases:
+            output = os.path.join(tmpdir, f"reproyectado_{tiles}_{n}_{executor}.npy")
+            r = run_isolated(_tiles_worker, base, contour, tiles, n, executor, output)
+            r["tile_size"], r["workers"], r["executor"] = tiles, n, executor
+            # Diferencia máxima con la reproyección en una pasada, por franjas de filas
+            reference = np.load(results[0]["output"] if results else output, mmap_mode="r")
+            reprojected = np.load(output, mmap_mode="r")
+            r["output"], r["max_diff"] = output, 0.0
+            for y0 in range(0, args.size, 1024):
+                a, b = reference[y0:y0 + 1024], reprojected[y0:y0 + 1024]
+                if not np.array_equal(np.isnan(a), np.isnan(b)):
+                    r["max_diff"] = np.inf
+                    break
+                r["max_diff"] = max(r["max_diff"], float(np.nanmax(np.abs(a - b), initial=0.0)))
+            del reference, reprojected
+            results.append(r)
+
+    print(f"Reproyección {args.size}x{args.size} -> {args.size}x{args.size}, bloques de {tile_size} px, "
+          f"{ncpu} núcleos", '\n')
+    print(f"{'modo':<20} {'workers':>7} {'tiempo (s)':>10} {'aceleración':>11} {'pico RSS (MB)':>14} "
+          f"{'dif. máx.':>10}")
+    base_s = results[0]["time_s"]
+    for r in results:
+        mode = "una pasada" if r["tile_size"] is None else f"bloques ({'hilos' if r['executor'] == 'threads' else 'procesos'})"
+        print(f"{mode:<20} {r['workers']:>7} {r['time_s']:>10.2f} {base_s / r['time_s']:>10.2f}x "
+              f"{r['peak_rss_mb']:>14.1f} {r['max_diff']:>10.1e}")
+        del r["output"]
+    return results
+
+
+def _pyramid_worker(image, contour, output, fmt):
+    """Construye la pirámide de teselas de un mapa (lazy, contornos reproyectados por bloques)."""
+    import matplotlib
+    matplotlib.use("Agg")
+    from fits_plotter import FITSPlotter
+
+    start = time.perf_counter()
+    with FITSPlotter(image, contour, moment="m0", sigma=1e-3, lazy=True, reproject_tiles=True) as plotter:
+        metadata = plotter.export_pyramid(output, fmt=fmt, contour_levels=[3, 5, 10])
+    elapsed = time.perf_counter() - start
+    files = [os.path.join(root, name) for root, _, names in os.walk(output) for name in names]
+    return {"time_s": elapsed, "peak_rss_mb": peak_rss_mb(), "levels": len(metadata["levels"]),
+            "files": len(files), "disk_mb": sum(os.path.getsize(f) for f in files) / 1024 ** 2}
+
+
+def _render_worker(image, contour):
+    """Una vista del mapa completo con FITSPlotter.export (downsample='auto'), como referencia."""
+    import matplotlib
+    matplotlib.use("Agg")
+    from fits_plotter import FITSPlotter
+
+    start = time.perf_counter()
+    with FITSPlotter(image, contour, moment="m0", sigma=1e-3, lazy=True, reproject_tiles=True) as plotter:
+        plotter.export("png", contour_levels=[3, 5, 10], downsample="auto", dpi=100)
+    return {"time_s": time.perf_counter() - start, "peak_rss_mb": peak_rss_mb()}
+
+
+def bench_pyramid(args):
+    """Benchmark de la pirámide de teselas: construcción (PNG, WebP, Zarr) y carga de una vista."""
+    from pyramid import FORMATS, read_metadata, read_region
+
+    formats = [fmt for fmt in FORMATS if fmt != "zarr" or importlib.util.find_spec("zarr")]
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        image = os.path.join(tmpdir, "mosaico.fits")
+        contour = os.path.join(tmpdir, "contornos.fits")
+        run_isolated(write_synthetic_cube, image, args.size, args.size)
+        run_isolated(write_synthetic_cube, contour, args.size // 2, args.size // 2, seed=1, cdelt_arcsec=0.2)
+        render = run_isolated(_render_worker, image, contour)
+        for fmt in formats:
+            output = os.path.join(tmpdir, f"piramide_{fmt}")
+            r = run_isolated(_pyramid_worker, image, contour, output, fmt)
+            # Vista de 1024 x 768 px en el centro, a resolución completa y en el nivel más reducido
+            metadata = read_metadata(output)
+            views = []
+            for entry in (metadata["levels"][0], metadata["levels"][-1]):
+                ny, nx = entry["shape"]
+                x0, y0 = max(nx // 2 - 512, 0), max(ny // 2 - 384, 0)
+                start = time.perf_counter()
+                read_region(output, entry["level"], x0, x0 + 1024, y0, y0 + 768)
+                views.append(time.perf_counter() - start)
+            r["fmt"], r["view_full_s"], r["view_top_s"] = fmt, views[0], views[1]
+            results.append(r)
+
+    print(f"Mapa {args.size}x{args.size}, contornos {args.size // 2}x{args.size // 2} (3, 5, 10 sigma)", '\n')
+    print(f"Render completo con export(downsample='auto'): {render['time_s']:.2f} s, "
+          f"pico RSS {render['peak_rss_mb']:.1f} MB", '\n')
+    print(f"{'formato':<8} {'niveles':>7} {'archivos':>9} {'disco (MB)':>11} {'construcción (s)':>17} "
+          f"{'pico RSS (MB)':>14} {'vista x1 (s)':>13} {'vista mín. (s)':>15}")
+    for r in results:
+        print(f"{r['fmt']:<8} {r['levels']:>7} {r['files']:>9} {r['disk_mb']:>11.1f} {r['time_s']:>17.2f} "
+              f"{r['peak_rss_mb']:>14.1f} {r['view_full_s']:>13.3f} {r['view_top_s']:>15.3f}")
+    return {"render": render, "pyramid": results}
+
+
+def _moments_worker(cube, max_chunk_bytes):
+    """Calcula m0/m1/m2 de un cubo y retorna tiempo y pico de RSS del proceso."""
+    from moments import compute_moments
+
+    start = time.perf_counter()
+    compute_moments(cube, moments=(0, 1, 2), clip=3, max_chunk_bytes=max_chunk_bytes)
+    return {"time_s": time.perf_counter() - start, "peak_rss_mb": peak_rss_mb()}
+
+
+def bench_beams(args):
+    """Benchmark de la lectura de tablas BEAMS y del beam común (beams.py)."""
+    from beams import Beams, beam_matrices, max_ratio
+
+    rng = np.random.default_rng(0)
+    results = []
+    for nchan in (args.nchan, 10 * args.nchan, 100 * args.nchan):
+        # Beams que crecen con la frecuencia, con algo de dispersión en forma y orientación
+        bmaj = np.linspace(1.0, 1.3, nchan) * rng.uniform(0.98, 1.02, nchan)
+        bmin = bmaj * rng.uniform(0.6, 0.9, nchan)
+        bpa = rng.uniform(-90, 90, nchan)
+        table = fits.BinTableHDU.from_columns([
+            fits.Column("BMAJ", "E", unit="arcsec", array=bmaj),
+            fits.Column("BMIN", "E", unit="arcsec", array=bmin),
+            fits.Column("BPA", "E", unit="deg", array=bpa),
+            fits.Column("CHAN", "J", array=np.arange(nchan)),
+            fits.Column("POL", "J", array=np.zeros(nchan, dtype=int)),
+        ], name="BEAMS")
+
+        start = time.perf_counter()
+        rows = [{"bmaj": float(row["BMAJ"]), "bmin": float(row["BMIN"]), "bpa": float(row["BPA"])}
+                for row in table.data]
+        loop_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        beams = Beams.from_table(table)
+        table_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        common = beams.common()
+        common_s = time.perf_counter() - start
+
+        target = beam_matrices(common["bmaj"], common["bmin"], common["bpa"])
+        worst = float(max_ratio(target, beams.matrices()).max())
+        results.append({"nchan": nchan, "rows_s": loop_s, "table_s": table_s, "common_s": common_s,
+                        "max_ratio": worst, "rows": len(rows)})
+
+    print(f"{'canales':>8} {'filas (s)':>10} {'tabla (s)':>10} {'común (s)':>10} {'contención':>11}")
+    for r in results:
+        print(f"{r['nchan']:>8} {r['rows_s']:>10.4f} {r['table_s']:>10.4f} {r['common_s']:>10.4f} "
+              f"{r['max_ratio']:>11.6f}")
+    return results
+
+
+SMOOTH_TARGET = (2.0, 1.5, 0.0)  # Beam objetivo del benchmark smooth (arcsec, arcsec, grados)
+
+
+def _smooth_worker(image, output, workers):
+    """Convoluciona `image` al beam SMOOTH_TARGET con smoothing.smooth_cube."""
+    from smoothing import smooth_cube
+
+    start = time.perf_counter()
+    smooth_cube(image, output, target=SMOOTH_TARGET, workers=workers)
+    return {"time_s": time.perf_counter() - start, "peak_rss_mb": peak_rss_mb()}
+
+
+def _astropy_smooth_worker(image, output):
+    """Misma convolución con astropy.convolution.convolve_fft y un núcleo muestreado en una imagen."""
+    from astropy.convolution import convolve_fft, Gaussian2DKernel
+    from astropy.wcs import WCS
+    from beams import Beams, beam_matrices
+    from smoothing import kernel_matrices, pixel_covariances, area_ratios
+
+    start = time.perf_counter()
+    with fits.open(image) as hdul:
+        header = hdul[0].header
+        data = hdul[0].data.reshape(hdul[0].data.shape[-2:]).astype(np.float64)
+    beam = Beams.from_header(header).matrices()[0]
+    covariance = pixel_covariances(kernel_matrices(beam, SMOOTH_TARGET), WCS(header, naxis=2))
+    variances, vectors = np.linalg.eigh(covariance)
+    kernel = Gaussian2DKernel(np.sqrt(variances[1]), np.sqrt(variances[0]),
+                              theta=np.arctan2(vectors[1, 1], vectors[0, 1]))
+    smoothed = convolve_fft(data, kernel, boundary="fill", fill_value=0.0, nan_treatment="fill",
+                            normalize_kernel=True, fft_pad=False, preserve_nan=True, allow_huge=True)
+    smoothed *= area_ratios(beam, SMOOTH_TARGET)
+    elapsed = time.perf_counter() - start
+    np.save(output, smoothed.astype(np.float32))
+    return {"time_s": elapsed, "peak_rss_mb": peak_rss_mb()}
+
+
+def _casa_smooth_worker(image, output, tmpdir):
+    """Misma convolución con importfits + imsmooth (targetres) + exportfits de CASA."""
+    from casatasks import importfits, imsmooth, exportfits
+
+    bmaj, bmin, bpa = SMOOTH_TARGET
+    cwd = os.getcwd()
+    os.chdir(tmpdir)
+    try:
+        start = time.perf_counter()
+        importfits(image, imagename="mapa.im", overwrite=True)
+        imsmooth(imagename="mapa.im", kernel="gauss", major=f"{bmaj}arcsec", minor=f"{bmin}arcsec",
+                 pa=f"{bpa}deg", targetres=True, outfile="suavizado.im", overwrite=True)
+        exportfits(imagename="suavizado.im", fitsimage=output, overwrite=True)
+        elapsed = time.perf_counter() - start
+    finally:
+        os.chdir(cwd)
+    return {"time_s": elapsed, "peak_rss_mb": peak_rss_mb()}
+
+
+def bench_smooth(args):
+    """Benchmark de la convolución a un beam común: FFT (smoothing.py) vs. astropy y CASA imsmooth."""
+    ncpu = os.cpu_count() or 1
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        image = os.path.join(tmpdir, "mapa.fits")
+        cube = os.path.join(tmpdir, "cubo.fits")
+        run_isolated(write_synthetic_cube, image, args.size, args.size)
+        cube_size = max(args.size // 4, 128)
+        run_isolated(write_synthetic_cube, cube, cube_size, cube_size, nchan=args.nchan)
+
+        reference = os.path.join(tmpdir, "suavizado_1.fits")
+        workers = 1
+        while workers <= ncpu:
+            output = os.path.join(tmpdir, f"suavizado_{workers}.fits")
+            r = run_isolated(_smooth_worker, image, output, workers)
+            r["method"], r["workers"], r["output"] = "fft (smoothing.py)", workers, output
+            results.append(r)
+            workers *= 2
+
+        output = os.path.join(tmpdir, "suavizado_astropy.npy")
+        r = run_isolated(_astropy_smooth_worker, image, output)
+        r["method"], r["workers"], r["output"] = "astropy convolve_fft", 1, output
+        results.append(r)
+
+        if importlib.util.find_spec("casatasks") is None:
+            print("casatasks no está instalado: se omite imsmooth de CASA.")
+        else:
+            output = os.path.join(tmpdir, "suavizado_casa.fits")
+            r = run_isolated(_casa_smooth_worker, image, output, tmpdir)
+            r["method"], r["workers"], r["output"] = "casa imsmooth", 1, output
+            results.append(r)
+
+        # Diferencia máxima con smoothing.py (1 hilo), relativa al pico del mapa suavizado
+        expected = fits.getdata(reference).reshape(args.size, args.size)
+        peak = float(np.nanmax(np.abs(expected)))
+        for r in results:
+            output = r.pop("output")
+            data = np.load(output) if output.endswith(".npy") else fits.getdata(output)
+            r["max_diff"] = float(np.nanmax(np.abs(data.reshape(expected.shape) - expected))) / peak
+            del data
+        del expected
+
+        output = os.path.join(tmpdir, "cubo_suavizado.fits")
+        r = run_isolated(_smooth_worker, cube, output, ncpu)
+        r["method"], r["workers"], r["max_diff"] = f"fft cubo {cube_size}px x {args.nchan}", ncpu, None
+        results.append(r)
+
+    print(f"Convolución de {args.size}x{args.size} de 1\"x0.7\" a {SMOOTH_TARGET[0]}\"x{SMOOTH_TARGET[1]}\", "
+          f"{ncpu} núcleos", '\n')
+    print(f"{'método':<26} {'workers':>7} {'tiempo (s)':>10} {'pico RSS (MB)':>14} {'dif. máx.':>10}")
+    for r in results:
+        diff = "-" if r["max_diff"] is None else f"{r['max_diff']:.1e}"
+        print(f"{r['method']:<26} {r['workers']:>7} {r['time_s']:>10.2f} {r['peak_rss_mb']:>14.1f} {diff:>10}")
+    return results
+
+
+STATS_PERCENTILES = (1, 50, 90, 99, 99.9)
+
+
+def _numpy_stats_worker(image):
+    """Estadísticas con NumPy sobre el plano completo (nanmin, nanmax, RMS, nanpercentile)."""
+    start = time.perf_counter()
+    with fits.open(image, memmap=True) as hdul:
+        data = hdul[0].data.reshape(hdul[0].data.shape[-2:])
+        vmin, vmax = float(np.nanmin(data)), float(np.nanmax(data))
+        finite = data[np.isfinite(data)].astype(np.float64)
+        rms = float(np.sqrt(np.mean(finite ** 2)))
+        percentiles = np.percentile(finite, STATS_PERCENTILES)
+        del data, finite
+    return {"time_s": time.perf_counter() - start, "peak_rss_mb": peak_rss_mb(), "min": vmin, "max": vmax,
+            "rms": rms, "percentiles": percentiles.tolist()}
+
+
+def _streaming_stats_worker(image, cache_dir):
+    """Estadísticas en una pasada por bloques (streaming_stats.file_stats), con o sin caché."""
+    from streaming_stats import StatsCache, file_stats
+
+    start = time.perf_counter()
+    stats = file_stats(image, cache=StatsCache(cache_dir) if cache_dir else None)
+    return {"time_s": time.perf_counter() - start, "peak_rss_mb": peak_rss_mb(), "min": stats.min,
+            "max": stats.max, "rms": stats.rms, "percentiles": stats.percentile(STATS_PERCENTILES).tolist()}
+
+
+def _cached_channels_worker(cube, cache_dir, channels):
+    """
+    Niveles y contornos reproyectados de cada canal con el backend dask, con y sin cachés en
+    disco (StatsCache y ReprojectionCache). Retorna los canales cuyo resultado con caché difiere.
+    """
+    from fits_plotter import FITSPlotter
+    from reproject_cache import ReprojectionCache
+    from streaming_stats import StatsCache
+
+    caches = {"stats_cache": StatsCache(os.path.join(cache_dir, "stats")),
+              "reproject_cache": ReprojectionCache(os.path.join(cache_dir, "reproject"))}
+    wrong = []
+    for channel in channels:
+        cached = FITSPlotter(cube, cube, channel=channel, backend="dask", **caches)
+        fresh = FITSPlotter(cube, cube, channel=channel, backend="dask")
+        if not (np.array_equal(cached.get_contour_levels(), fresh.get_contour_levels())
+                and np.array_equal(cached.reprojected_contour, fresh.reprojected_contour, equal_nan=True)):
+            wrong.append(channel)
+    return wrong
+
+
+def bench_stats(args):
+    """Benchmark de las estadísticas de un mapa: NumPy en memoria vs. una pasada por bloques vs. caché."""
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        image = os.path.join(tmpdir, "mapa.fits")
+        cache_dir = os.path.join(tmpdir, "stats")
+        run_isolated(write_synthetic_cube, image, args.size, args.size)
+        cases = [("numpy (plano completo)", _numpy_stats_worker, ()),
+                 ("una pasada por bloques", _streaming_stats_worker, (None,)),
+                 ("una pasada + caché", _streaming_stats_worker, (cache_dir,)),
+                 ("caché (segunda vez)", _streaming_stats_worker, (cache_dir,))]
+        for name, worker, extra in cases:
+            r = run_isolated(worker, image, *extra)
+            r["method"] = name
+            results.append(r)
+
+        # Las cachés se indexan por plano: cada canal de un cubo con dask debe tener sus propias entradas
+        cube = os.path.join(tmpdir, "cubo.fits")
+        run_isolated(write_synthetic_cube, cube, 256, 256, nchan=9)
+        wrong = run_isolated(_cached_channels_worker, cube, os.path.join(tmpdir, "cubo"), [8, 0]) \
+            if importlib.util.find_spec("dask") else None
+
+    reference = results[0]
+    print(f"Mapa {args.size}x{args.size}, percentiles {', '.join(map(str, STATS_PERCENTILES))}", '\n')
+    print(f"{'método':<24} {'tiempo (s)':>10} {'pico RSS (MB)':>14} {'mín/máx/RMS iguales':>20} {'err. percentiles':>16}")
+    for r in results:
+        same = (r["min"] == reference["min"] and r["max"] == reference["max"]
+                and np.isclose(r["rms"], reference["rms"], rtol=1e-9))
+        error = np.max(np.abs(np.subtract(r["percentiles"], reference["percentiles"]))
+                       / np.abs(reference["percentiles"]))
+        print(f"{r['method']:<24} {r['time_s']:>10.3f} {r['peak_rss_mb']:>14.1f} {str(same):>20} {error:>16.1e}")
+    if wrong is None:
+        print("\ndask no está instalado; verificación de las cachés por canal omitida.")
+    else:
+        print(f"\nCanales 8 y 0 de un cubo con dask y cachés: {'correctos' if not wrong else f'INCORRECTOS {wrong}'}")
+        assert not wrong, f"Las cachés devolvieron los resultados de otro canal en los canales {wrong}"
+    return results
+
+
+def bench_moments(args):
+    """Benchmark de memoria acotada del cálculo de momentos por bloques."""
+    max_chunk_bytes = 64 * 1024 ** 2
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for nchan in sorted({max(args.nchan // 4, 1), max(args.nchan // 2, 1), args.nchan}):
+            cube = os.path.join(tmpdir, f"cubo_{nchan}.fits")
+            write_synthetic_cube(cube, args.size, args.size, nchan=nchan)
+            size_mb = os.path.getsize(cube) / 1024 ** 2
+            result = run_isolated(_moments_worker, cube, max_chunk_bytes)
+            result.update({"nchan": nchan, "cube_mb": size_mb})
+            results.append(result)
+            os.remove(cube)
+
+    print(f"Bloques de {max_chunk_bytes / 1024 ** 2:.0f} MB, imagen {args.size}x{args.size}", '\n')
+    print(f"{'canales':>8} {'cubo (MB)':>10} {'tiempo (s)':>10} {'pico RSS (MB)':>14}")
+    for r in results:
+        print(f"{r['nchan']:>8} {r['cube_mb']:>10.1f} {r['time_s']:>10.2f} {r['peak_rss_mb']:>14.1f}")
+    return results
+
+
+def bench_noise(args):
+    """Benchmark de los estimadores de ruido sobre un mapa grande memory-mapped."""
+    from noise import METHODS, estimate_sigma
+
+    true_sigma = 1e-3
+    with tempfile.TemporaryDirectory() as tmpdir:
+        image = os.path.join(tmpdir, "mapa.fits")
+        write_synthetic_cube(image, args.size, args.size, noise=true_sigma)
+        results = []
+        with fits.open(image, memmap=True) as hdul:
+            data = hdul[0].data
+            for method in METHODS:
+                for sampling in ("stride", "random"):
+                    if method == "free" and sampling == "random":
+                        continue
+                    start = time.perf_counter()
+                    sigma = estimate_sigma(data, method=method, sampling=sampling)
+                    results.append({"method": method, "sampling": sampling, "sigma": sigma,
+                                    "time_s": time.perf_counter() - start})
+            del data
+
+    print(f"Mapa {args.size}x{args.size}, sigma verdadero = {true_sigma:.2e}", '\n')
+    print(f"{'método':<8} {'muestreo':<8} {'sigma':>10} {'tiempo (s)':>10}")
+    for r in results:
+        print(f"{r['method']:<8} {r['sampling']:<8} {r['sigma']:>10.3e} {r['time_s']:>10.3f}")
+    return results
+
+
+def _lod_worker(image, downsample, output):
+    """Grafica `image` con contornos sobre sí misma y retorna tiempo y memoria del render."""
+    import tracemalloc
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from fits_plotter import FITSPlotter
+
+    with FITSPlotter(image, image, moment="m0", reproject_method="pixelmap") as plotter:
+        tracemalloc.start()
+        start = time.perf_counter()
+        plotter.plot(save_as=output, downsample=downsample)
+        elapsed = time.perf_counter() - start
+        _, render_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    plt.close("all")
+    return {"downsample": str(downsample), "render_s": elapsed,
+            "peak_rss_mb": peak_rss_mb(), "render_alloc_mb": render_peak / 1024 ** 2}
+
+
+def bench_lod(args):
+    """Benchmark del render a resolución completa vs. con nivel de detalle automático."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        image = os.path.join(tmpdir, "mapa.fits")
+        write_synthetic_cube(image, args.size, args.size)
+        results = [run_isolated(_lod_worker, image, downsample, os.path.join(tmpdir, "figura.png"))
+                   for downsample in (None, "auto")]
+
+    print(f"Mapa {args.size}x{args.size}", '\n')
+    print(f"{'downsample':<11} {'render (s)':>10} {'pico RSS (MB)':>14} {'memoria del render (MB)':>24}")
+    for r in results:
+        print(f"{r['downsample']:<11} {r['render_s']:>10.2f} {r['peak_rss_mb']:>14.1f} {r['render_alloc_mb']:>24.1f}")
+    return results
+
+
+def bench_cutout(args):
+    """Benchmark del costo de carga y reproyección según el tamaño del recorte."""
+    from fits_plotter import FITSPlotter
+
+    cdelt = 0.1  # arcsec/pixel de la imagen base sintética
+    with tempfile.TemporaryDirectory() as tmpdir:
+        image = os.path.join(tmpdir, "base.fits")
+        contour = os.path.join(tmpdir, "contornos.fits")
+        write_synthetic_cube(image, args.size, args.size, cdelt_arcsec=cdelt)
+        write_synthetic_cube(contour, args.size, args.size, seed=1, cdelt_arcsec=cdelt * 1.2)
+        center = (275.1034, -16.1930)
+
+        results = []
+        sizes = [s for s in (128, 512, 2048) if s < args.size] + [None]
+        for size in sizes:
+            kwargs = {} if size is None else {"cutout_center": center, "cutout_size": size * cdelt}
+            start = time.perf_counter()
+            with FITSPlotter(image, contour, lazy=True, **kwargs) as plotter:
+                shape = plotter.data_base.shape
+            results.append({"cutout_px": size, "shape": shape, "time_s": time.perf_counter() - start})
+
+    print(f"{'recorte':>10} {'forma':>14} {'carga+reproy. (s)':>18}")
+    for r in results:
+        label = "completa" if r["cutout_px"] is None else f"{r['cutout_px']} px"
+        print(f"{label:>10} {str(r['shape']):>14} {r['time_s']:>18.2f}")
+    return results
+
+
+def _export_worker(images, mode, tmpdir):
+    """Exporta todas las imágenes con el modo indicado y retorna tiempos y memoria."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from fits_plotter import FITSPlotter
+    from export import FigureTemplate
+
+    plotters = [FITSPlotter(image, image, moment="m0", reproject_method="pixelmap") for image in images]
+    template = FigureTemplate(dpi=300)
+    times, rss = [], []
+    for i, plotter in enumerate(plotters):
+        output = os.path.join(tmpdir, f"{mode}_{i}.png")
+        start = time.perf_counter()
+        if mode == "plot":
+            # Uso tradicional en lote: plot() sin cerrar las figuras
+            plotter.plot(save_as=output)
+        elif mode == "export":
+            with open(output, "wb") as f:
+                f.write(plotter.export("png", dpi=300))
+        else:
+            template.update(plotter, title=f"Figura {i}")
+            template.savefig(output)
+        times.append(time.perf_counter() - start)
+        rss.append(peak_rss_mb())
+    template.close()
+    open_figures = len(plt.get_fignums())
+    for plotter in plotters:
+        plotter.close()
+    # Se descarta la primera figura (construcción de la plantilla / caché de fuentes)
+    return {"mode": mode, "first_s": times[0], "per_image_s": float(np.mean(times[1:])),
+            "rss_growth_mb": rss[-1] - rss[0], "open_figures": open_figures}
+
+
+def bench_export(args):
+    """Benchmark de exportación en lote: figura nueva por imagen vs. plantilla reutilizada."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        images = []
+        for i in range(args.nfiles):
+            image = os.path.join(tmpdir, f"mapa_{i}.fits")
+            write_synthetic_cube(image, args.size, args.size, seed=i)
+            images.append(image)
+        results = [run_isolated(_export_worker, images, mode, tmpdir)
+                   for mode in ("plot", "export", "template")]
+
+    print(f"{args.nfiles} mapas de {args.size}x{args.size}", '\n')
+    print(f"{'modo':<9} {'1a figura (s)':>13} {'por figura (s)':>15} {'crecimiento RSS (MB)':>21} {'figuras abiertas':>17}")
+    for r in results:
+        print(f"{r['mode']:<9} {r['first_s']:>13.3f} {r['per_image_s']:>15.3f} "
+              f"{r['rss_growth_mb']:>21.1f} {r['open_figures']:>17}")
+    return results
+
+
+def _grid_worker(cube, contour, nchan, mode):
+    """Prepara y renderiza un mapa de canales de `nchan` paneles con el modo indicado."""
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from fits_plotter import FITSPlotter, figure_bytes
+    from channel_maps import GridPlotter
+
+    start = time.perf_counter()
+    if mode == "grid":
+        grid = GridPlotter(cube, contour, channels=range(nchan))
+        prepare_s = time.perf_counter() - start
+        figure_bytes(grid.render(dpi=100), dpi=100)
+    else:
+        # Un FITSPlotter por panel: cada uno abre el cubo y reproyecta los contornos
+        plotters = [FITSPlotter(cube, contour, lazy=True, channel=k) for k in range(nchan)]
+        prepare_s = time.perf_counter() - start
+        ncols = int(np.ceil(np.sqrt(nchan)))
+        nrows = int(np.ceil(nchan / ncols))
+        fig = Figure(figsize=(3.0 * ncols + 1.5, 3.0 * nrows + 0.5))
+        FigureCanvasAgg(fig)
+        for k, plotter in enumerate(plotters):
+            ax = fig.add_subplot(nrows, ncols, k + 1, projection=plotter.wcs_base)
+            plotter.draw(ax, title=f"Canal {k}")
+        figure_bytes(fig, dpi=100)
+    return {"mode": mode, "prepare_s": prepare_s, "total_s": time.perf_counter() - start,
+            "peak_rss_mb": peak_rss_mb()}
+
+
+def bench_grid(args):
+    """Benchmark de un mapa de canales: GridPlotter vs. un FITSPlotter por panel."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cube = os.path.join(tmpdir, "cubo.fits")
+        contour = os.path.join(tmpdir, "continuo.fits")
+        write_synthetic_cube(cube, args.size, args.size, nchan=args.nchan)
+        write_synthetic_cube(contour, args.size, args.size, seed=1, cdelt_arcsec=0.12)
+        results = [run_isolated(_grid_worker, cube, contour, args.nchan, mode)
+                   for mode in ("por-panel", "grid")]
+
+    print(f"Cubo {args.size}x{args.size}x{args.nchan} ({args.nchan} paneles)", '\n')
+    print(f"{'modo':<10} {'preparación (s)':>16} {'total (s)':>10} {'pico RSS (MB)':>14}")
+    for r in results:
+        print(f"{r['mode']:<10} {r['prepare_s']:>16.2f} {r['total_s']:>10.2f} {r['peak_rss_mb']:>14.1f}")
+    return results
+
+
+def bench_index(args):
+    """Benchmark del índice de metadatos: escaneo, re-escaneo incremental y búsqueda por posición."""
+    from astropy.wcs import WCS
+    from fits_index import FITSIndex
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        files = []
+        for i in range(args.nfiles):
+            # Campos repartidos en 0.02 grados alrededor de M17
+            ra, dec = 275.1034 + rng.uniform(-0.01, 0.01), -16.1930 + rng.uniform(-0.01, 0.01)
+            filename = os.path.join(tmpdir, f"campo_{i:05d}_m0.fits")
+            write_synthetic_cube(filename, args.size, args.size, seed=i, ra=ra, dec=dec)
+            files.append(filename)
+        position = (275.1034, -16.1930, 30.0)
+
+        with FITSIndex(os.path.join(tmpdir, "indice.sqlite")) as index:
+            start = time.perf_counter()
+            index.scan(tmpdir)
+            scan_s = time.perf_counter() - start
+
+            start = time.perf_counter()
+            index.scan(tmpdir)
+            rescan_s = time.perf_counter() - start
+
+            start = time.perf_counter()
+            found_index = index.query(cone=position)
+            query_s = time.perf_counter() - start
+
+        # Sin índice: abrir cada archivo, construir el WCS y ubicar la posición
+        start = time.perf_counter()
+        found_headers = 0
+        for filename in files:
+            header = fits.getheader(filename)
+            x, y = WCS(header, naxis=2).wcs_world2pix([position[:2]], 0)[0]
+            dx = max(-0.5 - x, 0.0, x - (header["NAXIS1"] - 0.5))
+            dy = max(-0.5 - y, 0.0, y - (header["NAXIS2"] - 0.5))
+            if np.hypot(dx, dy) * abs(header["CDELT2"]) * 3600 <= position[2]:
+                found_headers += 1
+        headers_s = time.perf_counter() - start
+
+    print(f"{args.nfiles} archivos de {args.size}x{args.size}", '\n')
+    print(f"Escaneo inicial:                 {scan_s:8.2f} s")
+    print(f"Re-escaneo sin cambios:          {rescan_s:8.3f} s")
+    print(f"Búsqueda en el índice:           {query_s:8.3f} s ({len(found_index)} archivos)")
+    print(f"Búsqueda abriendo los headers:   {headers_s:8.3f} s ({found_headers} archivos)")
+    return {"scan_s": scan_s, "rescan_s": rescan_s, "query_s": query_s, "headers_s": headers_s}
+
+
+def bench_catalog(args):
+    """Benchmark de la superposición de catálogos: vectorizada vs. un objeto por vez."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import astropy.units as u
+    from astropy.coordinates import SkyCoord
+    from fits_plotter import FITSPlotter, release_figure
+    from catalog import Catalog, overlay_catalog
+
+    rng = np.random.default_rng(0)
+    field = args.size * 0.1 / 3600  # Lado del campo en grados (0.1 arcsec/pixel)
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        image = os.path.join(tmpdir, "mapa.fits")
+        write_synthetic_cube(image, args.size, args.size)
+        with FITSPlotter(image, moment="m0") as plotter:
+            fig = plotter.render(dpi=100)
+            ax = fig.axes[0]
+            for n in (100, 1000, 10000, 100000):
+                # La mitad de los objetos cae fuera del campo
+                ra = 275.1034 + rng.uniform(-field, field, n)
+                dec = -16.1930 + rng.uniform(-field, field, n)
+                catalog = Catalog(SkyCoord(ra * u.deg, dec * u.deg), labels=[f"YSO{i}" for i in range(n)])
+                start = time.perf_counter()
+                artists = overlay_catalog(ax, plotter.wcs_base, plotter.data_base.shape, catalog)
+                vectorized_s = time.perf_counter() - start
+                for artist in artists:
+                    artist.remove()
+
+                # Un objeto por vez (como la estrella UC1), solo hasta 1000 objetos
+                loop_s = None
+                if n <= 1000:
+                    start = time.perf_counter()
+                    loop_artists = []
+                    for i in range(n):
+                        coords = SkyCoord(ra=ra[i] * u.deg, dec=dec[i] * u.deg, frame='icrs')
+                        x_pix, y_pix = plotter.wcs_base.world_to_pixel(coords)
+                        loop_artists.append(ax.scatter(x_pix, y_pix, marker='o', s=30))
+                        loop_artists.append(ax.annotate(f"YSO{i}", (x_pix + 5, y_pix + 5)))
+                    loop_s = time.perf_counter() - start
+                    for artist in loop_artists:
+                        artist.remove()
+                results.append({"n": n, "vectorized_s": vectorized_s, "loop_s": loop_s})
+            release_figure(fig)
+
+    print(f"Mapa {args.size}x{args.size}", '\n')
+    print(f"{'objetos':>8} {'vectorizado (s)':>16} {'objeto por objeto (s)':>22}")
+    for r in results:
+        loop = f"{r['loop_s']:.3f}" if r["loop_s"] is not None else "-"
+        print(f"{r['n']:>8} {r['vectorized_s']:>16.3f} {loop:>22}")
+    return results
+
+
+def bench_contours(args):
+    """Benchmark de contornos: re-trazado con ax.contour vs. polilíneas en caché."""
+    import matplotlib
+    matplotlib.use("Agg")
+    from fits_plotter import FITSPlotter, release_figure
+    from contour_lines import ContourLines, ContourCache
+
+    contour_levels = [3, 5, 10, 20, 50]
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        image = os.path.join(tmpdir, "base.fits")
+        contour = os.path.join(tmpdir, "contornos.fits")
+        write_synthetic_cube(image, args.size, args.size)
+        write_synthetic_cube(contour, args.size, args.size, seed=1, cdelt_arcsec=0.12)
+        for trace_contours in (False, True):
+            with FITSPlotter(image, contour, moment="m0", sigma=1e-3, trace_contours=trace_contours) as plotter:
+                fig = plotter.render(dpi=100)
+                ax = fig.axes[0]
+                artists = plotter.draw(ax, contour_levels=contour_levels)
+                times = []
+                for _ in range(args.nfiles):
+                    start = time.perf_counter()
+                    artists = plotter.draw(ax, contour_levels=contour_levels, artists=artists)
+                    times.append(time.perf_counter() - start)
+                release_figure(fig)
+                results.append({"mode": "polilíneas" if trace_contours else "ax.contour",
+                                "first_s": times[0], "mean_s": float(np.mean(times[1:] or times))})
+
+            if trace_contours:
+                cache = ContourCache(os.path.join(tmpdir, "cache"))
+                levels = plotter.get_contour_levels(contour_levels)
+                start = time.perf_counter()
+                lines = ContourLines.trace(plotter.data_contour, plotter.wcs_contour, levels, cache=cache)
+                trace_s = time.perf_counter() - start
+                start = time.perf_counter()
+                ContourLines.trace(plotter.data_contour, plotter.wcs_contour, levels, cache=cache)
+                cached_s = time.perf_counter() - start
+                nlines = sum(len(level_lines) for level_lines in lines.lines)
+
+    print(f"Mapa {args.size}x{args.size}, {len(contour_levels)} niveles, {args.nfiles} redibujos", '\n')
+    print(f"{'modo':<11} {'primer draw (s)':>16} {'draw siguiente (s)':>19}")
+    for r in results:
+        print(f"{r['mode']:<11} {r['first_s']:>16.3f} {r['mean_s']:>19.3f}")
+    print(f"\nTrazado con contourpy + caché en disco: {trace_s:.3f} s ({nlines} polilíneas); "
+          f"lectura desde la caché: {cached_s:.3f} s")
+    return results
+
+
+def _levels_worker(image, mode, tmpdir):
+    """Mapa de niveles, máscaras y estadísticas por bloques o con la imagen completa en memoria."""
+    from contour_engine import contour_products, level_count_map, image_stats, beam_area_pixels
+
+    multipliers = "-3,3,5,10,20,40,80"
+    start = time.perf_counter()
+    if mode == "bloques":
+        contour_products(image, 0, "sigma", "auto", multipliers, os.path.join(tmpdir, f"{mode}.fits"),
+                         mask_fits=os.path.join(tmpdir, f"{mode}_mascaras.fits"), max_chunk_bytes=64 * 1024 ** 2)
+    else:
+        with fits.open(image) as hdul:
+            header = hdul[0].header
+            data = np.squeeze(hdul[0].data).astype(np.float64)
+        levels = [image_stats(data)["rms"] * float(m) for m in multipliers.split(",")]
+        fits.PrimaryHDU(level_count_map(data, levels)).writeto(os.path.join(tmpdir, f"{mode}.fits"))
+        beam = beam_area_pixels(header)
+        y, x = np.indices(data.shape)
+        masks = []
+        for level in sorted(levels):
+            mask = data > level  # Una pasada completa por nivel
+            values = data[mask]
+            if values.size:
+                _ = (mask.sum() / beam, values.sum() / beam, values.max(),
+                     (values * x[mask]).sum() / values.sum(), (values * y[mask]).sum() / values.sum())
+            masks.append(np.packbits(mask, axis=-1))
+        fits.PrimaryHDU(np.stack(masks)).writeto(os.path.join(tmpdir, f"{mode}_mascaras.fits"))
+    return {"mode": mode, "time_s": time.perf_counter() - start, "peak_rss_mb": peak_rss_mb()}
+
+
+def bench_levels(args):
+    """Benchmark del umbralizado multinivel: una pasada por bloques vs. imagen completa y N pasadas."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        image = os.path.join(tmpdir, "mapa.fits")
+        # Se genera en otro proceso: los procesos hijos heredan el pico de RSS del padre
+        run_isolated(write_synthetic_cube, image, args.size, args.size)
+        results = [run_isolated(_levels_worker, image, mode, tmpdir) for mode in ("bloques", "memoria")]
+
+    size_mb = args.size ** 2 * 4 / 1024 ** 2
+    print(f"Mapa {args.size}x{args.size} ({size_mb:.0f} MB en float32), 7 niveles", '\n')
+    print(f"{'modo':<9} {'tiempo (s)':>10} {'pico RSS (MB)':>14}")
+    for r in results:
+        print(f"{r['mode']:<9} {r['time_s']:>10.2f} {r['peak_rss_mb']:>14.1f}")
+    return results
+
+
+def _server_tweaks():
+    """Secuencia de ajustes interactivos típicos (opciones de la figura)."""
+    return [{"moment": "m0", "sigma": 1e-3, "contour_levels": [3, 5, 10]},
+            {"moment": "m0", "sigma": 2e-3, "contour_levels": [3, 5, 10]},
+            {"moment": "m0", "sigma": "mad", "contour_levels": [3, 5, 10, 20]},
+            {"moment": "m0", "sigma": "mad", "contour_levels": [3, 5, 10, 20], "cmap": "inferno"},
+            {"moment": "m1", "sigma": "mad", "contour_levels": [5, 10], "title": "m1"}]
+
+
+def _cold_worker(image, contour, tweak):
+    """Un ajuste como una celda nueva: importa, abre, reproyecta y renderiza."""
+    start = time.perf_counter()
+    import matplotlib
+    matplotlib.use("Agg")
+    from fits_plotter import FITSPlotter
+    options = dict(tweak)
+    with FITSPlotter(image, contour, moment=options.pop("moment"), sigma=options.pop("sigma"),
+                     cmap=options.pop("cmap", None)) as plotter:
+        plotter.export("png", dpi=100, **options)
+    return time.perf_counter() - start
+
+
+def bench_server(args):
+    """Benchmark del servidor de render: proceso nuevo por ajuste vs. servidor con cachés calientes."""
+    from render_server import RenderClient
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        image = os.path.join(tmpdir, "base.fits")
+        contour = os.path.join(tmpdir, "contornos.fits")
+        write_synthetic_cube(image, args.size, args.size)
+        write_synthetic_cube(contour, args.size // 2, args.size // 2, seed=1, cdelt_arcsec=0.2)
+        cold = [run_isolated(_cold_worker, image, contour, tweak) for tweak in _server_tweaks()]
+
+        warm = []
+        client = RenderClient(os.path.join(tmpdir, "render.sock"))
+        try:
+            start = time.perf_counter()
+            client.ping()
+            startup_s = time.perf_counter() - start
+            for tweak in _server_tweaks():
+                start = time.perf_counter()
+                client.render(image, contour, dpi=100, **tweak)
+                warm.append(time.perf_counter() - start)
+        finally:
+            client.shutdown()
+
+    print(f"Mapa {args.size}x{args.size}, contornos {args.size // 2}x{args.size // 2}, dpi 100", '\n')
+    print(f"{'ajuste':<45} {'celda nueva (s)':>15} {'servidor (s)':>13}")
+    for tweak, cold_s, warm_s in zip(_server_tweaks(), cold, warm):
+        label = ", ".join(f"{k}={v}" for k, v in tweak.items())
+        print(f"{label[:45]:<45} {cold_s:>15.3f} {warm_s:>13.3f}")
+    print(f"\nInicio del servidor: {startup_s:.2f} s")
+    return {"cold_s": cold, "server_s": warm, "startup_s": startup_s}
+
+
+def _redraw_tweaks():
+    """Ajustes sucesivos de una misma figura: estilo, anotaciones, niveles y momento."""
+    return [("inicial", {}, {"contour_levels": [3, 5, 10]}),
+            ("título", {}, {"contour_levels": [3, 5, 10], "title": "Región A"}),
+            ("colormap", {"cmap": "inferno"}, {"contour_levels": [3, 5, 10], "title": "Región A"}),
+            ("etiqueta", {"region_label": "A"}, {"contour_levels": [3, 5, 10], "title": "Región A"}),
+            ("momento (color)", {"moment": "m1"}, {"contour_levels": [3, 5, 10], "title": "Región A"}),
+            ("niveles", {}, {"contour_levels": [5, 10], "title": "Región A"}),
+            ("sigma", {"sigma": 2e-3}, {"contour_levels": [5, 10], "title": "Región A"})]
+
+
+def bench_redraw(args):
+    """Benchmark del redibujo incremental: draw() completo en una figura nueva vs. solo lo que cambió."""
+    import matplotlib
+    matplotlib.use("Agg")
+    from fits_plotter import FITSPlotter
+    from export import FigureTemplate
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        image = os.path.join(tmpdir, "base.fits")
+        contour = os.path.join(tmpdir, "contornos.fits")
+        write_synthetic_cube(image, args.size, args.size)
+        write_synthetic_cube(contour, args.size // 2, args.size // 2, seed=1, cdelt_arcsec=0.2)
+        with FITSPlotter(image, contour, moment="m0", sigma=1e-3) as plotter:
+            template = FigureTemplate(dpi=100)
+            for name, changes, options in _redraw_tweaks():
+                for attribute, value in changes.items():
+                    setattr(plotter, attribute, value)
+                start = time.perf_counter()
+                fresh = FigureTemplate(dpi=100)
+                fresh.update(plotter, downsample="auto", **options)
+                full_s = time.perf_counter() - start
+                start = time.perf_counter()
+                template.update(plotter, downsample="auto", **options)
+                incremental_s = time.perf_counter() - start
+                identical = template.to_bytes() == fresh.to_bytes()
+                fresh.close()
+                rows.append({"tweak": name, "full_s": full_s, "incremental_s": incremental_s,
+                             "identical": identical})
+            template.close()
+
+    print(f"Mapa {args.size}x{args.size}, contornos {args.size // 2}x{args.size // 2}, dpi 100", '\n')
+    print(f"{'ajuste':<18} {'completo (s)':>13} {'incremental (s)':>16} {'PNG idéntico':>13}")
+    for row in rows:
+        print(f"{row['tweak']:<18} {row['full_s']:>13.3f} {row['incremental_s']:>16.3f} "
+              f"{'sí' if row['identical'] else 'NO':>13}")
+    return rows
+
+
+def _dask_worker(image, output, scheduler, workers):
+    """Niveles (3, 5, 10, 20 sigma) y vista reducida x8 de un mapa con NumPy o con dask."""
+    from contour_engine import image_stats, level_count_map, plane_header
+    from downsample import block_average
+    if scheduler != "numpy":
+        import dask_backend
+
+    start = time.perf_counter()
+    if scheduler == "numpy":
+        with fits.open(image) as hdul:
+            header = hdul[0].header
+            data = np.squeeze(hdul[0].data).astype(np.float64)
+        rms = image_stats(data)["rms"]
+        levels = [rms * m for m in (3, 5, 10, 20)]
+        fits.PrimaryHDU(level_count_map(data, levels), plane_header(header, levels)).writeto(output)
+        view = block_average(data, 8)
+    else:
+        header, data = dask_backend.from_fits(image)
+        rms = dask_backend.image_stats(data, scheduler, workers)["rms"]
+        levels = [rms * m for m in (3, 5, 10, 20)]
+        dask_backend.store_fits(dask_backend.level_count_map(data, levels), output, plane_header(header, levels),
+                                scheduler=scheduler, workers=workers)
+        view = dask_backend.compute(dask_backend.block_average(data, 8), scheduler=scheduler, workers=workers)
+    elapsed = time.perf_counter() - start
+    digest = hashlib.sha1()
+    with fits.open(output, memmap=True) as hdul:
+        counts = hdul[0].data.reshape(hdul[0].data.shape[-2:])
+        for y0 in range(0, counts.shape[0], 1024):
+            digest.update(np.ascontiguousarray(counts[y0:y0 + 1024]).tobytes())
+        del counts
+    return {"time_s": elapsed, "peak_rss_mb": peak_rss_mb(), "rms": rms,
+            "view_sum": float(np.nansum(view)), "digest": digest.hexdigest()}
+
+
+def bench_dask(args):
+    """Benchmark del backend dask: NumPy en un núcleo vs. bloques en paralelo (hilos y procesos)."""
+    try:
+        import dask  # noqa: F401
+    except ImportError:
+        print("dask no está instalado; benchmark dask omitido.")
+        return {}
+
+    ncpu = os.cpu_count() or 1
+    cases = [("numpy", None)]
+    workers = 1
+    while workers <= ncpu:
+        cases.append(("threads", workers))
+        workers *= 2
+    cases.append(("processes", ncpu))
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        image = os.path.join(tmpdir, "mosaico.fits")
+        run_isolated(write_synthetic_cube, image, args.size, args.size)
+        for scheduler, n in cases:
+            output = os.path.join(tmpdir, f"niveles_{scheduler}_{n}.fits")
+            r = run_isolated(_dask_worker, image, output, scheduler, n)
+            r["identical"] = all(r[key] == results[0][key] for key in ("digest", "rms", "view_sum")) if results else True
+            r["scheduler"], r["workers"] = scheduler, n
+            results.append(r)
+
+    size_mb = args.size ** 2 * 4 / 1024 ** 2
+    print(f"Mosaico {args.size}x{args.size} ({size_mb:.0f} MB en float32), {ncpu} núcleos", '\n')
+    print(f"{'backend':<10} {'workers':>7} {'tiempo (s)':>10} {'aceleración':>11} {'pico RSS (MB)':>14} {'idéntico':>9}")
+    base = results[0]["time_s"]
+    for r in results:
+        print(f"{r['scheduler']:<10} {str(r['workers'] or 1):>7} {r['time_s']:>10.2f} {base / r['time_s']:>10.2f}x "
+              f"{r['peak_rss_mb']:>14.1f} {'sí' if r['identical'] else 'NO':>9}")
+    return results
+
+
+def run_metadata():
+    """Versión del código y del entorno de una corrida: commit de git, dependencias y máquina."""
+    import platform
+    import subprocess
+    import matplotlib
+    import astropy
+
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    def git(*command):
+        try:
+            return subprocess.run(["git", *command], cwd=here, capture_output=True, text=True,
+                                  timeout=30).stdout.strip() or None
+        except (OSError, subprocess.SubprocessError):
+            return None
+
+    versions = {"python": platform.python_version(), "numpy": np.__version__, "astropy": astropy.__version__,
+                "matplotlib": matplotlib.__version__}
+    for module in ("reproject", "contourpy", "dask"):
+        try:
+            versions[module] = __import__(module).__version__
+        except ImportError:
+            versions[module] = None
+    status = git("status", "--porcelain", "--untracked-files=no")
+    return {"date": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": git("rev-parse", "--short", "HEAD"),
+            "dirty": bool(status), "versions": versions, "machine": platform.platform(),
+            "cpus": os.cpu_count()}
+
+
+def _suite_image_worker(image, contour, output):
+    """Construcción de FITSPlotter, niveles de contcal (sobre los contornos) y exportación a PNG, por etapa."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import profiling
+    from profiling import stage
+    from fits_plotter import FITSPlotter
+    from contour_engine import contour_products
+
+    profiler = profiling.enable("table")
+    with stage("plotter"):
+        plotter = FITSPlotter(image, contour, moment="m0", sigma="mad")
+    with stage("contcal"):
+        contour_products(contour, 0, "sigma", "mad", "3,5,10,20", output, compute_stats=False)
+    with plotter:
+        plotter.export("png", contour_levels=[3, 5, 10, 20], dpi=100, downsample="auto")
+    profiling.disable()
+    return {"stages": profiler.summary(), "peak_rss_mb": peak_rss_mb()}
+
+
+def _suite_cube_worker(cube, nchan):
+    """Momentos de un cubo por bloques y figura lazy de su canal central, por etapa."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import profiling
+    from profiling import stage
+    from fits_plotter import FITSPlotter
+    from moments import compute_moments
+
+    profiler = profiling.enable("table")
+    with stage("moments"):
+        compute_moments(cube, moments=(0, 1, 2), clip=3)
+    with stage("plotter"):
+        plotter = FITSPlotter(cube, cube, moment="continuo", sigma="mad", lazy=True, channel=nchan // 2)
+    with plotter:
+        plotter.export("png", contour_levels=[3, 5, 10, 20], dpi=100, downsample="auto")
+    profiling.disable()
+    return {"stages": profiler.summary(), "peak_rss_mb": peak_rss_mb()}
+
+
+def print_suite(results):
+    """Tabla por caso y etapa de una corrida de la suite."""
+    print(f"{'caso':<22} {'etapa':<34} {'llamadas':>8} {'tiempo (s)':>10} {'CPU (s)':>9} {'pico RSS (MB)':>14}")
+    for case in results["cases"]:
+        if case.get("error"):
+            print(f"{case['case']:<22} {'(' + case['error'] + ')':<34}")
+        for row in case["stages"]:
+            label = "  " * row["depth"] + row["stage"]
+            print(f"{case['case']:<22} {label[:34]:<34} {row['calls']:>8} {row['wall_s']:>10.3f} "
+                  f"{row['cpu_s']:>9.3f} {row['peak_rss_mb']:>14.1f}")
+
+
+def compare_results(baseline, results, threshold=0.10, min_time_s=0.05):
+    """
+    Compara dos corridas de la suite etapa por etapa. Marca como regresión las etapas que
+    tardan (o usan memoria) más de `threshold` por encima de la referencia; las etapas de
+    menos de `min_time_s` no se marcan por tiempo (ruido de medición). Retorna las regresiones.
+    """
+    reference = {(case["case"], row["path"]): row for case in baseline["cases"] for row in case["stages"]}
+    print(f"Referencia: {baseline['meta']['commit']} ({baseline['meta']['date']}); "
+          f"actual: {results['meta']['commit']} ({results['meta']['date']})", '\n')
+    print(f"{'caso':<22} {'etapa':<34} {'ref (s)':>9} {'actual (s)':>10} {'razón':>7} {'RSS ref':>8} "
+          f"{'RSS act':>8}")
+    regressions = []
+    for case in results["cases"]:
+        for row in case["stages"]:
+            old = reference.get((case["case"], row["path"]))
+            if old is None:
+                continue
+            ratio = row["wall_s"] / old["wall_s"] if old["wall_s"] > 0 else float("inf")
+            slower = ratio > 1 + threshold and row["wall_s"] >= min_time_s
+            bigger = row["peak_rss_mb"] > old["peak_rss_mb"] * (1 + threshold)
+            if slower or bigger:
+                regressions.append((case["case"], row["path"], ratio))
+            label = "  " * row["depth"] + row["stage"]
+            flag = " <-- regresión" if slower or bigger else ""
+            print(f"{case['case']:<22} {label[:34]:<34} {old['wall_s']:>9.3f} {row['wall_s']:>10.3f} "
+                  f"{ratio:>6.2f}x {old['peak_rss_mb']:>8.0f} {row['peak_rss_mb']:>8.0f}{flag}")
+    print(f"\n{len(regressions)} etapas con regresión (umbral {threshold:.0%})")
+    return regressions
+
+
+def bench_suite(args):
+    """Suite completa: imágenes de --sizes px y un cubo; guarda los resultados en JSON para comparar versiones."""
+    sizes = [int(size) for size in args.sizes.split(",")]
+    results = {"meta": run_metadata(), "cases": []}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for size in sizes:
+            image = os.path.join(tmpdir, f"imagen_{size}.fits")
+            contour = os.path.join(tmpdir, f"contornos_{size}.fits")
+            # Contornos con la mitad de resolución: la reproyección tiene trabajo real
+            run_isolated(write_synthetic_cube, image, size, size)
+            run_isolated(write_synthetic_cube, contour, size // 2, size // 2, seed=1, cdelt_arcsec=0.2)
+            try:
+                case = run_isolated(_suite_image_worker, image, contour, os.path.join(tmpdir, f"niveles_{size}.fits"))
+            except BrokenProcessPool:
+                # Un caso que no cabe en memoria también es un resultado: se registra y se sigue
+                print(f"Imagen {size}x{size}: el proceso terminó abruptamente (¿memoria insuficiente?)", '\n')
+                case = {"stages": [], "peak_rss_mb": None, "error": "proceso terminado"}
+            case.update({"case": f"imagen {size}x{size}", "size": size})
+            results["cases"].append(case)
+            for filename in os.listdir(tmpdir):
+                os.remove(os.path.join(tmpdir, filename))
+
+        cube = os.path.join(tmpdir, "cubo.fits")
+        run_isolated(write_synthetic_cube, cube, args.size // 4, args.size // 4, args.nchan)
+        try:
+            case = run_isolated(_suite_cube_worker, cube, args.nchan)
+        except BrokenProcessPool:
+            print("Cubo: el proceso terminó abruptamente (¿memoria insuficiente?)", '\n')
+            case = {"stages": [], "peak_rss_mb": None, "error": "proceso terminado"}
+        case.update({"case": f"cubo {args.size // 4}x{args.size // 4}x{args.nchan}", "size": args.size // 4,
+                     "nchan": args.nchan})
+        results["cases"].append(case)
+
+    print_suite(results)
+    output = args.results or os.path.join(
+        "benchmark_results", f"{time.strftime('%Y%m%d-%H%M%S')}_{results['meta']['commit'] or 'sin-git'}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResultados guardados en {output}")
+    if args.baseline:
+        print()
+        with open(args.baseline) as f:
+            compare_results(json.load(f), results)
+    return results
+
+
+def bench_compare(args):
+    """Compara dos corridas guardadas de la suite (--baseline y --results) sin volver a ejecutarla."""
+    if not args.baseline or not args.results:
+        print("Uso: python benchmarks.py compare --baseline <referencia.json> --results <actual.json>")
+        sys.exit(1)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.results) as f:
+        results = json.load(f)
+    return compare_results(baseline, results)
+
+
+BENCHMARKS = {
+    "lazy": bench_lazy,
+    "contcal": bench_contcal,
+    "batch": bench_batch,
+    "reproject": bench_reproject,
+    "tiles": bench_tiles,
+    "pyramid": bench_pyramid,
+    "beams": bench_beams,
+    "smooth": bench_smooth,
+    "stats": bench_stats,
+    "moments": bench_moments,
+    "noise": bench_noise,
+    "lod": bench_lod,
+    "cutout": bench_cutout,
+    "export": bench_export,
+    "grid": bench_grid,
+    "index": bench_index,
+    "catalog": bench_catalog,
+    "contours": bench_contours,
+    "levels": bench_levels,
+    "server": bench_server,
+    "redraw": bench_redraw,
+    "dask": bench_dask,
+    "suite": bench_suite,
+    "compare": bench_compare,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de fits_plotting_tool")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--size", type=int, default=2048, help="Tamaño (px) de cada lado de la imagen")
+    parser.add_argument("--nchan", type=int, default=32, help="Número de canales de los cubos")
+    parser.add_argument("--nstokes", type=int, default=1, help="Número de planos Stokes")
+    parser.add_argument("--nfiles", type=int, default=32, help="Número de figuras (benchmark batch)")
+    parser.add_argument("--sizes", default="512,2048,8192",
+                        help="Lados (px) de las imágenes de la suite, separados por comas")
+    parser.add_argument("--results", help="JSON de resultados de la suite (por defecto, en benchmark_results/)")
+    parser.add_argument("--baseline", help="JSON de una corrida anterior de la suite con la cual comparar")
+    args = parser.parse_args(argv)
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Superposición de catálogos de fuentes (YSOs, máseres, clumps...) sobre las figuras.
+
+Dibujar cada objeto con su propio SkyCoord, world_to_pixel, scatter y annotate (como la
+estrella UC1 de FITSPlotter) es lento con miles de objetos y las etiquetas se apilan.
+Aquí todas las coordenadas se transforman con un solo world_to_pixel vectorizado, se
+descartan los objetos fuera del campo antes de dibujar, los marcadores que caerían en el
+mismo punto de la figura se dibujan una sola vez, todo en una sola colección (scatter), y
+las etiquetas se raleán para que no se superpongan (como máximo `max_labels`).
+
+Uso:
+    from catalog import Catalog
+    ysos = Catalog.read("ysos.csv")                       # CSV, FITS o VOTable
+    masers = Catalog.read("masers.vot", label_col="name")
+    plotter.add_catalog(ysos, marker="o", color="cyan")
+    plotter.add_catalog(masers, marker="x", color="red", max_labels=50)
+    plotter.plot(save_as="mapa.png")
+
+Las columnas de coordenadas se detectan por nombre (ra/dec, RAJ2000/DEJ2000, ...) y
+pueden estar en grados o en sexagesimal ("18h20m24.82s" o "18:20:24.82").
+"""
+
+import numpy as np
+import astropy.units as u
+from astropy.coordinates import SkyCoord
+from astropy.table import Table
+
+RA_COLUMNS = ("ra", "raj2000", "ra_deg", "radeg", "ra_icrs", "_raj2000", "alpha")
+DEC_COLUMNS = ("dec", "dej2000", "decj2000", "dec_deg", "dedeg", "de_icrs", "_dej2000", "delta")
+LABEL_COLUMNS = ("name", "label", "id", "source", "main_id")
+
+DEFAULT_MAX_LABELS = 100
+RASTERIZE_MARKERS = 5000  # Número de marcadores a partir del cual la colección se rasteriza
+
+
+def find_column(table, candidates, required=True):
+    """Primera columna de la tabla cuyo nombre (sin mayúsculas) está en `candidates`."""
+    names = {name.lower(): name for name in table.colnames}
+    for candidate in candidates:
+        if candidate in names:
+            return names[candidate]
+    if required:
+        raise ValueError(f"No se encontró ninguna de las columnas {candidates} en el catálogo "
+                         f"(columnas: {table.colnames}).")
+    return None
+
+
+class Catalog:
+    def __init__(self, coords, labels=None, priority=None, name=None):
+        """
+        Parámetros:
+            coords (SkyCoord): Posiciones de los objetos (un solo SkyCoord vectorial).
+            labels (array, opcional): Etiqueta de cada objeto.
+            priority (array, opcional): Prioridad de las etiquetas (mayor = se etiqueta
+                primero, p. ej. el flujo). Por defecto, el orden del catálogo.
+            name (str, opcional): Nombre del catálogo.
+        """
+        self.coords = coords
+        self.labels = None if labels is None else np.asarray(labels).astype(str)
+        self.priority = None if priority is None else np.asarray(priority, dtype=np.float64)
+        self.name = name
+
+    @classmethod
+    def read(cls, filename, ra_col=None, dec_col=None, label_col=None, priority_col=None,
+             frame="icrs", format=None):
+        """
+        Lee un catálogo CSV, FITS o VOTable (astropy.table.Table.read).
+        Las columnas no indicadas se detectan por nombre; las coordenadas se interpretan
+        en grados si son numéricas y en sexagesimal (horas, grados) si son texto.
+        """
+        table = Table.read(filename, format=format)
+        ra_col = ra_col or find_column(table, RA_COLUMNS)
+        dec_col = dec_col or find_column(table, DEC_COLUMNS)
+        label_col = label_col or find_column(table, LABEL_COLUMNS, required=False)
+        ra, dec = table[ra_col], table[dec_col]
+        if ra.unit is not None and dec.unit is not None:
+            coords = SkyCoord(ra.quantity, dec.quantity, frame=frame)
+        elif np.issubdtype(ra.dtype, np.number):
+            coords = SkyCoord(np.asarray(ra, dtype=np.float64) * u.deg, np.asarray(dec, dtype=np.float64) * u.deg,
+                              frame=frame)
+        else:
+            coords = SkyCoord(np.asarray(ra).astype(str), np.asarray(dec).astype(str),
+                              unit=(u.hourangle, u.deg), frame=frame)
+        labels = table[label_col] if label_col else None
+        priority = table[priority_col] if priority_col else None
+        return cls(coords, labels=labels, priority=priority, name=filename)
+
+    def __len__(self):
+        return len(self.coords)
+
+    def pixels(self, wcs, shape, margin=0.0):
+        """
+        Coordenadas de píxel de todos los objetos (un solo world_to_pixel vectorizado).
+        Retorna (x, y, índices) solo de los objetos dentro del campo (más `margin` píxeles).
+        """
+        x, y = wcs.world_to_pixel(self.coords)
+        x, y = np.atleast_1d(x), np.atleast_1d(y)
+        ny, nx = shape[-2:]
+        inside = ((x >= -0.5 - margin) & (x <= nx - 0.5 + margin) &
+                  (y >= -0.5 - margin) & (y <= ny - 0.5 + margin))
+        indices = np.flatnonzero(inside)
+        return x[indices], y[indices], indices
+
+
+def unique_cells(x, y, cell, order=None):
+    """
+    Índices (en `x`, `y`) del primer punto (según `order`) de cada celda de `cell` x `cell`
+    píxeles. Vectorizado con np.unique.
+    """
+    if order is not None:
+        x, y = x[order], y[order]
+    cells = np.stack([np.floor(x / cell), np.floor(y / cell)], axis=1).astype(np.int64)
+    _, first = np.unique(cells, axis=0, return_index=True)
+    first = np.sort(first)
+    return order[first] if order is not None else first
+
+
+def thin_labels(x, y, width, height, priority=None, max_labels=DEFAULT_MAX_LABELS):
+    """
+    Elige las etiquetas a mostrar para que sus cajas (`width` x `height` píxeles de datos)
+    no se superpongan, de mayor a menor prioridad y como máximo `max_labels`.
+
+    Primero se conserva un candidato por celda del tamaño de una etiqueta (vectorizado);
+    luego se verifica la superposición exacta solo entre esos candidatos.
+    """
+    if len(x) == 0 or max_labels <= 0:
+        return np.array([], dtype=int)
+    order = np.argsort(-priority, kind="stable") if priority is not None else np.arange(len(x))
+    candidates = unique_cells(x, y, max(width, height), order=order)  # En orden de prioridad
+
+    kept = []
+    kept_x, kept_y = np.empty(max_labels), np.empty(max_labels)
+    for i in candidates:
+        n = len(kept)
+        if n and np.any((np.abs(kept_x[:n] - x[i]) < width) & (np.abs(kept_y[:n] - y[i]) < height)):
+            continue
+        kept_x[n], kept_y[n] = x[i], y[i]
+        kept.append(i)
+        if len(kept) == max_labels:
+            break
+    return np.array(kept, dtype=int)
+
+
+def data_pixels_per_point(ax):
+    """Píxeles de datos por punto tipográfico en los ejes (no depende del dpi)."""
+    xlim = ax.get_xlim()
+    width_points = ax.get_position().width * ax.figure.get_figwidth() * 72
+    return abs(xlim[1] - xlim[0]) / max(width_points, 1e-9)
+
+
+def overlay_catalog(ax, wcs, shape, catalog, marker="o", color="cyan", size=30, linewidths=1.0,
+                    labels=True, max_labels=DEFAULT_MAX_LABELS, fontsize=8, zorder=9):
+    """
+    Dibuja un catálogo en `ax` con una sola colección de marcadores y etiquetas raleadas.
+    Retorna la lista de artistas creados (para poder eliminarlos al redibujar).
+    """
+    x, y, indices = catalog.pixels(wcs, shape)
+    if len(indices) == 0:
+        return []
+
+    # Marcadores que caerían a menos de ~1/4 del tamaño del marcador se dibujan una vez
+    scale = data_pixels_per_point(ax)
+    marker_points = np.sqrt(size)
+    keep = unique_cells(x, y, max(marker_points * scale / 4, 1e-9))
+    filled = marker not in ("x", "+", "1", "2", "3", "4", "|", "_")
+    # En PDF/SVG, miles de marcadores se rasterizan para no generar archivos enormes
+    artists = [ax.scatter(x[keep], y[keep], marker=marker, s=size, linewidths=linewidths,
+                          facecolors='none' if filled else color, edgecolors=color, zorder=zorder,
+                          rasterized=len(keep) > RASTERIZE_MARKERS)]
+
+    if labels and catalog.labels is not None:
+        names = catalog.labels[indices]
+        priority = catalog.priority[indices] if catalog.priority is not None else None
+        # Caja aproximada de una etiqueta: ancho medio de los caracteres x alto de la fuente
+        width = (np.char.str_len(names).mean() * 0.6 + 1) * fontsize * scale
+        height = 1.4 * fontsize * scale
+        offset = marker_points / 2 * scale
+        # Solo se etiquetan los objetos cuya etiqueta cabe dentro del campo
+        ny, nx = shape[-2:]
+        fits = np.flatnonzero((x + offset + width <= nx - 0.5) & (y + offset + height <= ny - 0.5))
+        chosen = thin_labels(x[fits], y[fits], width, height,
+                             priority=priority[fits] if priority is not None else None, max_labels=max_labels)
+        for i in fits[chosen]:
+            artists.append(ax.text(x[i] + offset, y[i] + offset, names[i], color=color,
+                                   fontsize=fontsize, zorder=zorder + 1, clip_on=True))
+    return artists
@@ -0,0 +1,356 @@
+"""
+Mapas de canales y mosaicos de varios paneles (p. ej. 25 canales de velocidad o m0/m1/m2).
+
+Con un FITSPlotter por panel se repite en cada panel la apertura del archivo, la
+construcción del WCS, la lectura del beam y la reproyección de los contornos. GridPlotter
+abre el cubo una sola vez (memory-mapped), lee los planos de los paneles en paralelo con
+hilos (la lectura y las reducciones de numpy liberan el GIL), reproyecta los contornos una
+sola vez (todos los paneles comparten la grilla de la imagen base) y dibuja todos los
+paneles en una figura con una escala de color común, un solo colorbar y un solo beam (o el
+beam de cada canal, si el cubo trae una tabla BEAMS con beams distintos por canal).
+
+Uso:
+    from channel_maps import GridPlotter
+    # Mapa de canales: 25 canales de un cubo con los contornos del continuo
+    grid = GridPlotter("cubo.fits", "continuo.fits", channels=range(10, 35), sigma="mad")
+    grid.plot(save_as="canales.png", contour_levels=[3, 5, 10])
+
+    # Tríptico m0/m1/m2 (misma grilla), cada panel con su propia escala de color
+    grid = GridPlotter(["m0.fits", "m1.fits", "m2.fits"], moment=["m0", "m1", "m2"],
+                       common_scale=False, ncols=3)
+    png = grid.export("png")
+
+La comparación con un FITSPlotter por panel se obtiene con `python benchmarks.py grid`.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from astropy.io import fits
+from astropy.wcs import WCS
+
+from fits_plotter import FITSPlotter, MOMENT_LABELS, read_plane
+from noise import estimate_sigma
+from catalog import overlay_catalog
+from downsample import auto_factor, block_average, block_extent, block_centers
+from profiling import stage
+from beams import Beams, pixel_scales, common_beam, beam_dict, beam_matrices
+
+# Tamaño (pulgadas) de cada panel en la figura
+PANEL_SIZE = 3.0
+
+
+class GridPlotter(FITSPlotter):
+    def __init__(self, image_fits, contour_fits=None, channels=None, sigma=3e-3, moment=None,
+                 stokes=0, labels=None, ncols=None, common_scale=True, workers=None,
+                 reproject_cache=None, reproject_method="interp", reproject_tiles=None, smooth=None):
+        """
+        Parámetros:
+            image_fits (str o list): Cubo del que se grafican los canales `channels`, o lista
+                de archivos (uno por panel, todos con la misma grilla que el primero).
+            contour_fits (str, opcional): Imagen de contornos, común a todos los paneles.
+            channels (iterable, opcional): Canales del cubo a graficar (por defecto, todos).
+            sigma (float o str, opcional): Ruido de los contornos, o un estimador de noise.py.
+            moment (str o list, opcional): Tipo de momento, común o uno por panel.
+            stokes (int, opcional): Plano Stokes a leer.
+            labels (list, opcional): Etiqueta de cada panel (por defecto la velocidad del
+                canal, o el nombre del archivo).
+            ncols (int, opcional): Número de columnas del mosaico.
+            common_scale (bool, opcional): Usa la misma escala de color (y un solo colorbar)
+                en todos los paneles.
+            workers (int, opcional): Número de hilos para leer los paneles.
+            reproject_cache, reproject_method, reproject_tiles: Como en FITSPlotter (los bloques
+                se reproyectan en `workers` hilos).
+            smooth (bool, dict o tuple, opcional): Convoluciona cada panel (con su beam) y los
+                contornos a una resolución común antes de reproyectar (ver FITSPlotter); con
+                True, al beam común de los paneles y los contornos.
+        """
+        files = [image_fits] if isinstance(image_fits, str) else list(image_fits)
+        moments = list(moment) if isinstance(moment, (list, tuple)) else None
+        self.configure(files[0], contour_fits=contour_fits, sigma=sigma, moment=moments[0] if moments else moment,
+                       lazy=True, stokes=stokes, reproject_cache=reproject_cache, reproject_method=reproject_method,
+                       workers=workers or min(32, os.cpu_count() or 1), reproject_tiles=reproject_tiles,
+                       smooth=smooth)
+        self.moments = moments
+        self.common_scale = common_scale
+        self.ncols = ncols
+
+        # Paneles: un canal del cubo por panel, o un archivo por panel
+        with fits.open(self.image_fits, memmap=True, lazy_load_hdus=True) as hdul:
+            self.header_base = hdul[0].header.copy()
+            if len(files) == 1:
+                if channels is None:
+                    channels = range(self.cube_nchan(self.header_base))
+                self.channels = [int(k) for k in channels]
+                planes = self.map(lambda k: self.read_panel(hdul[0], k), self.channels)
+            else:
+                self.channels = [0] * len(files)
+                planes = self.map(self.read_file_panel, files)
+        self.panels = [plane for plane, _ in planes]
+        self.panel_ranges = [data_range for _, data_range in planes]
+        self.labels = list(labels) if labels is not None else self.default_labels(files)
+        if self.moments and len(self.moments) != len(self.panels):
+            raise ValueError(f"Se dieron {len(self.moments)} momentos para {len(self.panels)} paneles.")
+
+        self.wcs_base = WCS(self.header_base, naxis=2)
+        self.data_base = self.panels[0]
+        self.pixel_scale = float(np.sqrt(np.prod(pixel_scales(self.wcs_base))))  # arcsec/pixel
+        # Beam de cada panel (del header, o de su canal en la tabla BEAMS) y el beam común
+        self.panel_beams = self.read_panel_beams(files)
+        self.beam_base = self.common_panel_beam()
+        for data in self.panels[1:]:
+            if data.shape != self.data_base.shape:
+                raise ValueError(f"Los paneles deben tener la misma grilla: {data.shape} != {self.data_base.shape}")
+
+        # Contornos: se leen y reproyectan una sola vez para todos los paneles
+        if self.contour_fits:
+            with fits.open(self.contour_fits, memmap=True, lazy_load_hdus=True) as hdul:
+                self.header_contour = hdul[0].header.copy()
+                self.data_contour = read_plane(hdul[0], stokes=stokes)
+            self.wcs_contour = WCS(self.header_contour, naxis=2)
+            self.beam_contour = self.get_beam_params(self.header_contour, self.contour_fits)
+        else:
+            self.reprojected_contour = None
+            self.footprint_contour = None
+            self.beam_contour = None
+
+        if self.smooth:
+            self.smooth_to_common_beam()
+        if self.contour_fits:
+            shape_out = self.data_base.shape[-2:]
+            self.reprojected_contour, self.footprint_contour = self.reproject_contour(shape_out)
+
+        if isinstance(self.sigma, str):
+            data_noise = self.data_contour if self.contour_fits else self.data_base
+            self.sigma = estimate_sigma(data_noise, method=self.sigma)
+
+    def map(self, func, items):
+        """Aplica `func` a cada elemento en paralelo (hilos), conservando el orden."""
+        items = list(items)
+        if self.workers <= 1 or len(items) <= 1:
+            return [func(item) for item in items]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return list(pool.map(func, items))
+
+    @staticmethod
+    def cube_nchan(header):
+        """Número de canales del cubo (1 si la imagen no tiene eje espectral)."""
+        for axis in range(3, header["NAXIS"] + 1):
+            if not str(header.get(f"CTYPE{axis}", "")).upper().startswith("STOKES"):
+                return header[f"NAXIS{axis}"]
+        return 1
+
+    @staticmethod
+    def prepare_plane(plane):
+        """Convierte el plano a orden de bytes nativo y retorna (plano, (mínimo, máximo))."""
+        plane = np.asarray(plane)
+        plane = plane.astype(plane.dtype.newbyteorder('='), copy=False)
+        if not np.any(np.isfinite(plane)):
+            return plane, (np.nan, np.nan)
+        return plane, (float(np.nanmin(plane)), float(np.nanmax(plane)))
+
+    def read_panel(self, hdu, channel):
+        """Lee un canal del cubo (se ejecuta en un hilo; el archivo está memory-mapped)."""
+        return self.prepare_plane(read_plane(hdu, channel=channel, stokes=self.stokes))
+
+    def read_file_panel(self, filename):
+        """Lee el plano de un archivo de la lista (se ejecuta en un hilo)."""
+        with fits.open(filename, memmap=True, lazy_load_hdus=True) as hdul:
+            return self.prepare_plane(read_plane(hdul[0], stokes=self.stokes))
+
+    def read_panel_beams(self, files):
+        """Beam de cada panel (None si no se conoce): el del header, o el de su canal en la tabla BEAMS."""
+        if len(files) > 1:
+            return [self.get_beam_params(fits.getheader(filename), filename) for filename in files]
+        beams = Beams.from_header(self.header_base)
+        if beams is None:
+            beams = Beams.read(self.image_fits)
+        if beams is None:
+            return [None] * len(self.channels)
+        return [beams.beam(channel, self.stokes) for channel in self.channels]
+
+    def uniform_beams(self):
+        """True si todos los paneles tienen el mismo beam (se dibuja uno solo)."""
+        return all(beam == self.panel_beams[0] for beam in self.panel_beams)
+
+    def common_panel_beam(self):
+        """Beam común de los paneles (el de cualquiera si son iguales; None si falta alguno)."""
+        if self.uniform_beams() or any(beam is None for beam in self.panel_beams):
+            return self.panel_beams[0]
+        bmaj, bmin, bpa = np.array([(b['bmaj'], b['bmin'], b['bpa']) for b in self.panel_beams]).T
+        return beam_dict(*common_beam(bmaj, bmin, bpa))
+
+    def smooth_to_common_beam(self):
+        """
+        Convoluciona todos los paneles, cada uno con su beam, en un solo bloque de FFT y los
+        contornos al beam self.smooth (True: el beam común de los paneles y los contornos).
+        """
+        from smoothing import (smooth_plane, common_target, convolve_planes, kernel_matrices,
+                               pixel_covariances, area_ratios, per_beam)
+
+        if any(beam is None for beam in self.panel_beams) or (self.contour_fits and self.beam_contour is None):
+            raise ValueError("smooth requiere el beam de todos los paneles y de los contornos (BMAJ o tabla BEAMS).")
+        if self.smooth is True:
+            target = common_target(*self.panel_beams, self.beam_contour)
+        else:
+            target = common_target(self.smooth)
+
+        matrices = beam_matrices(*np.array([(b['bmaj'], b['bmin'], b['bpa']) for b in self.panel_beams]).T)
+        covariances = pixel_covariances(kernel_matrices(matrices, target), self.wcs_base)
+        scales = area_ratios(matrices, target) if per_beam(self.header_base.get("BUNIT", "Jy/beam")) else None
+        with stage("smooth", file=self.image_fits, panels=len(self.panels)):
+            smoothed = convolve_planes(np.stack(self.panels), covariances, scales=scales, workers=self.workers)
+        planes = [self.prepare_plane(plane) for plane in smoothed]
+        self.panels = [plane for plane, _ in planes]
+        self.panel_ranges = [data_range for _, data_range in planes]
+        self.data_base = self.panels[0]
+        self.panel_beams = [target] * len(self.panels)
+        self.beam_base = target
+
+        if self.contour_fits:
+            with stage("smooth", file=self.contour_fits):
+                self.data_contour = smooth_plane(self.data_contour, self.beam_contour, target, self.wcs_contour,
+                                                 bunit=self.header_contour.get("BUNIT", "Jy/beam"),
+                                                 workers=self.workers)
+            self.beam_contour = target
+        self.smooth_beam = target
+
+    def default_labels(self, files):
+        """Velocidad de cada canal (km/s), o el nombre de cada archivo."""
+        if len(files) > 1:
+            return [os.path.splitext(os.path.basename(f))[0] for f in files]
+        try:
+            from moments import channel_velocities
+            velocities = channel_velocities(self.header_base)
+            return [f"{velocities[k]:.2f} km/s" for k in self.channels]
+        except (ValueError, KeyError):
+            return [f"Canal {k}" for k in self.channels]
+
+    def grid_shape(self, ncols=None):
+        """(filas, columnas) del mosaico."""
+        npanels = len(self.panels)
+        ncols = min(ncols or self.ncols or int(np.ceil(np.sqrt(npanels))), npanels)
+        return int(np.ceil(npanels / ncols)), ncols
+
+    def figure_size(self, ncols=None):
+        """Tamaño de la figura (pulgadas) según el número de paneles."""
+        nrows, ncols = self.grid_shape(ncols)
+        return (PANEL_SIZE * ncols + 1.5, PANEL_SIZE * nrows + 0.5)
+
+    def plot(self, save_as=None, title="", contour_levels=None, downsample=None, ncols=None):
+        """
+        Genera el mosaico de paneles con los contornos comunes y un solo beam.
+
+        contour_levels y downsample tienen el mismo significado que en FITSPlotter.plot.
+        """
+        fig = plt.figure(figsize=self.figure_size(ncols))
+        self.draw_grid(fig, title=title, contour_levels=contour_levels, downsample=downsample,
+                       dpi=300 if save_as else fig.dpi, ncols=ncols)
+
+        if save_as:
+            with stage("savefig", file=save_as, dpi=300):
+                plt.savefig(save_as, dpi=300, bbox_inches='tight')
+            print(f"Imagen guardada como {save_as}")
+
+        plt.show()
+
+    def render(self, title="", contour_levels=None, downsample=None, figsize=None, dpi=300, ncols=None):
+        """Construye el mosaico sin mostrarlo y retorna la figura (ver FITSPlotter.render)."""
+        with stage("render", panels=len(self.panels)):
+            fig = Figure(figsize=figsize or self.figure_size(ncols))
+            FigureCanvasAgg(fig)
+            self.draw_grid(fig, title=title, contour_levels=contour_levels, downsample=downsample,
+                           dpi=dpi, ncols=ncols)
+        return fig
+
+    def draw_grid(self, fig, title="", contour_levels=None, downsample=None, dpi=100, ncols=None):
+        """Dibuja todos los paneles en `fig` y retorna la lista de ejes."""
+        nrows, ncols = self.grid_shape(ncols)
+        ny, nx = self.data_base.shape[-2:]
+
+        # Factor de reducción según el tamaño de cada panel (no de la figura completa)
+        if downsample == 'auto':
+            factor = auto_factor(self.data_base.shape, figsize=(PANEL_SIZE, PANEL_SIZE), dpi=dpi)
+        else:
+            factor = int(downsample or 1)
+        if factor > 1:
+            # Los promedios por bloques se guardan para los redibujos (ver FITSPlotter.memo)
+            images = self.memo("panels", (id(self.panels), factor),
+                               lambda: self.map(lambda data: block_average(data, factor), self.panels))
+            extent = block_extent(images[0].shape, factor)
+        else:
+            images = self.panels
+            extent = (-0.5, nx - 0.5, -0.5, ny - 0.5)
+
+        # Escala de color común
+        if self.common_scale:
+            vmin = np.nanmin([low for low, _ in self.panel_ranges])
+            vmax = np.nanmax([high for _, high in self.panel_ranges])
+        else:
+            vmin = vmax = None
+
+        # Contornos comunes (reproyectados una sola vez)
+        contour_data = None
+        if self.reprojected_contour is not None:
+            levels = self.get_contour_levels(contour_levels)
+            if factor > 1:
+                contour_data = self.contour_display(factor)
+                contour_xy = block_centers(contour_data.shape, factor)
+            else:
+                contour_data = self.reprojected_contour
+                contour_xy = np.arange(nx), np.arange(ny)
+
+        axes = []
+        for i, image in enumerate(images):
+            row, col = divmod(i, ncols)
+            moment = self.moments[i] if self.moments else self.moment
+            cmap_base, contour_color, _ = self.plot_style(moment)
+            ax = fig.add_subplot(nrows, ncols, i + 1, projection=self.wcs_base)
+            im = ax.imshow(image, origin='lower', cmap=cmap_base, vmin=vmin, vmax=vmax, extent=extent)
+            ax.set_xlim(-0.5, nx - 0.5)
+            ax.set_ylim(-0.5, ny - 0.5)
+            if contour_data is not None:
+                ax.contour(*contour_xy, contour_data, levels=levels, colors=contour_color,
+                           linewidths=0.8, alpha=0.8)
+            for catalog, style in self.catalogs:
+                overlay_catalog(ax, self.wcs_base, self.data_base.shape, catalog, **style)
+            ax.text(0.05, 0.95, self.labels[i], transform=ax.transAxes, fontsize=9,
+                    color='white', ha='left', va='top', bbox=dict(facecolor='black', alpha=0.5))
+
+            # Solo los paneles del borde izquierdo e inferior llevan coordenadas
+            ra, dec = ax.coords[0], ax.coords[1]
+            ra.set_ticks(number=3)
+            if i + ncols < len(images):
+                ra.set_ticklabel_visible(False)
+                ra.set_axislabel('')
+            else:
+                ra.set_axislabel('Ascensión Recta (RA)')
+            if col > 0:
+                dec.set_ticklabel_visible(False)
+                dec.set_axislabel('')
+            else:
+                dec.set_axislabel('Declinación (Dec)')
+
+            if not self.common_scale:
+                label = MOMENT_LABELS.get(moment, "Intensidad (Jy/beam)")
+                fig.colorbar(im, ax=ax, pad=0.02, fraction=0.046, label=label)
+            if not self.uniform_beams():
+                # Beam distinto por canal: cada panel muestra el suyo
+                self.plot_beam(ax, self.panel_beams[i], facecolor='gray', edgecolor='black')
+            axes.append(ax)
+
+        # Un solo beam, en el panel inferior izquierdo
+        beam_ax = axes[(nrows - 1) * ncols]
+        if self.uniform_beams():
+            self.plot_beam(beam_ax, self.beam_base, facecolor='gray', edgecolor='black')
+        if self.beam_contour:
+            self.plot_beam(beam_ax, self.beam_contour, facecolor='white', edgecolor='gray')
+
+        if self.common_scale:
+            fig.colorbar(im, ax=axes, pad=0.02, fraction=0.03, label=self.colorbar_label)
+        fig.suptitle(title)
+        return axes
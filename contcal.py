@@ -3,14 +3,19 @@
 import os
 import sys
 import shutil
-import numpy as np
-from casatasks import importfits, exportfits, imstat, immath
+
+# Permite importar contour_engine.py aunque el script se ejecute con `casa -c` desde otro directorio
+sys.path.insert(0, os.path.dirname(os.path.abspath(sys.argv[0])))
+
+import profiling
+from contour_engine import compute_levels, contour_products, file_noise, print_level_stats
 
 """
-Script para generar contornos en imágenes FITS utilizando CASA.
+Script para generar contornos en imágenes FITS, con CASA o con NumPy.
 
 Uso:
-    casa --nologger --nogui -c script_contornos.py <fits_file> <moment> <method> <sigma (opcional)> <multipliers> <output_fits>
+    casa --nologger --nogui -c script_contornos.py <fits_file> <moment> <method> <sigma (opcional)> <multipliers> <output_fits> [backend]
+    python contcal.py <fits_file> <moment> <method> <sigma (opcional)> <multipliers> <output_fits> [backend] [--mask=<archivo>] [--stats=<archivo>] [--scheduler=<nombre>] [--workers=<n>] [--profile=<formato>]
 
 Argumentos:
     <fits_file>:     Ruta del archivo FITS de entrada.
@@ -19,117 +24,194 @@ Argumentos:
                      - "sigma": Usa la desviación estándar (RMS) y multipliers ingresados por el usuario.
                      - "imax": Usa el valor máximo de la imagen y factores predefinidos.
     <sigma>:         Valor de sigma o "auto" para calcularlo a partir del RMS (solo en momentos 0 y 2).
+                     También acepta un estimador robusto de noise.py: "mad", "clip" (recorte
+                     iterativo) o "free" (regiones sin emisión).
     <multipliers>:   Valores de contorno separados por comas (obligatorio en método "sigma", opcional en "imax").
     <output_fits>:   Nombre del archivo de salida con los contornos generados.
+    [backend]:       (Opcional) Motor de cálculo:
+                     - "numpy" (por defecto): NumPy/astropy en una sola pasada, sin tablas intermedias.
+                     - "casa": importfits + immath + exportfits (requiere casatasks); el RMS y el
+                       máximo se calculan en una pasada por bloques (streaming_stats.py) en vez de imstat.
+                     - "dask": Como "numpy", pero por bloques en varios núcleos (dask_backend.py).
+    --mask=<archivo>: (Opcional, backend NumPy) Cubo de máscaras empaquetadas: un plano por
+                     nivel con los píxeles img > nivel, 8 píxeles por byte (ver read_level_mask
+                     en contour_engine.py).
+    --stats=<archivo>: (Opcional, backend NumPy) Guarda en JSON las estadísticas por nivel
+                     (área en beams, flujo integrado, pico y centroide), que además se imprimen.
+    --scheduler=<nombre>, --workers=<n>: (Opcional, backend dask) Scheduler de dask ("threads",
+                     "processes", "distributed" o "tcp://...") y número de workers.
+    --profile=<formato>: (Opcional) Mide tiempo, CPU y pico de memoria de cada etapa (importfits,
+                     immath, exportfits; estadísticas, ruido, umbralizado) y lo reporta como
+                     "table", "jsonl[:archivo]" o "chrome:archivo" (ver profiling.py). También se
+                     activa con la variable de entorno FITS_PLOTTER_PROFILE.
+
+El backend NumPy recorre la imagen por bloques de filas, en una sola pasada para todos los
+niveles, por lo que también funciona con imágenes más grandes que la memoria.
+
+Si la variable de entorno FITS_PLOTTER_INDEX apunta a un índice de fits_index.py y el
+archivo está indexado, el backend NumPy toma el RMS y el máximo del índice. Si está definida
+FITS_PLOTTER_STATS_CACHE (un directorio), las estadísticas de cada archivo (RMS, máximo) se
+guardan ahí la primera vez y los métodos "auto" e "imax" no vuelven a recorrer la imagen.
 
 Ejemplos de uso:
     1. Usando sigma en momento 0:
        casa --nologger --nogui -c script_contornos.py imagen.fits 0 sigma 0.005 "3,5,10,20" salida_sigma_m0.fits
-    
+
     2. Usando I_max en momento 2:
        casa --nologger --nogui -c script_contornos.py imagen.fits 2 imax auto "" salida_imax_m2.fits
-    
+
     3. Usando multipliers directos en momento 1:
        casa --nologger --nogui -c script_contornos.py imagen.fits 1 direct auto "5,10,15,20" salida_multipliers_m1.fits
 
-    4. Mostrar esta ayuda:
-       casa --nologger --nogui -c script_contornos.py --help
-"""
+    4. Forzando el backend de CASA:
+       casa --nologger --nogui -c script_contornos.py imagen.fits 0 sigma auto "3,5,10,20" salida.fits casa
+
+    5. Sin CASA (backend NumPy):
+       python contcal.py imagen.fits 0 sigma auto "3,5,10,20" salida.fits
+
+    6. Con sigma robusto (MAD, sin contaminación de la fuente):
+       python contcal.py imagen.fits 0 sigma mad "3,5,10,20" salida.fits
+
+    7. Con dask en 8 procesos (mosaicos grandes):
+       python contcal.py mosaico.fits 0 sigma auto "3,5,10,20" salida.fits dask --scheduler=processes --workers=8
 
-# Leer argumentos de entrada
-if len(sys.argv) < 7:
-    print("Uso: casa --nologger --nogui -c script_contornos.py <fits_file> <moment> <method> <sigma (opcional)> <multipliers> <output_fits>")
-    sys.exit(1)
+    8. Con el tiempo y la memoria de cada etapa:
+       python contcal.py imagen.fits 0 sigma mad "3,5,10,20" salida.fits --profile=table
 
-fits_file = sys.argv[1]
-moment = int(sys.argv[2])  # Momento 0, 1 o 2
-method = sys.argv[3].lower()  # Método: "sigma" o "imax"
-sigma_value_arg = sys.argv[4]  # Corresponde al valor de sigma
-multipliers_arg = sys.argv[5]  # Corresponde a los valores de contorno si se usa sigma
-output_fits = sys.argv[6]  # Archivo de salida
+    9. Con máscaras por nivel y estadísticas en JSON:
+       python contcal.py imagen.fits 0 sigma mad "3,5,10,20" salida.fits numpy --mask=mascaras.fits --stats=niveles.json
 
-print(f"Método seleccionado: {method}", '\n')
-print(f"Multipliers recibidos: {multipliers_arg}", '\n')
-print(f"Argumentos recibidos: {sys.argv}", '\n')
+    10. Mostrar esta ayuda:
+       casa --nologger --nogui -c script_contornos.py --help
+"""
+
+BACKENDS = ["numpy", "casa", "dask"]
 
-# Definir nombres de archivos intermedios
+# Nombres de archivos intermedios (solo backend CASA)
 casa_image = 'imagen_casa.im'
 contour_image = 'contornos.im'
 
-# Eliminar directorios temporales si existen
-for directory in [casa_image, contour_image]:
-    if os.path.exists(directory):
-        shutil.rmtree(directory)
-        print(f"Directorio {directory} eliminado para evitar conflictos de sobrescritura.", '\n')
-
-# Eliminar archivo de salida si existe
-if os.path.exists(output_fits):
-    os.remove(output_fits)
-    print(f"Archivo {output_fits} eliminado para evitar conflictos de sobrescritura.", '\n')
-
-# Importar la imagen FITS a un formato de CASA
-importfits(fits_file, imagename=casa_image, overwrite=True)
-
-# Obtener estadísticas de la imagen
-stats = imstat(imagename=casa_image)
-
-# Determinar sigma o I_max según el método
-sigma_value = None
-contour_levels = []
-
-if method == "sigma":
-    if moment in [0, 2]:
-        if sigma_value_arg.lower() == "auto":
-            sigma_value = stats['rms'][0] if 'rms' in stats else 1.0  # Estimación por RMS si no se da sigma
-            print(f"Sigma estimado: {sigma_value}", '\n')
-        else:
-            sigma_value = float(sigma_value_arg)  # Usa el valor ingresado por el usuario
-        
-        # Calcular niveles de contorno con multipliers
-        try:
-            multipliers = list(map(float, multipliers_arg.split(',')))
-            contour_levels = [sigma_value * m for m in multipliers]
-        except ValueError:
-            print(f"Error: No se pudieron convertir los valores de contorno correctamente. Revisar entrada: {multipliers_arg}", '\n')
-            sys.exit(1)
-    else:
-        print("Error: El método 'sigma' solo es válido para momentos 0 y 2.", '\n')
+
+def run_casa(fits_file, moment, method, sigma_value_arg, multipliers_arg, output_fits, stats_cache=None):
+    """
+    Genera los contornos con CASA: importfits -> immath (iif) -> exportfits. El RMS y el
+    máximo (solo si el método los necesita) se calculan en una pasada por bloques sobre el
+    FITS (streaming_stats.py, con caché opcional) en lugar de imstat.
+    """
+    from casatasks import importfits, exportfits, immath
+
+    # Eliminar directorios temporales si existen
+    for directory in [casa_image, contour_image]:
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+            print(f"Directorio {directory} eliminado para evitar conflictos de sobrescritura.", '\n')
+
+    # Importar la imagen FITS a un formato de CASA
+    with profiling.stage("importfits"):
+        importfits(fits_file, imagename=casa_image, overwrite=True)
+
+    # Estadísticas de la imagen, calculadas solo si el método las necesita
+    def get_stats():
+        from streaming_stats import file_stats
+        with profiling.stage("stats"):
+            return file_stats(fits_file, cache=stats_cache).image_stats()
+
+    # Determinar sigma o I_max según el método (el ruido, del primer plano sin cargar el cubo)
+    contour_levels, _ = compute_levels(moment, method, sigma_value_arg, multipliers_arg, get_stats,
+                                       lambda noise_method: file_noise(fits_file, noise_method))
+
+    # Generar contornos con immath
+    contour_expr = f"iif({casa_image} > {contour_levels[0]}, 1, 0)"
+    for level in contour_levels[1:]:
+        contour_expr += f" + iif({casa_image} > {level}, 1, 0)"
+
+    with profiling.stage("immath", levels=len(contour_levels)):
+        immath(imagename=casa_image, expr=contour_expr, outfile=contour_image)
+
+    # Exportar la imagen de contornos a FITS con el nombre especificado
+    with profiling.stage("exportfits"):
+        exportfits(imagename=contour_image, fitsimage=output_fits, overwrite=True)
+    return contour_levels
+
+
+def main(argv):
+    # Opciones --mask=<archivo> y --stats=<archivo> (solo backend NumPy), --scheduler/--workers (dask)
+    # y --profile=<formato> (instrumentación por etapas, ver profiling.py)
+    options = dict(arg[2:].split("=", 1) for arg in argv if arg.startswith("--") and "=" in arg)
+    argv = [arg for arg in argv if not (arg.startswith("--") and "=" in arg)]
+    if options.get("profile"):
+        profiling.enable(options["profile"])
+
+    # Leer argumentos de entrada
+    if len(argv) < 7:
+        print("Uso: casa --nologger --nogui -c script_contornos.py <fits_file> <moment> <method> <sigma (opcional)> <multipliers> <output_fits> [backend]")
         sys.exit(1)
 
-elif method == "imax":
-    i_max = stats['max'][0]
-    factors = [0.1, 0.2, 0.4, 0.5, 0.7, 0.9]
-    contour_levels = [f * i_max for f in factors]
-    print(f"Niveles de contorno basados en I_max={i_max}: {contour_levels}", '\n')
+    fits_file = argv[1]
+    moment = int(argv[2])  # Momento 0, 1 o 2
+    method = argv[3].lower()  # Método: "sigma" o "imax"
+    sigma_value_arg = argv[4]  # Corresponde al valor de sigma
+    multipliers_arg = argv[5]  # Corresponde a los valores de contorno si se usa sigma
+    output_fits = argv[6]  # Archivo de salida
+    backend = argv[7].lower() if len(argv) > 7 else "numpy"  # Motor de cálculo
 
-elif moment == 1:
-    # Usar los multipliers ingresados directamente
-    try:
-        contour_levels = list(map(float, multipliers_arg.split(',')))
-        print(f"Niveles de contorno ingresados por el usuario: {contour_levels}")
-    except ValueError:
-        print(f"Error: No se pudieron convertir los valores de contorno correctamente. Revisar entrada: {multipliers_arg}", '\n')
+    print(f"Método seleccionado: {method}", '\n')
+    print(f"Multipliers recibidos: {multipliers_arg}", '\n')
+    print(f"Argumentos recibidos: {argv}", '\n')
+
+    if backend not in BACKENDS:
+        print(f"Error: Backend desconocido '{backend}'. Use {' o '.join(BACKENDS)}.", '\n')
         sys.exit(1)
 
-else:
-    print("Error: Método desconocido. Use 'sigma' o 'imax'.", '\n')
-    sys.exit(1)
+    # Eliminar archivo de salida si existe
+    if os.path.exists(output_fits):
+        os.remove(output_fits)
+        print(f"Archivo {output_fits} eliminado para evitar conflictos de sobrescritura.", '\n')
 
+    # Índice de metadatos (fits_index.py): si está definido, el RMS y el máximo se leen de él
+    index = None
+    if backend == "numpy" and os.environ.get("FITS_PLOTTER_INDEX"):
+        from fits_index import FITSIndex
+        index = FITSIndex()
 
+    # Caché de estadísticas por archivo (streaming_stats.py)
+    stats_cache = None
+    if os.environ.get("FITS_PLOTTER_STATS_CACHE"):
+        from streaming_stats import StatsCache
+        stats_cache = StatsCache()
 
-# Generar contornos con immath
-contour_expr = f"iif({casa_image} > {contour_levels[0]}, 1, 0)"
-for level in contour_levels[1:]:
-    contour_expr += f" + iif({casa_image} > {level}, 1, 0)"
+    try:
+        with profiling.stage("contcal", backend=backend, file=fits_file):
+            if backend == "casa":
+                contour_levels = run_casa(fits_file, moment, method, sigma_value_arg, multipliers_arg, output_fits,
+                                          stats_cache=stats_cache)
+            elif backend == "dask":
+                from dask_backend import make_contour_fits as make_contour_fits_dask
+                workers = int(options["workers"]) if options.get("workers") else None
+                contour_levels = make_contour_fits_dask(fits_file, moment, method, sigma_value_arg, multipliers_arg,
+                                                        output_fits, scheduler=options.get("scheduler", "threads"),
+                                                        workers=workers)
+            else:
+                contour_levels, stats = contour_products(fits_file, moment, method, sigma_value_arg,
+                                                         multipliers_arg, output_fits, mask_fits=options.get("mask"),
+                                                         index=index, stats_cache=stats_cache)
+                print_level_stats(stats)
+                if options.get("stats"):
+                    import json
+                    with open(options["stats"], "w") as f:
+                        json.dump(stats, f, indent=2)
+                    print(f"Estadísticas por nivel guardadas en {options['stats']}", '\n')
+    except ValueError as error:
+        print(error, '\n')
+        sys.exit(1)
 
-immath(imagename=casa_image, expr=contour_expr, outfile=contour_image)
+    print(f"Proceso completado: Contornos generados para momento {moment} con método {method} y niveles {contour_levels} <3", '\n')
 
-# Exportar la imagen de contornos a FITS con el nombre especificado
-exportfits(imagename=contour_image, fitsimage=output_fits, overwrite=True)
 
-print(f"Proceso completado: Contornos generados para momento {moment} con método {method} y niveles {contour_levels} <3", '\n')
+if __name__ == "__main__":
+    main(sys.argv)
 
 #EJEMPLOS DE USO
 #casa --nologger --nogui -c script_contornos.py imagen.fits 0 sigma 0.001 "3,5,10,20" salida.fits
 #casa --nologger --nogui -c script_contornos.py imagen.fits 0 imax auto "" salida.fits
-
+#python contcal.py imagen.fits 0 sigma 0.001 "3,5,10,20" salida.fits numpy
@@ -0,0 +1,422 @@
+"""
+Motor de contornos en NumPy/astropy (sin CASA) para contcal.py.
+
+Reproduce los métodos de contcal.py ("sigma", "imax" y niveles directos para el
+momento 1) y genera el mismo FITS de salida: cada píxel contiene el número de
+niveles de contorno que supera, es decir, el equivalente a la expresión de immath
+    iif(img > L1, 1, 0) + iif(img > L2, 1, 0) + ...
+pero calculado en una sola pasada vectorizada con np.searchsorted sobre los
+niveles ordenados, en lugar de N comparaciones sobre la imagen completa.
+
+La imagen se recorre por bloques de filas (nunca se carga completa), y en la misma pasada
+se calculan las estadísticas de cada nivel (área en beams, flujo integrado, pico y
+centroide) y, opcionalmente, un cubo de máscaras booleanas empaquetadas (un plano por
+nivel, 8 píxeles por byte) que conserva qué píxeles pertenecen a cada nivel.
+
+Uso desde Python:
+    from contour_engine import make_contour_fits, contour_products, read_level_mask
+    levels = make_contour_fits("imagen.fits", 0, "sigma", "0.005", "3,5,10,20", "salida.fits")
+    levels, stats = contour_products("imagen.fits", 0, "sigma", "mad", "3,5,10,20", "salida.fits",
+                                     mask_fits="mascaras.fits")
+    mask_5sigma = read_level_mask("mascaras.fits", 1)
+"""
+
+import os
+
+import numpy as np
+from astropy.io import fits
+from astropy.wcs import WCS
+from astropy.wcs.utils import proj_plane_pixel_area
+
+from noise import METHODS as NOISE_METHODS, estimate_sigma
+from moments import cube_index, DEFAULT_MAX_CHUNK_BYTES
+from profiling import stage
+from streaming_stats import plane_stats, file_stats
+
+# Factores (fracciones de I_max) usados por el método "imax"
+IMAX_FACTORS = [0.1, 0.2, 0.4, 0.5, 0.7, 0.9]
+
+
+def image_stats(data):
+    """
+    Estadísticas equivalentes a las que usa contcal.py de imstat (ignorando NaN).
+    Retorna un diccionario con 'rms', 'max' y 'min'.
+    """
+    finite = data[np.isfinite(data)]
+    if finite.size == 0:
+        return {'rms': None, 'max': None, 'min': None}
+    finite = finite.astype(np.float64, copy=False)
+    return {
+        'rms': float(np.sqrt(np.mean(finite ** 2))),
+        'max': float(finite.max()),
+        'min': float(finite.min()),
+    }
+
+
+def parse_multipliers(multipliers_arg):
+    """Convierte una cadena "3,5,10,20" en una lista de floats (ValueError si no es válida)."""
+    try:
+        return list(map(float, multipliers_arg.split(',')))
+    except ValueError:
+        raise ValueError("Error: No se pudieron convertir los valores de contorno correctamente. "
+                         f"Revisar entrada: {multipliers_arg}")
+
+
+def compute_levels(moment, method, sigma_value_arg, multipliers_arg, get_stats, estimate_noise=None):
+    """
+    Calcula los niveles de contorno con las mismas reglas que contcal.py.
+
+    Parámetros:
+        moment (int): Momento de la imagen (0, 1 o 2).
+        method (str): "sigma", "imax" o cualquier otro valor para niveles directos (momento 1).
+        sigma_value_arg (str): Valor de sigma, "auto" (RMS de la imagen) o un estimador
+            de noise.py ("mad", "clip", "free", "rms").
+        multipliers_arg (str): Valores de contorno separados por comas.
+        get_stats (callable): Función sin argumentos que retorna un diccionario con
+            'rms' y 'max'. Solo se llama si el método la necesita.
+        estimate_noise (callable, opcional): Función que recibe el nombre del estimador
+            de ruido y retorna sigma. Necesaria si sigma_value_arg es un estimador.
+
+    Retorna:
+        (levels, sigma_value): Lista de niveles y sigma usado (None si no aplica).
+        Lanza ValueError con el mensaje de error si la combinación no es válida.
+    """
+    sigma_value = None
+
+    if method == "sigma":
+        if moment not in [0, 2]:
+            raise ValueError("Error: El método 'sigma' solo es válido para momentos 0 y 2.")
+        if sigma_value_arg.lower() == "auto":
+            rms = get_stats().get('rms')
+            sigma_value = rms if rms is not None else 1.0  # Estimación por RMS si no se da sigma
+            print(f"Sigma estimado: {sigma_value}", '\n')
+        elif sigma_value_arg.lower() in NOISE_METHODS:
+            if estimate_noise is None:
+                raise ValueError(f"Error: El estimador de ruido '{sigma_value_arg}' no está disponible.")
+            sigma_value = estimate_noise(sigma_value_arg.lower())
+            if sigma_value is None:
+                sigma_value = 1.0
+            print(f"Sigma estimado ({sigma_value_arg.lower()}): {sigma_value}", '\n')
+        else:
+            sigma_value = float(sigma_value_arg)  # Usa el valor ingresado por el usuario
+        levels = [sigma_value * m for m in parse_multipliers(multipliers_arg)]
+
+    elif method == "imax":
+        i_max = get_stats()['max']
+        levels = [f * i_max for f in IMAX_FACTORS]
+        print(f"Niveles de contorno basados en I_max={i_max}: {levels}", '\n')
+
+    elif moment == 1:
+        # Usar los multipliers ingresados directamente
+        levels = parse_multipliers(multipliers_arg)
+        print(f"Niveles de contorno ingresados por el usuario: {levels}")
+
+    else:
+        raise ValueError("Error: Método desconocido. Use 'sigma' o 'imax'.")
+
+    return levels, sigma_value
+
+
+def level_count_map(data, levels):
+    """
+    Número de niveles superados por cada píxel (img > L), en una sola pasada.
+
+    np.searchsorted(niveles_ordenados, img, side='left') retorna cuántos niveles son
+    estrictamente menores que cada píxel, que es exactamente la suma de los iif de
+    immath. Los píxeles NaN se mantienen como NaN (CASA los exporta enmascarados).
+    """
+    sorted_levels = np.sort(np.asarray(levels, dtype=np.float64))
+    counts = np.searchsorted(sorted_levels, data, side='left').astype(np.float32)
+    counts[np.isnan(data)] = np.nan
+    return counts
+
+
+def write_contour_fits(output_fits, counts, header, levels=None):
+    """Escribe el mapa de conteo de niveles con el header de la imagen de entrada."""
+    header = header.copy()
+    for key in ('BSCALE', 'BZERO', 'BLANK', 'DATAMIN', 'DATAMAX'):
+        header.remove(key, ignore_missing=True)
+    if levels is not None:
+        header['HISTORY'] = f"contour_engine: niveles {list(levels)}"
+    fits.PrimaryHDU(data=counts, header=header).writeto(output_fits, overwrite=True)
+
+
+def row_blocks(ny, nx, max_chunk_bytes=DEFAULT_MAX_CHUNK_BYTES):
+    """Bloques de filas (y0, y1) de un plano ny x nx de modo que cada bloque (float64) ocupe a lo sumo max_chunk_bytes."""
+    rows = max(1, int(max_chunk_bytes // (nx * 8)))
+    for y0 in range(0, ny, rows):
+        yield y0, min(y0 + rows, ny)
+
+
+def read_rows(hdu, y0, y1, channel=0, stokes=0):
+    """Filas y0:y1 del plano (canal, Stokes) de `hdu`, leídas con hdu.section (sin cargar la imagen)."""
+    index = cube_index(hdu.header, channel, stokes)[:-2] + (slice(y0, y1), slice(None))
+    return np.asarray(hdu.section[index], dtype=np.float64)
+
+
+def chunked_stats(hdu, channel=0, stokes=0, max_chunk_bytes=DEFAULT_MAX_CHUNK_BYTES):
+    """Como image_stats(), pero leyendo el plano por bloques de filas (streaming_stats.plane_stats)."""
+    return plane_stats(hdu, channel, stokes, max_chunk_bytes).image_stats()
+
+
+def create_fits(filename, header, shape, dtype):
+    """
+    Crea un FITS con el header dado y los datos sin escribir; retorna un np.memmap de
+    escritura sobre los datos, para llenarlo por bloques sin tenerlo en memoria.
+    """
+    header.tofile(filename, overwrite=True)
+    offset = os.path.getsize(filename)
+    nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    with open(filename, 'r+b') as f:
+        f.truncate(offset + nbytes + (-nbytes % 2880))
+    return np.memmap(filename, dtype=dtype, mode='r+', offset=offset, shape=shape)
+
+
+def plane_header(header, levels=None):
+    """Header del mapa de conteo: el de la imagen, con los ejes no celestes degenerados y en float32."""
+    header = header.copy()
+    header['BITPIX'] = -32
+    for n in range(3, header['NAXIS'] + 1):
+        header[f'NAXIS{n}'] = 1
+    for key in ('BSCALE', 'BZERO', 'BLANK', 'DATAMIN', 'DATAMAX'):
+        header.remove(key, ignore_missing=True)
+    if levels is not None:
+        header['HISTORY'] = f"contour_engine: niveles {list(levels)}"
+    return header
+
+
+def mask_header(nx, ny, levels):
+    """Header del cubo de máscaras empaquetadas: un plano por nivel, 8 píxeles por byte (np.packbits)."""
+    header = fits.Header()
+    header['SIMPLE'] = True
+    header['BITPIX'] = 8
+    header['NAXIS'] = 3
+    header['NAXIS1'] = (nx + 7) // 8
+    header['NAXIS2'] = ny
+    header['NAXIS3'] = len(levels)
+    header['MASKNX'] = (nx, 'Columnas de la imagen (antes de empaquetar)')
+    header['PACKBITS'] = (True, 'Cada byte contiene 8 pixeles en x (np.packbits)')
+    for k, level in enumerate(levels):
+        header[f'LEVEL{k + 1}'] = (float(level), f'Plano {k + 1}: img > nivel')
+    return header
+
+
+def read_level_mask(mask_fits, level_index):
+    """Máscara booleana (ny, nx) del nivel `level_index` (base 0) de un cubo de máscaras empaquetadas."""
+    with fits.open(mask_fits, memmap=True) as hdul:
+        header = hdul[0].header
+        packed = np.asarray(hdul[0].section[level_index])
+        return np.unpackbits(packed, axis=-1, count=header['MASKNX']).astype(bool)
+
+
+def beam_area_pixels(header):
+    """Área del beam gaussiano en píxeles (pi * bmaj * bmin / (4 ln 2)), o None si no hay beam."""
+    if not all(key in header for key in ('BMAJ', 'BMIN')):
+        return None
+    pixel_area = proj_plane_pixel_area(WCS(header).celestial)  # grados^2
+    return np.pi * header['BMAJ'] * header['BMIN'] / (4 * np.log(2)) / pixel_area
+
+
+def threshold_levels(hdu, levels, output_fits=None, mask_fits=None, channel=0, stokes=0,
+                     max_chunk_bytes=DEFAULT_MAX_CHUNK_BYTES, compute_stats=True):
+    """
+    Umbraliza el plano (canal, Stokes) de `hdu` con todos los niveles en una sola pasada
+    por bloques de filas y calcula las estadísticas de cada nivel.
+
+    En cada bloque, np.searchsorted da el índice de nivel de cada píxel (número de niveles
+    superados) y np.bincount acumula, por índice, el número de píxeles, la suma y la suma
+    ponderada por la fila y la columna; la región de un nivel (img > L_k) es la unión de los índices
+    > k, de modo que sus estadísticas son sumas acumuladas de esos acumuladores.
+
+    Parámetros:
+        hdu: HDU de la imagen (abierta sin memmap; se lee con hdu.section).
+        levels (list): Niveles de contorno.
+        output_fits (str, opcional): Mapa de índice de nivel (mismo formato que contcal.py).
+        mask_fits (str, opcional): Cubo de máscaras booleanas empaquetadas (un plano por nivel).
+        compute_stats (bool, opcional): Si es False solo se escriben las salidas y se retorna None.
+
+    Retorna:
+        Lista (una entrada por nivel, en orden creciente) de diccionarios con: 'level',
+        'npix', 'area_arcsec2', 'area_beams', 'flux' (suma / área del beam, p. ej. Jy si la
+        imagen está en Jy/beam; la suma de píxeles si no hay beam), 'peak', 'peak_x',
+        'peak_y', 'centroid_x', 'centroid_y', 'centroid_ra' y 'centroid_dec' (grados,
+        centroide ponderado por intensidad).
+    """
+    header = hdu.header
+    sorted_levels = np.sort(np.asarray(levels, dtype=np.float64))
+    nlevels = len(sorted_levels)
+    ny, nx = header['NAXIS2'], header['NAXIS1']
+
+    counts_out = None
+    if output_fits:
+        out_header = plane_header(header, sorted_levels)
+        shape = tuple(out_header[f'NAXIS{n}'] for n in range(out_header['NAXIS'], 0, -1))
+        counts_out = create_fits(output_fits, out_header, shape, '>f4').reshape(ny, nx)
+    masks_out = create_fits(mask_fits, mask_header(nx, ny, sorted_levels),
+                            (nlevels, ny, (nx + 7) // 8), np.uint8) if mask_fits else None
+
+    nbands = nlevels + 2  # Índices 0..nlevels, más una banda extra para los píxeles no finitos
+    npix = np.zeros(nbands)
+    total = np.zeros(nbands)
+    sum_x = np.zeros(nbands)
+    sum_y = np.zeros(nbands)
+    peak, peak_x, peak_y = -np.inf, None, None
+    columns = np.arange(nx, dtype=np.float64)
+    column_offsets = nbands * np.arange(nx)
+
+    for y0, y1 in row_blocks(ny, nx, max_chunk_bytes):
+        block = read_rows(hdu, y0, y1, channel, stokes)
+        counts = np.searchsorted(sorted_levels, block, side='left')
+        finite = np.isfinite(block)
+        all_finite = finite.all()
+        if counts_out is not None:
+            counts_out[y0:y1] = counts
+            if not all_finite:
+                counts_out[y0:y1][np.isnan(block)] = np.nan  # Como level_count_map
+        if not all_finite:
+            counts[~finite] = nlevels + 1
+            block = np.where(finite, block, 0.0)
+        if masks_out is not None:
+            for k in range(nlevels):
+                masks_out[k, y0:y1] = np.packbits((counts > k) & (counts <= nlevels), axis=-1)
+        if not compute_stats:
+            continue
+
+        # Sumas por (fila, índice) y por (columna, índice) con un solo bincount cada una:
+        # de ellas salen la suma total y los momentos en y y en x de cada índice
+        nrows = y1 - y0
+        row_offsets = nbands * np.arange(nrows)[:, None]
+        by_row = np.bincount((counts + row_offsets).ravel(), weights=block.ravel(),
+                             minlength=nbands * nrows).reshape(nrows, nbands)
+        by_column = np.bincount((counts + column_offsets).ravel(), weights=block.ravel(),
+                                minlength=nbands * nx).reshape(nx, nbands)
+        npix += np.bincount(counts.ravel(), minlength=nbands)
+        total += by_row.sum(axis=0)
+        sum_y += np.arange(y0, y1, dtype=np.float64) @ by_row
+        sum_x += columns @ by_column
+
+        block_peak = np.argmax(np.where(finite, block, -np.inf)) if not all_finite else np.argmax(block)
+        iy, ix = np.unravel_index(block_peak, block.shape)
+        if finite[iy, ix] and block[iy, ix] > peak:
+            peak, peak_x, peak_y = float(block[iy, ix]), int(ix), int(y0 + iy)
+
+    for output in (counts_out, masks_out):
+        if output is not None:
+            output.flush()
+    counts_out = masks_out = None
+    if not compute_stats:
+        return None
+
+    # Región del nivel k (img > L_k) = índices k+1 ... nlevels: sumas acumuladas desde arriba
+    def above(accumulator):
+        return np.cumsum(accumulator[nlevels::-1])[::-1][1:]
+
+    npix, total, sum_x, sum_y = above(npix), above(total), above(sum_x), above(sum_y)
+    wcs = WCS(header).celestial
+    pixel_arcsec2 = proj_plane_pixel_area(wcs) * 3600 ** 2
+    beam_pixels = beam_area_pixels(header)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        centroid_x, centroid_y = sum_x / total, sum_y / total
+    valid = np.isfinite(centroid_x) & np.isfinite(centroid_y)
+    centroid_ra, centroid_dec = np.full(nlevels, np.nan), np.full(nlevels, np.nan)
+    if valid.any():
+        centroid_ra[valid], centroid_dec[valid] = wcs.pixel_to_world_values(centroid_x[valid], centroid_y[valid])
+
+    stats = []
+    for k, level in enumerate(sorted_levels):
+        has_pixels = npix[k] > 0
+        stats.append({
+            'level': float(level),
+            'npix': int(npix[k]),
+            'area_arcsec2': float(npix[k] * pixel_arcsec2),
+            'area_beams': float(npix[k] / beam_pixels) if beam_pixels else None,
+            'flux': float(total[k] / beam_pixels) if beam_pixels else float(total[k]),
+            'peak': peak if has_pixels else None,
+            'peak_x': peak_x if has_pixels else None,
+            'peak_y': peak_y if has_pixels else None,
+            'centroid_x': float(centroid_x[k]) if valid[k] else None,
+            'centroid_y': float(centroid_y[k]) if valid[k] else None,
+            'centroid_ra': float(centroid_ra[k]) if valid[k] else None,
+            'centroid_dec': float(centroid_dec[k]) if valid[k] else None,
+        })
+    return stats
+
+
+def print_level_stats(stats, bunit=""):
+    """Imprime la tabla de estadísticas por nivel de threshold_levels()."""
+    print(f"{'nivel':>12} {'píxeles':>10} {'área (beams)':>13} {'flujo':>12} {'pico':>12} "
+          f"{'centroide (RA, Dec) [deg]':>28}")
+    for s in stats:
+        beams = f"{s['area_beams']:.2f}" if s['area_beams'] is not None else "-"
+        peak = f"{s['peak']:.4g}" if s['peak'] is not None else "-"
+        centroid = f"{s['centroid_ra']:.6f}, {s['centroid_dec']:.6f}" if s['centroid_ra'] is not None else "-"
+        print(f"{s['level']:>12.4g} {s['npix']:>10} {beams:>13} {s['flux']:>12.4g} {peak:>12} {centroid:>28}")
+    if bunit:
+        print(f"(pico en {bunit}; flujo = suma de los píxeles / área del beam, p. ej. Jy si la imagen está en Jy/beam)")
+
+
+def file_noise(fits_file, noise_method, channel=0, stokes=0):
+    """
+    Sigma del plano (channel, stokes) del archivo con un estimador de noise.py. Sin escalado
+    el plano es una vista del archivo memory-mapped y solo se leen las filas muestreadas; con
+    BSCALE/BZERO/BLANK (que astropy no escala sobre memmap) se lee y escala solo ese plano
+    con hdu.section.
+    """
+    with stage("noise", method=noise_method):
+        with fits.open(fits_file, memmap=True, lazy_load_hdus=True) as hdul:
+            scaled = any(key in hdul[0].header for key in ('BSCALE', 'BZERO', 'BLANK'))
+        with fits.open(fits_file, memmap=not scaled, lazy_load_hdus=True) as hdul:
+            hdu = hdul[0]
+            index = cube_index(hdu.header, channel, stokes)
+            plane = hdu.section[index] if scaled else hdu.data[index]
+            return estimate_sigma(plane, noise_method)
+
+
+def contour_products(fits_file, moment, method, sigma_value_arg, multipliers_arg, output_fits=None,
+                     mask_fits=None, index=None, channel=0, stokes=0, max_chunk_bytes=DEFAULT_MAX_CHUNK_BYTES,
+                     compute_stats=True, stats_cache=None):
+    """
+    Calcula los niveles (como contcal.py) y, en una sola pasada por bloques, el mapa de
+    índice de nivel, el cubo opcional de máscaras empaquetadas y las estadísticas por nivel.
+    La imagen nunca se carga completa: sirve para imágenes más grandes que la memoria.
+    Las estadísticas y el ruido son los del plano (channel, stokes). Si se da `index`
+    (FITSIndex) y el archivo indexado tiene un solo plano (nchan == nstokes == 1), el RMS
+    y el máximo se toman del índice; si no, se calculan en una pasada previa por bloques,
+    que con `stats_cache` (StatsCache de streaming_stats.py) se guarda en disco y no se
+    repite para el mismo archivo.
+
+    Retorna (levels, stats), con stats como en threshold_levels().
+    """
+    record = index.lookup(fits_file) if index is not None else None
+    with fits.open(fits_file, memmap=False, lazy_load_hdus=True) as hdul:
+        hdu = hdul[0]
+
+        def get_stats():
+            # Las estadísticas del índice son de todos los planos: solo valen para imágenes 2-D
+            single_plane = record is not None and record["nchan"] == 1 and record["nstokes"] == 1
+            if single_plane and record["data_max"] is not None:
+                return {'rms': record["data_rms"], 'max': record["data_max"], 'min': record["data_min"]}
+            with stage("stats"):
+                if stats_cache is not None:
+                    return file_stats(fits_file, channel, stokes, cache=stats_cache,
+                                      max_chunk_bytes=max_chunk_bytes).image_stats()
+                return chunked_stats(hdu, channel, stokes, max_chunk_bytes)
+
+        levels, _ = compute_levels(moment, method.lower(), sigma_value_arg, multipliers_arg, get_stats,
+                                   lambda noise_method: file_noise(fits_file, noise_method, channel, stokes))
+        with stage("threshold", levels=len(levels)):
+            stats = threshold_levels(hdu, levels, output_fits=output_fits, mask_fits=mask_fits, channel=channel,
+                                     stokes=stokes, max_chunk_bytes=max_chunk_bytes, compute_stats=compute_stats)
+    return levels, stats
+
+
+def make_contour_fits(fits_file, moment, method, sigma_value_arg, multipliers_arg, output_fits, index=None):
+    """
+    Equivalente NumPy de contcal.py: calcula los niveles y escribe el FITS de conteo
+    (por bloques, ver contour_products). Si se da `index` (FITSIndex) y el archivo es una
+    imagen 2-D indexada, las estadísticas (RMS, máximo) se toman del índice en vez de recalcularlas.
+    Retorna la lista de niveles usados.
+    """
+    levels, _ = contour_products(fits_file, moment, method, sigma_value_arg, multipliers_arg,
+                                 output_fits=output_fits, index=index, compute_stats=False)
+    return levels
@@ -0,0 +1,293 @@
+"""
+Trazado de contornos (polilíneas) con contourpy, con caché y exportación a regiones/GeoJSON.
+
+FITSPlotter.plot vuelve a ejecutar ax.contour sobre la grilla reproyectada completa en cada
+figura, y contcal.py solo genera un FITS de conteo de niveles (no la geometría). Aquí los
+contornos se trazan una sola vez por (imagen, niveles) sobre la grilla original de la
+imagen, se guardan como polilíneas en coordenadas del cielo (grados, en el sistema del WCS)
+y se reutilizan:
+    - para graficar sobre cualquier imagen (una transformación vectorizada a píxeles y una
+      LineCollection, sin volver a trazar), con cualquier estilo,
+    - para exportar regiones de DS9 o CASA (CRTF) y GeoJSON.
+Las polilíneas se guardan en una caché en disco (ContourCache), con clave formada por el
+hash de los datos, el WCS y los niveles.
+
+Uso:
+    python contour_lines.py <fits_file> <moment> <method> <sigma> <multipliers> [--ds9 f.reg] [--crtf f.crtf] [--geojson f.json]
+
+    Los argumentos <moment> <method> <sigma> <multipliers> son los mismos de contcal.py, p. ej.:
+    python contour_lines.py imagen.fits 0 sigma mad "3,5,10,20" --ds9 contornos.reg
+
+Uso desde Python:
+    from contour_lines import ContourLines
+    lines = ContourLines.trace(data, wcs, levels=[0.01, 0.02, 0.05])
+    lines.draw(ax, wcs_base, colors='white')
+    lines.to_ds9("contornos.reg")
+"""
+
+import os
+import json
+import hashlib
+import argparse
+import tempfile
+
+import numpy as np
+import contourpy
+from matplotlib.collections import LineCollection
+from astropy.io import fits
+from astropy.wcs import WCS
+from astropy.wcs.utils import wcs_to_celestial_frame
+
+from reproject_cache import default_cache_dir
+from contour_engine import compute_levels, image_stats
+from noise import estimate_sigma
+
+REGION_FRAMES = {"icrs": ("icrs", "ICRS"), "fk5": ("fk5", "J2000"), "fk4": ("fk4", "B1950"),
+                 "galactic": ("galactic", "GALACTIC")}
+
+
+def default_contour_cache_dir():
+    """Directorio de la caché de contornos, junto al de la caché de reproyección."""
+    return os.path.join(os.path.dirname(default_cache_dir()), "contours")
+
+
+def trace(data, levels):
+    """
+    Traza los contornos de `data` con contourpy. Los píxeles NaN quedan fuera.
+    Retorna una lista (una entrada por nivel) de listas de arreglos (N, 2) con (x, y) en píxeles.
+    """
+    z = np.ma.masked_invalid(np.asarray(data, dtype=np.float64))
+    generator = contourpy.contour_generator(z=z, name="serial", line_type="Separate", corner_mask=True)
+    return [[np.asarray(line) for line in generator.lines(level)] for level in levels]
+
+
+def pack(lines):
+    """Convierte las polilíneas por nivel en (vértices (M, 2), inicio de cada línea, nivel de cada línea)."""
+    flat = [(i, line) for i, level_lines in enumerate(lines) for line in level_lines]
+    if not flat:
+        return np.empty((0, 2)), np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int64)
+    vertices = np.concatenate([line for _, line in flat])
+    starts = np.concatenate([[0], np.cumsum([len(line) for _, line in flat])]).astype(np.int64)
+    line_levels = np.array([i for i, _ in flat], dtype=np.int64)
+    return vertices, starts, line_levels
+
+
+def unpack(vertices, starts, line_levels, nlevels):
+    """Inversa de pack()."""
+    lines = [[] for _ in range(nlevels)]
+    for k, level in enumerate(line_levels):
+        lines[level].append(vertices[starts[k]:starts[k + 1]])
+    return lines
+
+
+class ContourCache:
+    def __init__(self, cache_dir=None):
+        """Caché en disco de polilíneas de contornos (un .npz por entrada)."""
+        self.cache_dir = cache_dir or default_contour_cache_dir()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(data, wcs, levels):
+        """Clave: hash de los datos + WCS de la imagen + niveles."""
+        sha = hashlib.sha256()
+        data = np.ascontiguousarray(data)
+        sha.update(repr((data.shape, data.dtype.str)).encode())
+        sha.update(data.view(np.uint8).ravel())
+        sha.update(wcs.to_header_string(relax=True).encode())
+        sha.update(np.asarray(levels, dtype=np.float64).tobytes())
+        return sha.hexdigest()
+
+    def get(self, key):
+        """Retorna el ContourLines guardado, o None."""
+        try:
+            return ContourLines.load(os.path.join(self.cache_dir, f"{key}.npz"))
+        except (FileNotFoundError, OSError, ValueError, KeyError):
+            return None
+
+    def put(self, key, lines):
+        """Guarda un ContourLines (escritura atómica)."""
+        with tempfile.NamedTemporaryFile(dir=self.cache_dir, suffix=".tmp", delete=False) as tmp:
+            lines.save(tmp)
+        os.replace(tmp.name, os.path.join(self.cache_dir, f"{key}.npz"))
+
+
+class ContourLines:
+    def __init__(self, levels, lines, frame="icrs"):
+        """
+        Parámetros:
+            levels (array): Niveles de contorno.
+            lines (list): Por nivel, lista de arreglos (N, 2) con (lon, lat) en grados.
+            frame (str): Sistema de coordenadas de las polilíneas ('icrs', 'fk5', 'galactic'...).
+        """
+        self.levels = np.asarray(levels, dtype=np.float64)
+        self.lines = lines
+        self.frame = frame
+        self._pixel_cache = (None, None)
+
+    @classmethod
+    def trace(cls, data, wcs, levels, cache=None):
+        """
+        Traza los contornos de `data` (con su WCS celeste) y los convierte a coordenadas
+        del cielo con una sola transformación vectorizada. Con `cache` (ContourCache o
+        True para el directorio por defecto) se reutilizan los contornos ya trazados.
+        """
+        if cache is True:
+            cache = ContourCache()
+        levels = np.sort(np.asarray(levels, dtype=np.float64))
+        key = None
+        if cache is not None:
+            key = cache.make_key(data, wcs, levels)
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+
+        vertices, starts, line_levels = pack(trace(data, levels))
+        world = np.column_stack(wcs.pixel_to_world_values(vertices[:, 0], vertices[:, 1])) \
+            if len(vertices) else vertices
+        try:
+            frame = wcs_to_celestial_frame(wcs).name
+        except ValueError:
+            frame = "icrs"
+        lines = cls(levels, unpack(world, starts, line_levels, len(levels)), frame=frame)
+        if cache is not None:
+            cache.put(key, lines)
+        return lines
+
+    def pixel_lines(self, wcs):
+        """
+        Polilíneas en píxeles de `wcs` (una transformación para todos los vértices). Lista por
+        nivel. Se guarda el resultado del último WCS para redibujar sobre la misma imagen.
+        """
+        wcs_key = wcs.to_header_string(relax=True) + repr(wcs.array_shape)
+        if self._pixel_cache[0] == wcs_key:
+            return self._pixel_cache[1]
+        vertices, starts, line_levels = pack(self.lines)
+        if len(vertices):
+            vertices = np.column_stack(wcs.world_to_pixel_values(vertices[:, 0], vertices[:, 1]))
+        pixel_lines = unpack(vertices, starts, line_levels, len(self.levels))
+        self._pixel_cache = (wcs_key, pixel_lines)
+        return pixel_lines
+
+    def draw(self, ax, wcs, colors="white", linewidths=1, alpha=0.8, zorder=2):
+        """
+        Dibuja los contornos en `ax` (ejes en píxeles de `wcs`) con una sola LineCollection.
+        `colors` puede ser un color o una lista (uno por nivel). Retorna la colección.
+        """
+        pixel_lines = self.pixel_lines(wcs)
+        segments, segment_colors = [], []
+        per_level = not isinstance(colors, str) and len(colors) == len(self.levels)
+        for i, level_lines in enumerate(pixel_lines):
+            segments += level_lines
+            segment_colors += [colors[i] if per_level else colors] * len(level_lines)
+        collection = LineCollection(segments, colors=segment_colors or None, linewidths=linewidths,
+                                    alpha=alpha, zorder=zorder)
+        ax.add_collection(collection, autolim=False)
+        return collection
+
+    def region_polygons(self):
+        """
+        Itera (nivel, vértices, cerrada) sobre las polilíneas exportables como polígono: sin
+        repetir el vértice de cierre y con al menos 3 vértices distintos.
+        """
+        for level, level_lines in zip(self.levels, self.lines):
+            for line in level_lines:
+                closed = len(line) > 2 and np.allclose(line[0], line[-1])
+                vertices = line[:-1] if closed else line
+                if len(np.unique(vertices, axis=0)) >= 3:
+                    yield level, vertices, closed
+
+    def to_ds9(self, filename, color="green"):
+        """
+        Escribe un archivo de regiones de DS9 (un polígono por polilínea, con el nivel como tag).
+        Las líneas abiertas (que tocan el borde de la imagen) se marcan con el tag 'abierto'.
+        """
+        ds9_frame = REGION_FRAMES.get(self.frame, ("icrs", "ICRS"))[0]
+        with open(filename, "w") as f:
+            f.write("# Region file format: DS9 version 4.1\n")
+            f.write(f'global color={color} dashlist=8 3 width=1 font="helvetica 10 normal roman" '
+                    f"select=1 highlite=1 dash=0 fixed=0 edit=1 move=1 delete=1 include=1 source=1\n")
+            f.write(f"{ds9_frame}\n")
+            for level, vertices, closed in self.region_polygons():
+                coords = ",".join(f"{lon:.8f},{lat:.8f}" for lon, lat in vertices)
+                tags = f"tag={{{level:.6g}}}" + ("" if closed else " tag={abierto}")
+                f.write(f"polygon({coords}) # {tags}\n")
+
+    def to_crtf(self, filename, color="green"):
+        """Escribe un archivo de regiones de CASA (CRTF), un polígono por polilínea con el nivel como etiqueta."""
+        crtf_frame = REGION_FRAMES.get(self.frame, ("icrs", "ICRS"))[1]
+        with open(filename, "w") as f:
+            f.write("#CRTFv0 CASA Region Text Format version 0\n")
+            for level, vertices, closed in self.region_polygons():
+                coords = ", ".join(f"[{lon:.8f}deg, {lat:.8f}deg]" for lon, lat in vertices)
+                f.write(f'poly [{coords}] coord={crtf_frame}, color={color}, label="{level:.6g}"\n')
+
+    def to_geojson(self, filename=None):
+        """
+        GeoJSON (FeatureCollection) con un MultiLineString por nivel; coordenadas [lon, lat]
+        en grados. Si se da `filename` se escribe el archivo; retorna el diccionario.
+        """
+        features = [{
+            "type": "Feature",
+            "properties": {"level": float(level), "frame": self.frame},
+            "geometry": {"type": "MultiLineString", "coordinates": [line.tolist() for line in level_lines]},
+        } for level, level_lines in zip(self.levels, self.lines)]
+        collection = {"type": "FeatureCollection", "features": features}
+        if filename:
+            with open(filename, "w") as f:
+                json.dump(collection, f)
+        return collection
+
+    def save(self, file):
+        """Guarda las polilíneas en un .npz."""
+        vertices, starts, line_levels = pack(self.lines)
+        np.savez(file, levels=self.levels, vertices=vertices, starts=starts, line_levels=line_levels,
+                 frame=np.array(self.frame))
+
+    @classmethod
+    def load(cls, file):
+        """Lee un .npz escrito por save()."""
+        with np.load(file) as entry:
+            levels = entry["levels"]
+            lines = unpack(entry["vertices"], entry["starts"], entry["line_levels"], len(levels))
+            return cls(levels, lines, frame=str(entry["frame"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Trazado de contornos y exportación a regiones/GeoJSON")
+    parser.add_argument("fits_file", help="Archivo FITS de entrada")
+    parser.add_argument("moment", type=int, help="Momento de la imagen (0, 1 o 2)")
+    parser.add_argument("method", help="Método de niveles: sigma, imax o direct (como en contcal.py)")
+    parser.add_argument("sigma", help="Valor de sigma, 'auto' o un estimador de noise.py")
+    parser.add_argument("multipliers", help="Valores de contorno separados por comas")
+    parser.add_argument("--ds9", help="Archivo de regiones de DS9 de salida")
+    parser.add_argument("--crtf", help="Archivo de regiones de CASA (CRTF) de salida")
+    parser.add_argument("--geojson", help="Archivo GeoJSON de salida")
+    parser.add_argument("--no-cache", action="store_true", help="No usa la caché de contornos")
+    args = parser.parse_args(argv)
+
+    with fits.open(args.fits_file) as hdul:
+        header = hdul[0].header
+        data = np.squeeze(hdul[0].data)
+        try:
+            levels, _ = compute_levels(args.moment, args.method.lower(), args.sigma, args.multipliers,
+                                       lambda: image_stats(data),
+                                       lambda noise_method: estimate_sigma(data, noise_method))
+        except ValueError as error:
+            parser.exit(1, f"{error}\n")
+        lines = ContourLines.trace(data, WCS(header, naxis=2), levels, cache=None if args.no_cache else True)
+
+    for level, level_lines in zip(lines.levels, lines.lines):
+        print(f"Nivel {level:.6g}: {len(level_lines)} polilíneas")
+    if args.ds9:
+        lines.to_ds9(args.ds9)
+        print(f"Regiones DS9 guardadas en {args.ds9}")
+    if args.crtf:
+        lines.to_crtf(args.crtf)
+        print(f"Regiones CRTF guardadas en {args.crtf}")
+    if args.geojson:
+        lines.to_geojson(args.geojson)
+        print(f"GeoJSON guardado en {args.geojson}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Recortes (cutouts) de imágenes FITS: cálculo de la caja de píxeles a leer del disco.
+
+Las cajas se expresan como (y0, y1, x0, x1) en píxeles (base 0, y1/x1 excluidos), en el
+mismo orden que los índices de numpy. Con la caja se lee solo esa sección del archivo
+(`hdu.section`) y se construye el WCS recortado con `wcs[y0:y1, x0:x1]`.
+
+Uso:
+    from cutout import sky_box, footprint_box
+    box = sky_box(wcs, shape, "18h20m24.82s -16d11m34.9s", 120)       # caja de 2' x 2'
+    box_contour = footprint_box(wcs_contour, shape_contour, wcs[box[0]:box[1], box[2]:box[3]],
+                                (box[1] - box[0], box[3] - box[2]))
+"""
+
+import numpy as np
+import astropy.units as u
+from astropy.coordinates import SkyCoord
+from astropy.wcs.utils import pixel_to_pixel, proj_plane_pixel_scales
+
+# Píxeles extra alrededor de la huella de contornos (margen para la interpolación)
+FOOTPRINT_PADDING = 2
+
+
+def parse_center(center):
+    """Convierte el centro en SkyCoord (acepta SkyCoord, "18h20m24.82s -16d11m34.9s" o (ra, dec) en grados)."""
+    if isinstance(center, SkyCoord):
+        return center
+    if isinstance(center, str):
+        return SkyCoord(center, frame='icrs')
+    ra, dec = center
+    if isinstance(ra, str):
+        return SkyCoord(ra=ra, dec=dec, frame='icrs')
+    return SkyCoord(ra=ra * u.deg, dec=dec * u.deg, frame='icrs')
+
+
+def parse_size(size):
+    """Tamaño (ancho, alto) del recorte en arcosegundos. Acepta Quantity, número (arcsec) o par."""
+    if isinstance(size, (tuple, list)):
+        width, height = size
+    else:
+        width = height = size
+    return tuple(s.to_value(u.arcsec) if isinstance(s, u.Quantity) else float(s) for s in (width, height))
+
+
+def clip_box(box, shape):
+    """Recorta la caja a los límites de la imagen; None si queda vacía."""
+    y0, y1, x0, x1 = box
+    ny, nx = shape
+    y0, y1 = max(0, int(y0)), min(ny, int(y1))
+    x0, x1 = max(0, int(x0)), min(nx, int(x1))
+    if y1 <= y0 or x1 <= x0:
+        return None
+    return (y0, y1, x0, x1)
+
+
+def sky_box(wcs, shape, center, size):
+    """
+    Caja de píxeles de un recorte centrado en `center` con tamaño `size` (arcsec o Quantity).
+    Lanza ValueError si el recorte queda fuera de la imagen.
+    """
+    x, y = wcs.world_to_pixel(parse_center(center))
+    width, height = parse_size(size)
+    scale_x, scale_y = proj_plane_pixel_scales(wcs) * 3600  # arcsec/pixel
+    half_x, half_y = width / scale_x / 2, height / scale_y / 2
+    box = (np.floor(y - half_y + 0.5), np.ceil(y + half_y + 0.5),
+           np.floor(x - half_x + 0.5), np.ceil(x + half_x + 0.5))
+    box = clip_box(box, shape)
+    if box is None:
+        raise ValueError(f"El recorte centrado en {center} queda fuera de la imagen.")
+    return box
+
+
+def footprint_box(wcs_in, shape_in, wcs_out, shape_out, samples=64, padding=FOOTPRINT_PADDING):
+    """
+    Caja de la imagen de entrada que cubre la grilla de salida (wcs_out, shape_out).
+
+    Se transforman puntos del borde de la grilla de salida a píxeles de entrada y se toma
+    su rectángulo envolvente más un margen. Retorna None si no hay superposición.
+    """
+    ny, nx = shape_out
+    xs = np.linspace(-0.5, nx - 0.5, samples)
+    ys = np.linspace(-0.5, ny - 0.5, samples)
+    edge_x = np.concatenate([xs, xs, np.full(samples, -0.5), np.full(samples, nx - 0.5)])
+    edge_y = np.concatenate([np.full(samples, -0.5), np.full(samples, ny - 0.5), ys, ys])
+    x_in, y_in = pixel_to_pixel(wcs_out, wcs_in, edge_x, edge_y)
+    if not np.any(np.isfinite(x_in) & np.isfinite(y_in)):
+        return None
+    box = (np.floor(np.nanmin(y_in)) - padding, np.ceil(np.nanmax(y_in)) + 1 + padding,
+           np.floor(np.nanmin(x_in)) - padding, np.ceil(np.nanmax(x_in)) + 1 + padding)
+    return clip_box(box, shape_in)
+
+
+def slice_wcs(wcs, box):
+    """WCS de la sección `box` de la imagen."""
+    y0, y1, x0, x1 = box
+    return wcs[y0:y1, x0:x1]
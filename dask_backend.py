@@ -0,0 +1,232 @@
+"""
+Backend dask (opcional) para FITSPlotter y contcal.py: ejecución por bloques y en varios núcleos.
+
+Con el backend NumPy, fits_plotter.py y contcal.py usan un solo núcleo y necesitan la imagen
+completa en memoria. Aquí el plano 2-D de un FITS se expone como un arreglo dask por bloques
+(cada bloque se lee del archivo con np.memmap solo cuando se calcula), y las operaciones
+sobre la imagen base, la de contornos y los cubos se ejecutan por bloques en paralelo:
+    - mínimo/máximo ignorando NaN y estadísticas (RMS, máximo, mínimo) para los niveles,
+    - mapa de conteo de niveles de contcal.py (escrito bloque a bloque en el FITS de salida),
+    - promedio por bloques para el nivel de detalle (downsample.block_average).
+Cada bloque usa exactamente las mismas funciones que el camino NumPy (level_count_map,
+block_average), de modo que los resultados coinciden con él.
+
+Schedulers (parámetro `scheduler`):
+    "threads" (por defecto), "processes", "synchronous", "distributed" (un LocalCluster
+    en esta máquina, requiere dask.distributed) o la dirección de un scheduler existente
+    ("tcp://host:8786").
+
+Uso:
+    plotter = FITSPlotter("mosaico.fits", "contornos.fits", backend="dask", scheduler="threads", workers=8)
+    plotter.plot(downsample="auto")
+
+    python contcal.py mosaico.fits 0 sigma auto "3,5,10" salida.fits dask --scheduler=processes --workers=8
+
+Requiere dask (pip install "dask[array]"); el scheduler "distributed" requiere además
+dask.distributed (pip install distributed).
+"""
+
+import os
+import multiprocessing
+import multiprocessing.util
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import dask
+import dask.array as da
+from astropy.io import fits
+
+from fits_index import BITPIX_DTYPES, scale_plane
+from moments import cube_index
+from downsample import block_average as numpy_block_average
+from profiling import stage
+from contour_engine import (compute_levels, level_count_map as numpy_level_count_map, plane_header,
+                            create_fits, file_noise)
+
+SCHEDULERS = ("threads", "processes", "synchronous", "distributed")
+DEFAULT_CHUNK_BYTES = 64 * 1024 ** 2  # Tamaño objetivo de cada bloque (en float64)
+
+_clients = {}  # Clientes de dask.distributed ya creados en este proceso, por (scheduler, workers)
+_pools = {}  # Pools del scheduler "processes", por número de workers (dask crea uno nuevo en cada compute)
+
+
+class FITSPlane:
+    """
+    Plano 2-D de un archivo FITS que se lee por secciones con np.memmap (sin astropy).
+    Solo guarda la ruta y la posición de los datos, así que se puede enviar a otros
+    procesos (schedulers "processes" y "distributed").
+    """
+
+    def __init__(self, filename, header, data_offset, index):
+        self.filename = os.path.abspath(filename)
+        self.header = fits.Header({key: header[key] for key in ("BITPIX", "BSCALE", "BZERO", "BLANK")
+                                   if key in header})
+        self.data_offset = data_offset
+        self.index = index
+        self.full_shape = tuple(header[f"NAXIS{axis}"] for axis in range(header["NAXIS"], 0, -1))
+        self.shape = self.full_shape[-2:]
+        self.ndim = 2
+        self.dtype = scale_plane(np.zeros(1, dtype=BITPIX_DTYPES[header["BITPIX"]]), self.header).dtype
+
+    def __getitem__(self, key):
+        data = np.memmap(self.filename, dtype=BITPIX_DTYPES[self.header["BITPIX"]], mode="r",
+                         offset=self.data_offset, shape=self.full_shape)
+        block = np.array(data[self.index + tuple(key)])
+        del data
+        return scale_plane(block, self.header)
+
+
+def from_fits(filename, channel=0, stokes=0, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """
+    Abre el plano (canal, Stokes) de un FITS como arreglo dask, sin leer los datos.
+    Los bloques son franjas de filas completas de ~chunk_bytes. Retorna (header, arreglo).
+    """
+    with fits.open(filename, memmap=True, lazy_load_hdus=True) as hdul:
+        hdu = hdul[0]
+        header = hdu.header.copy()
+        data_offset = hdu.fileinfo()["datLoc"]
+    if header["BITPIX"] not in BITPIX_DTYPES:
+        raise ValueError(f"BITPIX {header['BITPIX']} no soportado en {filename}")
+    plane = FITSPlane(filename, header, data_offset, cube_index(header, channel, stokes)[:-2])
+    ny, nx = plane.shape
+    rows = max(1, min(ny, int(chunk_bytes // (nx * 8))))
+    stat = os.stat(filename)
+    name = "fits-" + dask.base.tokenize(plane.filename, stat.st_mtime_ns, stat.st_size, channel, stokes, rows)
+    return header, da.from_array(plane, chunks=(rows, nx), name=name, lock=False,
+                                 meta=np.empty((0, 0), dtype=plane.dtype))
+
+
+@contextmanager
+def use_scheduler(scheduler="threads", workers=None):
+    """Contexto en el que los cálculos de dask usan el scheduler y número de workers indicados."""
+    scheduler = scheduler or "threads"
+    if scheduler == "distributed" or "://" in scheduler:
+        try:
+            from dask.distributed import Client, LocalCluster
+        except ImportError:
+            raise ImportError("El scheduler 'distributed' requiere dask.distributed (pip install distributed).")
+        key = (scheduler, workers)
+        if key not in _clients:
+            if scheduler == "distributed":
+                cluster = LocalCluster(n_workers=workers, threads_per_worker=1, processes=True)
+                _clients[key] = Client(cluster, set_as_default=False)
+            else:
+                _clients[key] = Client(scheduler, set_as_default=False)
+        with dask.config.set(scheduler=_clients[key].get):
+            yield
+        return
+    if scheduler not in SCHEDULERS:
+        raise ValueError(f"Scheduler desconocido '{scheduler}'. Use uno de: {', '.join(SCHEDULERS)}")
+    if scheduler == "processes":
+        if workers not in _pools:
+            pool = ProcessPoolExecutor(workers or os.cpu_count(), mp_context=multiprocessing.get_context("spawn"))
+            # En un proceso hijo de multiprocessing los hijos se esperan antes de atexit: el pool se
+            # cierra en un finalizador con prioridad mayor que la de sus colas, o el proceso no termina
+            multiprocessing.util.Finalize(pool, pool.shutdown, exitpriority=100)
+            _pools[workers] = pool
+        with dask.config.set(scheduler=scheduler, pool=_pools[workers]):
+            yield
+        return
+    with dask.config.set(scheduler=scheduler, num_workers=workers):
+        yield
+
+
+def compute(*arrays, scheduler="threads", workers=None):
+    """Calcula los arreglos dask con el scheduler indicado (uno o una tupla de resultados)."""
+    with use_scheduler(scheduler, workers):
+        results = dask.compute(*arrays)
+    return results[0] if len(results) == 1 else results
+
+
+def nan_min_max(data):
+    """(mínimo, máximo) ignorando NaN, como np.nanmin/np.nanmax (arreglos dask, sin calcular)."""
+    return da.nanmin(data), da.nanmax(data)
+
+
+def streaming_stats(data, scheduler="threads", workers=None):
+    """
+    StreamingStats (streaming_stats.py) de un arreglo dask: un resumen por bloque, en
+    paralelo, y la unión de los resúmenes (los histogramas se suman).
+    """
+    from streaming_stats import StreamingStats
+    parts = [dask.delayed(StreamingStats.from_array)(block) for block in data.to_delayed().ravel()]
+    return compute(dask.delayed(StreamingStats.merge_all)(parts), scheduler=scheduler, workers=workers)
+
+
+def nan_stats(data):
+    """Como contour_engine.image_stats (RMS, máximo y mínimo de los píxeles finitos), sin calcular."""
+    finite = da.isfinite(data)
+    values = da.where(finite, data, 0).astype(np.float64)
+    count = finite.sum()
+    rms = da.sqrt((values ** 2).sum() / count)
+    vmax = da.where(finite, data, -np.inf).max()
+    vmin = da.where(finite, data, np.inf).min()
+    return count, rms, vmax, vmin
+
+
+def image_stats(data, scheduler="threads", workers=None):
+    """Estadísticas de contour_engine.image_stats calculadas por bloques en paralelo."""
+    count, rms, vmax, vmin = compute(*nan_stats(data), scheduler=scheduler, workers=workers)
+    if count == 0:
+        return {'rms': None, 'max': None, 'min': None}
+    return {'rms': float(rms), 'max': float(vmax), 'min': float(vmin)}
+
+
+def block_average(data, factor):
+    """
+    downsample.block_average por bloques: los bloques de dask se alinean a múltiplos de
+    `factor` y cada uno se promedia con la misma función, así que el resultado es idéntico.
+    """
+    if factor <= 1:
+        return data
+    aligned = tuple(max(factor, (max(chunks) // factor) * factor) for chunks in data.chunks)
+    data = data.rechunk(aligned)
+    out_chunks = tuple(tuple(-(-c // factor) for c in chunks) for chunks in data.chunks)
+    return data.map_blocks(numpy_block_average, factor, chunks=out_chunks, dtype=np.float64)
+
+
+def level_count_map(data, levels):
+    """contour_engine.level_count_map aplicado bloque a bloque."""
+    return data.map_blocks(numpy_level_count_map, levels, dtype=np.float32)
+
+
+def _write_block(block, filename, offset, shape, dtype, block_info=None):
+    """Escribe un bloque en su posición del archivo de salida (cada worker abre su memmap)."""
+    (y0, y1), (x0, x1) = block_info[0]["array-location"]
+    out = np.memmap(filename, dtype=dtype, mode="r+", offset=offset, shape=shape)
+    out[y0:y1, x0:x1] = block
+    out.flush()
+    del out
+    return np.zeros((1, 1), dtype=np.int8)
+
+
+def store_fits(data, filename, header, scheduler="threads", workers=None):
+    """Escribe un arreglo dask 2-D en un FITS nuevo bloque a bloque (sin reunirlo en memoria)."""
+    shape = tuple(header[f"NAXIS{n}"] for n in range(header["NAXIS"], 0, -1))
+    out = create_fits(filename, header, shape, ">f4")
+    offset = out.offset
+    del out
+    written = data.map_blocks(_write_block, filename, offset, data.shape, ">f4",
+                              chunks=tuple((1,) * len(chunks) for chunks in data.chunks), dtype=np.int8)
+    compute(written, scheduler=scheduler, workers=workers)
+
+
+def make_contour_fits(fits_file, moment, method, sigma_value_arg, multipliers_arg, output_fits,
+                      scheduler="threads", workers=None, channel=0, stokes=0, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """
+    Equivalente de contour_engine.make_contour_fits con dask: las estadísticas y el mapa
+    de conteo de niveles se calculan por bloques en paralelo. Retorna la lista de niveles.
+    """
+    header, data = from_fits(fits_file, channel=channel, stokes=stokes, chunk_bytes=chunk_bytes)
+    def get_stats():
+        with stage("stats", scheduler=scheduler):
+            return image_stats(data, scheduler, workers)
+
+    levels, _ = compute_levels(moment, method.lower(), sigma_value_arg, multipliers_arg, get_stats,
+                               lambda noise_method: file_noise(fits_file, noise_method, channel, stokes))
+    sorted_levels = np.sort(np.asarray(levels, dtype=np.float64))
+    with stage("threshold", levels=len(levels), scheduler=scheduler):
+        store_fits(level_count_map(data, sorted_levels), output_fits, plane_header(header, sorted_levels),
+                   scheduler=scheduler, workers=workers)
+    return levels
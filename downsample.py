@@ -0,0 +1,79 @@
+"""
+Reducción de resolución (nivel de detalle) de imágenes para graficar imágenes muy grandes.
+
+Una figura de 10x8 pulgadas no puede mostrar más de unos miles de píxeles por lado, así que
+rasterizar con imshow (o trazar contornos sobre) una imagen de 8k+ píxeles es trabajo
+desperdiciado. Aquí se promedian bloques de `factor` x `factor` píxeles ignorando los NaN,
+y se calculan las coordenadas de píxel (de la grilla original) que corresponden a cada
+bloque, de modo que las transformaciones WCS de los ejes siguen siendo correctas.
+
+Uso:
+    from downsample import auto_factor, block_average, block_extent
+    factor = auto_factor(data.shape, figsize=(10, 8), dpi=300)
+    small = block_average(data, factor)
+    ax.imshow(small, origin='lower', extent=block_extent(small.shape, factor))
+"""
+
+import numpy as np
+
+# Número máximo aproximado de elementos procesados por franja en block_average
+BAND_ELEMENTS = 16 * 1024 ** 2
+
+
+def auto_factor(shape, figsize=(10, 8), dpi=100):
+    """
+    Factor de reducción entero tal que la imagen reducida conserve al menos un píxel
+    de datos por píxel de la figura (1 si la imagen ya cabe en la figura).
+    """
+    ny, nx = shape[-2:]
+    width_px, height_px = figsize[0] * dpi, figsize[1] * dpi
+    return max(1, int(min(nx / width_px, ny / height_px)))
+
+
+def block_average(data, factor):
+    """
+    Promedio por bloques de `factor` x `factor` píxeles que ignora los NaN.
+
+    Los bordes que no completan un bloque se rellenan con NaN (el bloque parcial es el
+    promedio de sus píxeles válidos). Los bloques sin píxeles válidos quedan en NaN.
+    Se procesa por franjas de filas para no crear temporales del tamaño de la imagen.
+    """
+    if factor <= 1:
+        return data
+    ny, nx = data.shape[-2:]
+    out_ny, out_nx = -(-ny // factor), -(-nx // factor)
+    result = np.empty((out_ny, out_nx), dtype=np.float64)
+
+    rows_per_band = max(1, BAND_ELEMENTS // (nx * factor)) * factor
+    for y0 in range(0, ny, rows_per_band):
+        band = np.asarray(data[y0:y0 + rows_per_band], dtype=np.float64)
+        band_ny = band.shape[0]
+        pad_y, pad_x = (-band_ny) % factor, (-nx) % factor
+        if pad_y or pad_x:
+            band = np.pad(band, ((0, pad_y), (0, pad_x)), constant_values=np.nan)
+
+        valid = np.isfinite(band)
+        blocks_shape = (band.shape[0] // factor, factor, out_nx, factor)
+        sums = np.where(valid, band, 0.0).reshape(blocks_shape).sum(axis=(1, 3))
+        counts = valid.reshape(blocks_shape).sum(axis=(1, 3))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.where(counts > 0, sums / counts, np.nan)
+        result[y0 // factor:y0 // factor + means.shape[0]] = means
+    return result
+
+
+def block_extent(shape, factor):
+    """
+    Extent (izquierda, derecha, abajo, arriba) en píxeles de la grilla original para
+    mostrar con imshow una imagen reducida por `factor`.
+    """
+    out_ny, out_nx = shape[-2:]
+    return (-0.5, out_nx * factor - 0.5, -0.5, out_ny * factor - 0.5)
+
+
+def block_centers(shape, factor):
+    """Coordenadas (x, y) de píxel original del centro de cada bloque, para ax.contour."""
+    out_ny, out_nx = shape[-2:]
+    x = np.arange(out_nx) * factor + (factor - 1) / 2.0
+    y = np.arange(out_ny) * factor + (factor - 1) / 2.0
+    return x, y
@@ -0,0 +1,105 @@
+"""
+Exportación sin pantalla de muchas figuras reutilizando una misma figura (plantilla).
+
+FITSPlotter.plot construye una figura nueva con pyplot y llama a plt.show(); en trabajos
+en lote eso deja figuras abiertas y la memoria crece con cada imagen. FigureTemplate crea
+una sola figura de matplotlib (canvas Agg, fuera de pyplot) y la reutiliza: en cada imagen
+se actualizan en el lugar los datos de la imagen, los contornos, los beams y las anotaciones
+(FITSPlotter.draw) en vez de reconstruir los ejes WCS, la barra de color y las etiquetas.
+
+Uso:
+    from export import FigureTemplate
+    with FigureTemplate(figsize=(10, 8), dpi=300) as template:
+        for image_fits, output in pares:
+            with FITSPlotter(image_fits, moment='m0') as plotter:
+                template.update(plotter, title=output)
+                template.savefig(output)          # o template.to_bytes("png")
+
+Para una sola figura basta con FITSPlotter.export("png") o FITSPlotter.render().
+"""
+
+import io
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from fits_plotter import release_figure
+from profiling import stage
+
+
+class FigureTemplate:
+    """Figura y ejes WCS reutilizables para exportar muchas imágenes sin reconstruirlos."""
+
+    def __init__(self, figsize=(10, 8), dpi=300):
+        self.figsize = figsize
+        self.dpi = dpi
+        self.fig = None
+        self.ax = None
+        self.artists = None
+        self._bbox = None
+        self._layout_key = None
+
+    def update(self, plotter, title="", contour_levels=None, downsample=None):
+        """
+        Dibuja la imagen de `plotter` (FITSPlotter) en la plantilla.
+
+        La primera llamada crea la figura y los ejes con el WCS de la imagen; las siguientes
+        solo actualizan los elementos existentes (y el WCS de los ejes si cambia).
+        """
+        if self.fig is None:
+            with stage("figure"):
+                self.fig = Figure(figsize=self.figsize)
+                FigureCanvasAgg(self.fig)
+                self.ax = self.fig.add_subplot(projection=plotter.wcs_base)
+        self.artists = plotter.draw(self.ax, title=title, contour_levels=contour_levels,
+                                    downsample=downsample, dpi=self.dpi, artists=self.artists)
+
+        # El recuadro ajustado (bbox_inches='tight') solo cambia si cambian las etiquetas de los ejes
+        layout_key = (plotter.wcs_base.to_header_string(), plotter.colorbar_label, bool(title))
+        if layout_key != self._layout_key:
+            self._bbox = None
+            self._layout_key = layout_key
+        return self.fig
+
+    def _tight_bbox(self):
+        """Recuadro ajustado de la figura; se calcula una vez por disposición y se reutiliza."""
+        if self._bbox is None:
+            self.fig.canvas.draw()
+            self._bbox = self.fig.get_tightbbox(self.fig.canvas.get_renderer()).padded(0.1)
+        return self._bbox
+
+    def to_bytes(self, fmt="png"):
+        """Contenido de la figura actual en el formato indicado (png, pdf, svg...)."""
+        if self.fig is None:
+            raise ValueError("La plantilla está vacía: llame a update() antes de exportar.")
+        buffer = io.BytesIO()
+        self.savefig(buffer, fmt=fmt)
+        return buffer.getvalue()
+
+    def savefig(self, filename, fmt=None):
+        """
+        Guarda la figura actual en `filename` (el formato se deduce de la extensión).
+
+        A diferencia de bbox_inches='tight', que dibuja la figura dos veces en cada guardado,
+        el recuadro ajustado se reutiliza entre imágenes con la misma disposición.
+        """
+        if self.fig is None:
+            raise ValueError("La plantilla está vacía: llame a update() antes de guardar.")
+        with stage("savefig", fmt=fmt, dpi=self.dpi):
+            self.fig.savefig(filename, format=fmt, dpi=self.dpi, bbox_inches=self._tight_bbox())
+
+    def close(self):
+        """Libera la figura y todos sus artistas."""
+        if self.fig is not None:
+            release_figure(self.fig)
+        self.fig = None
+        self.ax = None
+        self.artists = None
+        self._bbox = None
+        self._layout_key = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
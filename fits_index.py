@@ -0,0 +1,486 @@
+"""
+Índice de metadatos de archivos FITS (header, WCS, beam, forma, estadísticas) en SQLite.
+
+Con archivos de decenas de miles de imágenes, saber qué archivos cubren una posición o
+tienen un beam dado obliga a abrir y parsear todos los headers. FITSIndex recorre un
+árbol de directorios una vez y guarda por archivo:
+    - el header completo (texto), la forma (nx, ny, canales, Stokes) y la posición de
+      los datos en el archivo (para leer planos sin volver a parsear el header),
+    - la huella en el cielo (esquinas, centro y radio del círculo que la contiene),
+    - el beam (BMAJ/BMIN en arcsec, BPA en grados) y el tipo de momento (m0, m1, m2,
+      continuo o cubo, deducido del nombre del archivo),
+    - mínimo, máximo y RMS (como imstat en contcal.py) y el SHA-256 del contenido.
+Las actualizaciones son incrementales: solo se vuelven a indexar los archivos cuyo tamaño
+o mtime cambiaron, y se eliminan las entradas de archivos borrados.
+
+Uso:
+    python fits_index.py scan <directorio> [--db indice.sqlite] [--no-stats] [--no-checksum]
+    python fits_index.py query [--ra 275.1034 --dec -16.193 --radius 30] [--moment m0] [--bmaj 0.5:2]
+
+Uso desde Python:
+    from fits_index import FITSIndex
+    index = FITSIndex()
+    index.scan("/datos/alma")
+    files = index.query(cone=(275.1034, -16.193, 30), moment="m0", bmaj=(0.5, 2.0))
+    plotter = FITSPlotter(files[0]["path"], lazy=True, index=index)   # sin parsear el header
+
+El archivo por defecto es ~/.cache/fits_plotting_tool/index.sqlite, o el indicado en la
+variable de entorno FITS_PLOTTER_INDEX.
+"""
+
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from astropy.io import fits
+from astropy.wcs import WCS
+from astropy.wcs.utils import proj_plane_pixel_scales
+
+from reproject_cache import HASH_CHUNK
+
+DEFAULT_INDEX_FILE = os.path.join(os.path.expanduser("~"), ".cache", "fits_plotting_tool", "index.sqlite")
+
+FITS_EXTENSIONS = (".fits", ".fit", ".fts")
+
+# Tipo de datos de numpy según BITPIX
+BITPIX_DTYPES = {8: "u1", 16: ">i2", 32: ">i4", 64: ">i8", -32: ">f4", -64: ">f8"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path        TEXT PRIMARY KEY,
+    size        INTEGER NOT NULL,
+    mtime_ns    INTEGER NOT NULL,
+    sha256      TEXT,
+    header      TEXT NOT NULL,
+    data_offset INTEGER,
+    bitpix      INTEGER,
+    nx          INTEGER,
+    ny          INTEGER,
+    nchan       INTEGER,
+    nstokes     INTEGER,
+    moment      TEXT,
+    bunit       TEXT,
+    bmaj        REAL,
+    bmin        REAL,
+    bpa         REAL,
+    ra_center   REAL,
+    dec_center  REAL,
+    radius      REAL,
+    footprint   TEXT,
+    data_min    REAL,
+    data_max    REAL,
+    data_rms    REAL,
+    indexed_at  REAL
+);
+CREATE INDEX IF NOT EXISTS files_dec ON files (dec_center);
+CREATE INDEX IF NOT EXISTS files_moment ON files (moment);
+CREATE INDEX IF NOT EXISTS files_bmaj ON files (bmaj);
+"""
+
+# Columnas retornadas por las consultas (el header se obtiene aparte con header())
+RECORD_COLUMNS = ("path", "size", "mtime_ns", "sha256", "nx", "ny", "nchan", "nstokes", "moment",
+                  "bunit", "bmaj", "bmin", "bpa", "ra_center", "dec_center", "radius",
+                  "data_min", "data_max", "data_rms")
+
+
+def default_index_file():
+    """Archivo del índice: variable FITS_PLOTTER_INDEX o ~/.cache/fits_plotting_tool/index.sqlite."""
+    return os.environ.get("FITS_PLOTTER_INDEX", DEFAULT_INDEX_FILE)
+
+
+def guess_moment(filename, header):
+    """Tipo de imagen según el nombre del archivo: 'm0', 'm1', 'm2', 'continuo', 'cubo' o None."""
+    name = os.path.basename(filename).lower()
+    match = re.search(r"(?:^|[._-])(?:m|mom|moment)([012])(?:[._-]|$)", name)
+    if match:
+        return f"m{match.group(1)}"
+    if re.search(r"(?:^|[._-])cont(?:inuum|inuo)?(?:[._-]|$)", name):
+        return "continuo"
+    if axis_length(header, "spectral") > 1:
+        return "cubo"
+    return None
+
+
+def axis_length(header, kind):
+    """Longitud del eje espectral ('spectral') o Stokes ('stokes'); 1 si no existe."""
+    for axis in range(3, header.get("NAXIS", 0) + 1):
+        is_stokes = str(header.get(f"CTYPE{axis}", "")).upper().startswith("STOKES")
+        if is_stokes == (kind == "stokes"):
+            return header[f"NAXIS{axis}"]
+    return 1
+
+
+def sky_footprint(wcs, shape):
+    """Esquinas (ra, dec) de la imagen, centro y radio (grados) del círculo que las contiene."""
+    corners = wcs.calc_footprint(axes=(shape[1], shape[0]))
+    ra, dec = np.radians(corners[:, 0]), np.radians(corners[:, 1])
+    vectors = np.stack([np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra), np.sin(dec)], axis=1)
+    center = vectors.mean(axis=0)
+    center /= np.linalg.norm(center)
+    radius = np.degrees(np.arccos(np.clip(vectors @ center, -1.0, 1.0))).max()
+    ra_center = np.degrees(np.arctan2(center[1], center[0])) % 360.0
+    dec_center = np.degrees(np.arcsin(center[2]))
+    return corners, float(ra_center), float(dec_center), float(radius)
+
+
+def angular_separation(ra1, dec1, ra2, dec2):
+    """Separación angular (grados) entre posiciones en grados (vectorizada)."""
+    ra1, dec1, ra2, dec2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (ra1, dec1, ra2, dec2))
+    cos_sep = np.sin(dec1) * np.sin(dec2) + np.cos(dec1) * np.cos(dec2) * np.cos(ra1 - ra2)
+    return np.degrees(np.arccos(np.clip(cos_sep, -1.0, 1.0)))
+
+
+def data_stats(hdu):
+    """Mínimo, máximo y RMS de todos los píxeles finitos, leyendo un plano por vez."""
+    header = hdu.header
+    ndim = header["NAXIS"]
+    nplanes = int(np.prod([header[f"NAXIS{axis}"] for axis in range(3, ndim + 1)])) if ndim > 2 else 1
+    vmin, vmax, sum_sq, count = np.inf, -np.inf, 0.0, 0
+    for i in range(nplanes):
+        index = np.unravel_index(i, hdu.shape[:-2]) if ndim > 2 else ()
+        plane = np.asarray(hdu.section[tuple(index)], dtype=np.float64)
+        finite = plane[np.isfinite(plane)]
+        if finite.size:
+            vmin, vmax = min(vmin, finite.min()), max(vmax, finite.max())
+            sum_sq += float(np.dot(finite, finite))
+            count += finite.size
+    if count == 0:
+        return None, None, None
+    return float(vmin), float(vmax), float(np.sqrt(sum_sq / count))
+
+
+def scale_plane(plane, header):
+    """
+    Aplica BSCALE/BZERO y BLANK (como astropy) a datos leídos crudos del archivo y los
+    retorna en el orden de bytes nativo. Sin escalado ni BLANK, el tipo no cambia.
+    """
+    bitpix = header["BITPIX"]
+    bscale, bzero = header.get("BSCALE", 1), header.get("BZERO", 0)
+    blank = header.get("BLANK") if bitpix > 0 else None
+    if blank is not None or bscale != 1 or bzero != 0:
+        scaled = plane.astype(np.float32 if bitpix <= 16 else np.float64)
+        if blank is not None:
+            scaled[plane == blank] = np.nan
+        plane = scaled * bscale + bzero if (bscale != 1 or bzero != 0) else scaled
+    return plane.astype(plane.dtype.newbyteorder('='), copy=False)
+
+
+def file_sha256(path):
+    """SHA-256 del contenido del archivo (lectura por bloques)."""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_CHUNK), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def read_file_metadata(path, stats=True, checksum=True):
+    """Lee los metadatos de un archivo FITS (se ejecuta en un hilo). Retorna un diccionario."""
+    stat = os.stat(path)
+    with fits.open(path, memmap=True, lazy_load_hdus=True) as hdul:
+        hdu = hdul[0]
+        header = hdu.header
+        info = hdu.fileinfo()
+        record = {
+            "path": path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+            "header": header.tostring(), "data_offset": info["datLoc"] if info else None,
+            "bitpix": header["BITPIX"], "nx": header.get("NAXIS1"), "ny": header.get("NAXIS2"),
+            "nchan": axis_length(header, "spectral"), "nstokes": axis_length(header, "stokes"),
+            "moment": guess_moment(path, header), "bunit": header.get("BUNIT"),
+            "bmaj": header["BMAJ"] * 3600 if "BMAJ" in header else None,
+            "bmin": header["BMIN"] * 3600 if "BMIN" in header else None,
+            "bpa": header.get("BPA"),
+            "ra_center": None, "dec_center": None, "radius": None, "footprint": None,
+            "data_min": None, "data_max": None, "data_rms": None,
+        }
+        if header.get("NAXIS", 0) >= 2:
+            try:
+                corners, ra, dec, radius = sky_footprint(WCS(header, naxis=2), (header["NAXIS2"], header["NAXIS1"]))
+                record.update(ra_center=ra, dec_center=dec, radius=radius,
+                              footprint=json.dumps(corners.tolist()))
+            except Exception:  # Header sin WCS celeste válido: se indexa sin huella
+                pass
+    if stats and record["nx"] and record["ny"]:
+        # Sin memmap: las páginas leídas no se acumulan en el RSS y se aceptan datos escalados
+        with fits.open(path, memmap=False, lazy_load_hdus=True) as hdul:
+            record["data_min"], record["data_max"], record["data_rms"] = data_stats(hdul[0])
+    record["sha256"] = file_sha256(path) if checksum else None
+    record["indexed_at"] = time.time()
+    return record
+
+
+class FITSIndex:
+    def __init__(self, index_file=None):
+        """
+        Parámetros:
+            index_file (str, opcional): Archivo SQLite del índice (se crea si no existe).
+        """
+        self.index_file = index_file or default_index_file()
+        directory = os.path.dirname(os.path.abspath(self.index_file))
+        os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(self.index_file)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+        self._wcs = {}  # WCS ya construidos en este proceso, por (ruta, mtime)
+
+    def scan(self, root, stats=True, checksum=True, workers=None, verbose=False):
+        """
+        Indexa todos los archivos FITS bajo `root` (recursivo). Solo se leen los archivos
+        nuevos o modificados (tamaño o mtime distintos) y se eliminan del índice los
+        archivos que ya no existen. Retorna (indexados, sin cambios, eliminados).
+        """
+        root = os.path.abspath(root)
+        known = {row["path"]: (row["size"], row["mtime_ns"]) for row in self.connection.execute(
+            "SELECT path, size, mtime_ns FROM files WHERE path LIKE ? ESCAPE '\\'",
+            (self._like_prefix(root),))}
+
+        found, pending = set(), []
+        for directory, _, names in os.walk(root):
+            for name in names:
+                if not name.lower().endswith(FITS_EXTENSIONS):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                found.add(path)
+                if known.get(path) != (stat.st_size, stat.st_mtime_ns):
+                    pending.append(path)
+
+        def read(path):
+            try:
+                return read_file_metadata(path, stats=stats, checksum=checksum), None
+            except Exception as error:
+                return None, f"{type(error).__name__}: {error}"
+
+        indexed = 0
+        with ThreadPoolExecutor(max_workers=workers or min(8, os.cpu_count() or 1)) as pool:
+            for path, (record, error) in zip(pending, pool.map(read, pending)):
+                if record is None:
+                    if verbose:
+                        print(f"No se pudo indexar {path}: {error}")
+                    continue
+                self._upsert(record)
+                indexed += 1
+                if verbose:
+                    print(f"Indexado {path}")
+
+        removed = [path for path in known if path not in found]
+        self.connection.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in removed])
+        self.connection.commit()
+        return indexed, len(found) - len(pending), len(removed)
+
+    def add(self, filename, stats=True, checksum=True):
+        """Indexa (o reindexa) un solo archivo y retorna su registro."""
+        record = read_file_metadata(os.path.abspath(filename), stats=stats, checksum=checksum)
+        self._upsert(record)
+        self.connection.commit()
+        return self.get(filename)
+
+    def get(self, filename):
+        """Registro (diccionario) del archivo, o None si no está indexado."""
+        row = self.connection.execute(f"SELECT {', '.join(RECORD_COLUMNS)} FROM files WHERE path = ?",
+                                      (os.path.abspath(filename),)).fetchone()
+        return dict(row) if row else None
+
+    def lookup(self, filename):
+        """
+        Registro completo (con header) del archivo si la entrada está al día (mismo tamaño
+        y mtime que el archivo en disco); None si no está indexado o fue modificado.
+        """
+        path = os.path.abspath(filename)
+        row = self.connection.execute("SELECT * FROM files WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        if (stat.st_size, stat.st_mtime_ns) != (row["size"], row["mtime_ns"]):
+            return None
+        return dict(row)
+
+    def header(self, filename):
+        """Header guardado del archivo (fits.Header), o None si la entrada no está al día."""
+        record = self.lookup(filename)
+        return fits.Header.fromstring(record["header"]) if record else None
+
+    def wcs(self, filename, header=None):
+        """WCS celeste (2-D) del archivo; se construye una sola vez por proceso."""
+        path = os.path.abspath(filename)
+        key = (path, os.stat(path).st_mtime_ns)
+        if key not in self._wcs:
+            header = header if header is not None else self.header(path)
+            if header is None:
+                return None
+            self._wcs[key] = WCS(header, naxis=2)
+        return self._wcs[key]
+
+    def read_plane(self, filename, channel=0, stokes=0, box=None):
+        """
+        Lee un plano 2-D (o la sección `box`) directamente del archivo con la posición de
+        los datos guardada en el índice, sin abrir el archivo con astropy ni parsear el header.
+        Retorna (header, plano), o None si la entrada no está al día.
+        """
+        from fits_plotter import plane_index
+
+        record = self.lookup(filename)
+        if record is None or record["data_offset"] is None or record["bitpix"] not in BITPIX_DTYPES:
+            return None
+        header = fits.Header.fromstring(record["header"])
+        ndim = header["NAXIS"]
+        shape = tuple(header[f"NAXIS{axis}"] for axis in range(ndim, 0, -1))
+        data = np.memmap(record["path"], dtype=BITPIX_DTYPES[record["bitpix"]], mode="r",
+                         offset=record["data_offset"], shape=shape)
+        index = plane_index(header, ndim, channel=channel, stokes=stokes)
+        y0, y1, x0, x1 = box if box is not None else (0, shape[-2], 0, shape[-1])
+        plane = np.array(data[index + (slice(y0, y1), slice(x0, x1))])
+        del data
+        return header, scale_plane(plane, header)
+
+    def query(self, cone=None, moment=None, bmaj=None, bmin=None, nchan=None, bunit=None):
+        """
+        Busca archivos en el índice. Todos los filtros son opcionales y se combinan:
+            cone (tuple): (ra, dec, radio) con ra/dec en grados y radio en arcsec; retorna
+                los archivos cuya imagen contiene algún punto a menos de `radio` de la
+                posición (radio 0: la imagen contiene la posición).
+            moment (str o list): 'm0', 'm1', 'm2', 'continuo' o 'cubo'.
+            bmaj, bmin (tuple): Rango (mínimo, máximo) del beam en arcsec.
+            nchan (tuple): Rango (mínimo, máximo) de canales.
+            bunit (str): Unidad de los datos.
+        Retorna una lista de registros (diccionarios) ordenada por ruta.
+        """
+        conditions, params = [], []
+        if moment is not None:
+            moments = [moment] if isinstance(moment, str) else list(moment)
+            conditions.append(f"moment IN ({', '.join('?' * len(moments))})")
+            params += moments
+        for column, value in (("bmaj", bmaj), ("bmin", bmin), ("nchan", nchan)):
+            if value is not None:
+                conditions.append(f"{column} BETWEEN ? AND ?")
+                params += list(value)
+        if bunit is not None:
+            conditions.append("bunit = ?")
+            params.append(bunit)
+        if cone is not None:
+            ra, dec, radius_arcsec = cone
+            # Prefiltro en declinación (usa el índice de la tabla); el resto se verifica abajo
+            conditions.append("dec_center IS NOT NULL AND ABS(dec_center - ?) <= radius + ?")
+            params += [dec, radius_arcsec / 3600.0]
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        columns = RECORD_COLUMNS + (("header",) if cone is not None else ())
+        rows = [dict(row) for row in self.connection.execute(
+            f"SELECT {', '.join(columns)} FROM files {where} ORDER BY path", params)]
+        if cone is None:
+            return rows
+        return self._cone_filter(rows, *cone)
+
+    def _cone_filter(self, rows, ra, dec, radius_arcsec):
+        """
+        Filtra por distancia al centro (vectorizado) y luego, solo para los archivos en el
+        borde del cono, por la distancia en píxeles entre la posición y el rectángulo de la imagen.
+        """
+        if not rows:
+            return []
+        radius = radius_arcsec / 3600.0
+        separation = angular_separation(ra, dec, [r["ra_center"] for r in rows], [r["dec_center"] for r in rows])
+
+        result = []
+        for row, sep in zip(rows, separation):
+            header = row.pop("header")
+            if sep > row["radius"] + radius:
+                continue
+            if sep <= radius:  # El cono contiene el centro de la imagen
+                result.append(row)
+                continue
+            key = (row["path"], row["mtime_ns"])
+            if key not in self._wcs:
+                self._wcs[key] = WCS(fits.Header.fromstring(header), naxis=2)
+            wcs = self._wcs[key]
+            x, y = wcs.wcs_world2pix([[ra, dec]], 0)[0]
+            dx = max(-0.5 - x, 0.0, x - (row["nx"] - 0.5))
+            dy = max(-0.5 - y, 0.0, y - (row["ny"] - 0.5))
+            if np.hypot(dx, dy) * proj_plane_pixel_scales(wcs).min() <= radius:
+                result.append(row)
+        return result
+
+    def remove(self, filename):
+        """Elimina un archivo del índice."""
+        self.connection.execute("DELETE FROM files WHERE path = ?", (os.path.abspath(filename),))
+        self.connection.commit()
+
+    def close(self):
+        """Cierra la conexión con la base de datos."""
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _upsert(self, record):
+        columns = list(record)
+        self.connection.execute(
+            f"INSERT OR REPLACE INTO files ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            [record[c] for c in columns])
+
+    @staticmethod
+    def _like_prefix(root):
+        escaped = root.rstrip(os.sep).replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return escaped + os.sep + "%"
+
+
+def parse_range(text):
+    """Convierte 'min:max' en (min, max)."""
+    low, high = text.split(":")
+    return float(low), float(high)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Índice de metadatos de archivos FITS")
+    parser.add_argument("--db", default=None, help="Archivo SQLite del índice")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    scan = subparsers.add_parser("scan", help="Indexa (incrementalmente) un árbol de directorios")
+    scan.add_argument("root", help="Directorio raíz")
+    scan.add_argument("--no-stats", action="store_true", help="No calcula mínimo/máximo/RMS")
+    scan.add_argument("--no-checksum", action="store_true", help="No calcula el SHA-256")
+    scan.add_argument("--workers", type=int, default=None, help="Número de hilos de lectura")
+
+    query = subparsers.add_parser("query", help="Busca archivos en el índice")
+    query.add_argument("--ra", type=float, help="Ascensión recta (grados)")
+    query.add_argument("--dec", type=float, help="Declinación (grados)")
+    query.add_argument("--radius", type=float, default=0.0, help="Radio de búsqueda (arcsec)")
+    query.add_argument("--moment", default=None, help="Tipo de imagen (m0, m1, m2, continuo, cubo)")
+    query.add_argument("--bmaj", type=parse_range, default=None, help="Rango de BMAJ en arcsec (min:max)")
+    query.add_argument("--bmin", type=parse_range, default=None, help="Rango de BMIN en arcsec (min:max)")
+    args = parser.parse_args(argv)
+
+    with FITSIndex(args.db) as index:
+        if args.command == "scan":
+            start = time.perf_counter()
+            indexed, unchanged, removed = index.scan(args.root, stats=not args.no_stats,
+                                                     checksum=not args.no_checksum,
+                                                     workers=args.workers, verbose=True)
+            print(f"\n{indexed} archivos indexados, {unchanged} sin cambios, {removed} eliminados "
+                  f"en {time.perf_counter() - start:.1f} s.")
+        else:
+            cone = (args.ra, args.dec, args.radius) if args.ra is not None and args.dec is not None else None
+            rows = index.query(cone=cone, moment=args.moment, bmaj=args.bmaj, bmin=args.bmin)
+            for row in rows:
+                beam = f"{row['bmaj']:.2f}\" x {row['bmin']:.2f}\"" if row["bmaj"] else "sin beam"
+                print(f"{row['path']}  {row['nx']}x{row['ny']}x{row['nchan']}  {row['moment'] or '-'}  {beam}")
+            print(f"\n{len(rows)} archivos.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,90 +1,503 @@
+import gc
+import io
+import itertools
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from astropy.io import fits
 from astropy.wcs import WCS
 from astropy.coordinates import SkyCoord
 import astropy.units as u
 from matplotlib.patches import Ellipse
-from reproject import reproject_interp  ### PARA LA REPROYECCIÓN
+from reprojection import reproject_array, TILE_SIZE  ### PARA LA REPROYECCIÓN
+from noise import estimate_sigma
+from downsample import auto_factor, block_average, block_extent, block_centers
+from cutout import sky_box, footprint_box, clip_box, slice_wcs
+from catalog import Catalog, overlay_catalog
+from contour_lines import ContourLines
+from profiling import stage
+from beams import Beams, pixel_scales, beam_pixel_ellipse
+
+# Etiquetas del colorbar según el momento
+MOMENT_LABELS = {
+    "m0": "Flujo Integrado (Jy/beam km/s)",
+    "m1": "Velocidad (km/s)",
+    "m2": "Dispersión de Velocidad (km/s)",
+    "continuo": "Intensidad (Jy/beam)"
+}
+
+_plotter_ids = itertools.count()  # Identifica a cada FITSPlotter en las claves de los artistas (ver draw)
+
+
+def plane_index(header, ndim, channel=0, stokes=0):
+    """
+    Construye el índice (tupla) que selecciona un único plano 2-D de un HDU.
+
+    Los ejes anteriores a los dos ejes celestes se indexan con `stokes` si su
+    CTYPE es STOKES y con `channel` en cualquier otro caso (frecuencia/velocidad).
+    Los ejes degenerados (longitud 1) siempre se indexan con 0.
+    """
+    index = []
+    for axis in range(ndim - 2):
+        fits_axis = ndim - axis  # El eje numpy 0 es el último eje FITS (NAXISn)
+        if header.get(f"NAXIS{fits_axis}", 1) == 1:
+            index.append(0)
+        elif str(header.get(f"CTYPE{fits_axis}", "")).upper().startswith("STOKES"):
+            index.append(stokes)
+        else:
+            index.append(channel)
+    return tuple(index)
+
+
+def read_plane(hdu, channel=0, stokes=0, box=None):
+    """
+    Lee del disco únicamente el plano 2-D solicitado de un HDU.
+
+    Usa `hdu.section`, que accede al archivo memory-mapped sin cargar el cubo
+    completo en memoria (el escalado BSCALE/BZERO se aplica solo al plano leído).
+    Si se da `box` = (y0, y1, x0, x1) se lee solo esa sección del plano.
+    """
+    header = hdu.header
+    ndim = header["NAXIS"]
+    index = plane_index(header, ndim, channel=channel, stokes=stokes)
+    if box is None:
+        return np.asarray(hdu.section[index + (slice(None), slice(None))])
+    y0, y1, x0, x1 = box
+    return np.asarray(hdu.section[index + (slice(y0, y1), slice(x0, x1))])
+
+
+def figure_bytes(fig, fmt="png", dpi=300):
+    """Contenido de una figura en el formato indicado (png, pdf, svg...), como bytes."""
+    buffer = io.BytesIO()
+    with stage("savefig", fmt=fmt, dpi=dpi):
+        fig.savefig(buffer, format=fmt, dpi=dpi, bbox_inches='tight')
+    return buffer.getvalue()
+
+
+def release_figure(fig):
+    """
+    Libera una figura y la memoria de sus artistas en el momento (sin esperar al recolector).
+
+    Los ejes WCS y los artistas de matplotlib forman ciclos de referencias, así que sin
+    gc.collect() los buffers de cada figura se acumulan durante cientos de figuras.
+    """
+    fig.clear()
+    gc.collect()
 
 
 class FITSPlotter:
-    def __init__(self, image_fits, contour_fits=None, sigma=3e-3, moment=None, region_label=None):
+    def __init__(self, image_fits, contour_fits=None, sigma=3e-3, moment=None, region_label=None,
+                 lazy=False, channel=0, stokes=0, reproject_cache=None, reproject_method="interp",
+                 cutout_center=None, cutout_size=None, cutout_box=None, index=None, trace_contours=False,
+                 cmap=None, backend="numpy", scheduler="threads", workers=None, reproject_tiles=None,
+                 smooth=None, stats_cache=None):
         """
         Parámetros:
             image_fits (str): Archivo FITS de la imagen base.
             contour_fits (str, opcional): Archivo FITS de los contornos (puede ser None).
-            sigma (float, opcional): Factor de escala para el mapa.
+            sigma (float o str, opcional): Factor de escala para el mapa (ruido de los contornos).
+                También puede ser un estimador de noise.py ('mad', 'clip', 'free', 'rms')
+                para estimarlo de la imagen de contornos (o de la base si no hay contornos).
             moment (str, opcional): Tipo de momento ('m0', 'm1', 'm2', 'continuo').
             region_label (str, opcional): Nombre de la región para mostrar en la imagen.
+            lazy (bool, opcional): Si es True, los archivos se abren memory-mapped, se lee
+                solo el plano 2-D a graficar y los archivos se cierran inmediatamente.
+            channel (int, opcional): Canal espectral a leer en modo lazy (cubos 3-D/4-D).
+            stokes (int, opcional): Plano Stokes a leer en modo lazy.
+            reproject_cache (ReprojectionCache o bool, opcional): Caché en disco de los
+                contornos reproyectados. True usa la caché en el directorio por defecto.
+            reproject_method (str, opcional): Algoritmo de reproyección de los contornos:
+                'interp' (por defecto), 'nearest', 'exact', 'adaptive', 'pixelmap' o
+                'pixelmap-nearest' (ver reprojection.py).
+            cutout_center (SkyCoord o str, opcional): Centro del recorte a graficar
+                (p. ej. '18h20m24.82s -16d11m34.9s'). Requiere cutout_size.
+            cutout_size (float o Quantity, opcional): Tamaño del recorte (arcsec si es un
+                número); también acepta un par (ancho, alto).
+            cutout_box (tuple, opcional): Recorte en píxeles de la imagen base (y0, y1, x0, x1).
+                Con un recorte solo se lee del disco esa sección de la imagen base y la
+                sección de los contornos que la cubre, y se reproyecta solo sobre el recorte.
+            index (FITSIndex, opcional): Índice de metadatos (fits_index.py). En modo lazy o
+                con recorte, si el archivo está indexado y no cambió, el header, el WCS y la
+                posición de los datos se toman del índice sin abrir el archivo con astropy.
+            trace_contours (bool o ContourCache, opcional): Si no es False, los contornos se
+                trazan una sola vez por niveles sobre la grilla original de los contornos
+                (contour_lines.py) y se dibujan como polilíneas, sin volver a ejecutar
+                ax.contour en cada figura. Un ContourCache guarda además las polilíneas en disco.
+            cmap (str, opcional): Mapa de colores de la imagen base (por defecto, según el momento).
+            backend (str, opcional): 'numpy' (por defecto) o 'dask' (dask_backend.py): la imagen
+                base y la de contornos se abren como arreglos dask por bloques y el mínimo/
+                máximo, los niveles y el promedio por bloques (downsample) se calculan en
+                paralelo sin cargar la imagen completa. Con recorte se usa NumPy.
+            scheduler (str, opcional): Scheduler de dask: 'threads', 'processes', 'synchronous',
+                'distributed' o la dirección de un scheduler ('tcp://...').
+            workers (int, opcional): Número de workers de dask y de la reproyección por bloques
+                (por defecto, uno por núcleo).
+            reproject_tiles (int o bool, opcional): Reproyecta los contornos por bloques de este
+                lado en píxeles (True: reprojection.TILE_SIZE) en paralelo, con la salida
+                memory-mapped (ver reproject_tiled). Con backend='dask' cada bloque lee solo la
+                sección de los contornos que lo cubre, por lo que conviene en mosaicos grandes;
+                con NumPy (también con lazy=True) el plano de contornos se lee completo antes de
+                reproyectar. Usa hilos, o procesos con scheduler='processes'.
+            smooth (bool, dict o tuple, opcional): Convoluciona por FFT (smoothing.py) la imagen
+                base y la de contornos a una resolución común antes de reproyectar. True usa el
+                beam común de ambas; también acepta un beam {'bmaj', 'bmin', 'bpa'} o
+                (bmaj, bmin, bpa) en arcsec y grados. Los beams dibujados pasan a ser el objetivo.
+                Con recorte, los bordes del recorte se tratan como 0 (como en imsmooth).
+            stats_cache (StatsCache o bool, opcional): Caché en disco de las estadísticas de la
+                imagen de contornos (streaming_stats.py) por archivo y plano: los niveles por
+                defecto o por esquema ('percentile', 'asinh', 'log') no vuelven a recorrer el
+                archivo. True usa la caché en el directorio por defecto.
         """
-        self.image_fits = image_fits
-        self.contour_fits = contour_fits
-        self.sigma = sigma
-        self.moment = moment  
-        self.region_label = region_label  
+        self.configure(image_fits, contour_fits=contour_fits, sigma=sigma, moment=moment,
+                       region_label=region_label, lazy=lazy, channel=channel, stokes=stokes,
+                       reproject_cache=reproject_cache, reproject_method=reproject_method,
+                       cutout_center=cutout_center, cutout_size=cutout_size, cutout_box=cutout_box, index=index,
+                       trace_contours=trace_contours, cmap=cmap, backend=backend, scheduler=scheduler,
+                       workers=workers, reproject_tiles=reproject_tiles, smooth=smooth, stats_cache=stats_cache)
 
-        # Definir etiquetas del colorbar según el momento
-        moment_labels = {
-            "m0": "Flujo Integrado (Jy/beam km/s)",
-            "m1": "Velocidad (km/s)",
-            "m2": "Dispersión de Velocidad (km/s)",
-            "continuo": "Intensidad (Jy/beam)"
-        }
-        self.colorbar_label = moment_labels.get(self.moment, "Intensidad (Jy/beam)")
-
-        # Cargar la imagen base
-        self.hdul_base = fits.open(self.image_fits)
-        self.data_base = self.hdul_base[0].data.squeeze()
-        self.wcs_base = WCS(self.hdul_base[0].header, naxis=2)
+        # Cargar la imagen base (o solo el recorte)
+        if self.has_cutout:
+            with stage("fits.open", file=self.image_fits, cutout=True):
+                self.hdul_base, self.header_base, self.data_base, self.box_base = self.load_cutout(self.image_fits)
+            with stage("wcs", file=self.image_fits):
+                self.wcs_base = slice_wcs(self.make_wcs(self.image_fits, self.header_base), self.box_base)
+        else:
+            with stage("fits.open", file=self.image_fits):
+                self.hdul_base, self.header_base, self.data_base = self.load_fits(self.image_fits)
+            with stage("wcs", file=self.image_fits):
+                self.wcs_base = self.make_wcs(self.image_fits, self.header_base)
+            self.box_base = None
         
-        # Calcular el pixel scale (arcsec/pixel)
-        self.pixel_scale = abs(self.hdul_base[0].header["CDELT1"]) * 3600  # arcsec/pixel
+        # Calcular el pixel scale (arcsec/pixel; media geométrica de los ejes, vale con CD/PC)
+        self.pixel_scale = float(np.sqrt(np.prod(pixel_scales(self.wcs_base))))
         
         # Extraer parámetros del beam de la imagen base
-        self.beam_base = self.get_beam_params(self.hdul_base[0].header)
+        self.beam_base = self.get_beam_params(self.header_base, self.image_fits)
         
         # Cargar la imagen de contornos solo si se proporciona
+        self.box_contour = None
         if self.contour_fits:
-            self.hdul_contour = fits.open(self.contour_fits)
-            self.data_contour = self.hdul_contour[0].data.squeeze()
-            self.wcs_contour = WCS(self.hdul_contour[0].header, naxis=2)
-
-            # Reproyección de los contornos a la imagen base
-            shape_out = (self.data_base.shape[-2], self.data_base.shape[-1])
-            self.reprojected_contour, _ = reproject_interp(
-                (self.data_contour, self.wcs_contour), self.wcs_base, shape_out=shape_out
-            )
+            if self.has_cutout:
+                # Solo la sección de los contornos que cubre el recorte de la imagen base
+                with stage("fits.open", file=self.contour_fits, cutout=True):
+                    self.hdul_contour, self.header_contour, self.data_contour, self.box_contour = \
+                        self.load_cutout(self.contour_fits, target=(self.wcs_base, self.data_base.shape))
+                with stage("wcs", file=self.contour_fits):
+                    self.wcs_contour = slice_wcs(self.make_wcs(self.contour_fits, self.header_contour),
+                                                 self.box_contour)
+            else:
+                with stage("fits.open", file=self.contour_fits):
+                    self.hdul_contour, self.header_contour, self.data_contour = self.load_fits(self.contour_fits)
+                with stage("wcs", file=self.contour_fits):
+                    self.wcs_contour = self.make_wcs(self.contour_fits, self.header_contour)
 
             # Extraer parámetros del beam de los contornos
-            self.beam_contour = self.get_beam_params(self.hdul_contour[0].header)
+            self.beam_contour = self.get_beam_params(self.header_contour, self.contour_fits)
         else:
+            self.hdul_contour = None
             self.reprojected_contour = None
+            self.footprint_contour = None
             self.beam_contour = None
 
-    def get_beam_params(self, header):
+        # Convolución a una resolución común, sobre la grilla original de cada imagen
+        if self.smooth:
+            self.smooth_to_common_beam()
+
+        if self.contour_fits:
+            # Reproyección de los contornos a la imagen base
+            shape_out = (self.data_base.shape[-2], self.data_base.shape[-1])
+            with stage("reproject", method=self.reproject_method, shape=shape_out):
+                self.reprojected_contour, self.footprint_contour = self.reproject_contour(shape_out)
+
+        # Estimar sigma si se pidió un estimador de ruido en lugar de un valor
+        if isinstance(self.sigma, str):
+            data_noise = self.data_contour if self.contour_fits else self.data_base
+            with stage("sigma", method=self.sigma):
+                self.sigma = estimate_sigma(data_noise, method=self.sigma)
+
+    def configure(self, image_fits, contour_fits=None, sigma=3e-3, moment=None, region_label=None,
+                  lazy=False, channel=0, stokes=0, reproject_cache=None, reproject_method="interp",
+                  cutout_center=None, cutout_size=None, cutout_box=None, index=None, trace_contours=False,
+                  cmap=None, backend="numpy", scheduler="threads", workers=None, reproject_tiles=None,
+                  smooth=None, stats_cache=None):
+        """
+        Guarda las opciones (ver __init__) y el estado inicial del plotter sin leer ningún archivo.
+        Lo comparten FITSPlotter y GridPlotter (channel_maps.py), que luego cargan sus datos.
+        """
+        self.image_fits = image_fits
+        self.contour_fits = contour_fits
+        self.sigma = sigma
+        self.moment = moment  
+        self.region_label = region_label  
+        self.cmap = cmap
+        self.catalogs = []
+        self.lazy = lazy
+        self.channel = channel
+        self.stokes = stokes
+        if reproject_cache is True:
+            from reproject_cache import ReprojectionCache
+            reproject_cache = ReprojectionCache()
+        self.reproject_cache = reproject_cache or None
+        self.reproject_method = reproject_method
+        self.cutout_center = cutout_center
+        self.cutout_size = cutout_size
+        self.cutout_box = cutout_box
+        self.index = index
+        self.trace_contours = trace_contours
+        self.backend = backend
+        self.scheduler = scheduler
+        self.workers = workers
+        self.reproject_tiles = reproject_tiles
+        self.smooth = smooth
+        self.smooth_beam = None
+        if stats_cache is True:
+            from streaming_stats import StatsCache
+            stats_cache = StatsCache()
+        self.stats_cache = stats_cache or None
+        self._token = next(_plotter_ids)
+        self._memo = {}
+        self._figure = None
+        self._contour_lines = {}
+        self.has_cutout = cutout_box is not None or cutout_center is not None
+        self.box_base = None
+        self.box_contour = None
+        self.hdul_base = None
+        self.hdul_contour = None
+        if cutout_center is not None and cutout_size is None:
+            raise ValueError("cutout_center requiere cutout_size.")
+
+        # Etiqueta del colorbar según el momento
+        self.colorbar_label = MOMENT_LABELS.get(self.moment, "Intensidad (Jy/beam)")
+
+    def plane_key(self):
+        """
+        Plano leído de los archivos, para las claves de las cachés en disco (reproyección y
+        estadísticas): (channel, stokes) si se eligió un plano (modo lazy, backend dask o
+        recorte), o None si se cargó el archivo completo (modo normal).
+        """
+        if self.lazy or self.backend == "dask" or self.has_cutout:
+            return (self.channel, self.stokes)
+        return None
+
+    def smooth_to_common_beam(self):
+        """
+        Convoluciona la imagen base y la de contornos al beam self.smooth (True: el beam común
+        de ambas) con smoothing.smooth_plane y actualiza sus beams.
+        """
+        from smoothing import smooth_plane, common_target
+
+        if self.beam_base is None or (self.contour_fits and self.beam_contour is None):
+            raise ValueError("smooth requiere el beam de la imagen base y de los contornos (BMAJ o tabla BEAMS).")
+        if self.smooth is True:
+            target = common_target(self.beam_base, self.beam_contour)
+        else:
+            target = common_target(self.smooth)
+        with stage("smooth", file=self.image_fits):
+            self.data_base = smooth_plane(self.materialize(self.data_base), self.beam_base, target, self.wcs_base,
+                                          bunit=self.header_base.get("BUNIT", "Jy/beam"), workers=self.workers)
+        self.beam_base = target
+        if self.contour_fits:
+            with stage("smooth", file=self.contour_fits):
+                self.data_contour = smooth_plane(self.materialize(self.data_contour), self.beam_contour, target,
+                                                 self.wcs_contour, bunit=self.header_contour.get("BUNIT", "Jy/beam"),
+                                                 workers=self.workers)
+            self.beam_contour = target
+        self.smooth_beam = target
+
+    def materialize(self, data):
+        """Arreglo NumPy de `data`: con el backend dask, lo calcula con el scheduler elegido."""
+        if self.backend != "dask" or isinstance(data, np.ndarray):
+            return data
+        from dask_backend import compute
+        return compute(data, scheduler=self.scheduler, workers=self.workers)
+
+    def memo(self, name, key, compute):
+        """
+        Valor derivado `name` calculado a partir de las entradas descritas por `key`: se
+        reutiliza mientras `key` no cambie y se recalcula con compute() si cambió.
+        """
+        cached = self._memo.get(name)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        value = compute()
+        self._memo[name] = (key, value)
+        return value
+
+    def invalidate(self, *names):
+        """
+        Descarta los valores derivados guardados (todos, o los indicados: 'display',
+        'contour_display', 'contour_stats', 'uc1'). Necesario solo si se modifican los
+        datos en el lugar; reemplazar un arreglo o cambiar sigma, niveles o estilo se
+        detecta solo.
+        """
+        for name in names or list(self._memo):
+            self._memo.pop(name, None)
+
+    @staticmethod
+    def data_key(data):
+        """Identidad de un arreglo para las claves de memo() y draw() (cambia si se reemplaza)."""
+        return None if data is None else (id(data), data.shape)
+
+    def display_image(self, factor):
+        """
+        Imagen base a mostrar, promediada por bloques de `factor` (downsample). El promedio
+        se guarda para los redibujos; con el backend dask se calcula en paralelo.
+        """
+        if factor <= 1 and self.backend != "dask":
+            return self.data_base
+
+        def compute():
+            if self.backend == "dask":
+                from dask_backend import block_average as dask_block_average
+                return self.materialize(dask_block_average(self.data_base, factor))
+            return block_average(self.data_base, factor)
+
+        return self.memo("display", (self.data_key(self.data_base), factor), compute)
+
+    def contour_display(self, factor):
+        """Contornos reproyectados promediados por bloques de `factor` (guardado para los redibujos)."""
+        if factor <= 1:
+            return self.reprojected_contour
+        return self.memo("contour_display", (self.data_key(self.reprojected_contour), factor),
+                         lambda: block_average(self.reprojected_contour, factor))
+
+    def reproject_contour(self, shape_out):
+        """
+        Reproyecta los contornos a la grilla de la imagen base. Si hay caché de
+        reproyección y la entrada existe, se reutiliza sin volver a reproyectar.
+        """
+        def compute():
+            if self.reproject_tiles:
+                # Por bloques: cada bloque lee (o calcula, con dask) solo su sección de los contornos
+                tile_size = TILE_SIZE if self.reproject_tiles is True else int(self.reproject_tiles)
+                executor = "processes" if self.scheduler == "processes" else "threads"
+                return reproject_array(self.data_contour, self.wcs_contour, self.wcs_base, shape_out,
+                                       method=self.reproject_method, tile_size=tile_size, workers=self.workers,
+                                       executor=executor)
+            return reproject_array(self.materialize(self.data_contour), self.wcs_contour, self.wcs_base, shape_out,
+                                   method=self.reproject_method)
+
+        if self.reproject_cache is None:
+            return compute()
+
+        plane = self.plane_key()
+        if self.has_cutout:
+            plane = plane + (self.box_contour,)
+        if self.smooth_beam is not None:
+            plane = (plane, "smooth", self.smooth_beam)
+        key = self.reproject_cache.make_key(self.contour_fits, self.wcs_base, shape_out, plane=plane,
+                                            method=self.reproject_method)
+        return self.reproject_cache.get_or_compute(key, compute)
+
+    def load_fits(self, filename):
+        """
+        Abre un archivo FITS y retorna (hdul, header, data).
+
+        En modo lazy el archivo se abre memory-mapped, se lee solo el plano 2-D
+        seleccionado (channel/stokes) y se cierra antes de retornar (hdul es None).
+        Con el backend dask se retorna el plano como arreglo dask (sin leer los datos).
+        En modo normal se conserva el comportamiento original: el HDUList queda
+        abierto y los datos se obtienen con `.data.squeeze()`.
+        """
+        if self.backend == "dask":
+            from dask_backend import from_fits
+            header, data = from_fits(filename, channel=self.channel, stokes=self.stokes)
+            return None, header, data
+        if self.lazy:
+            indexed = self.index.read_plane(filename, self.channel, self.stokes) if self.index else None
+            if indexed is not None:
+                header, data = indexed
+                return None, header, data
+            with fits.open(filename, memmap=True, lazy_load_hdus=True) as hdul:
+                header = hdul[0].header.copy()
+                data = read_plane(hdul[0], channel=self.channel, stokes=self.stokes)
+            return None, header, data
+
+        hdul = fits.open(filename)
+        return hdul, hdul[0].header, hdul[0].data.squeeze()
+
+    def load_cutout(self, filename, target=None):
+        """
+        Lee del disco solo la sección necesaria de un archivo FITS y lo cierra.
+        Retorna (None, header, data, box).
+
+        Sin `target`, la caja es el recorte pedido (cutout_box o cutout_center/cutout_size).
+        Con `target` = (wcs, shape) de la grilla de destino, la caja es la huella de esa
+        grilla en el archivo (más un margen), usada para leer solo los contornos necesarios.
+        """
+        header = self.index.header(filename) if self.index else None
+        if header is not None:
+            box = self.cutout_region(self.make_wcs(filename, header), header, target)
+            _, data = self.index.read_plane(filename, self.channel, self.stokes, box=box)
+            return None, header, data, box
+
+        with fits.open(filename, memmap=True, lazy_load_hdus=True) as hdul:
+            header = hdul[0].header.copy()
+            box = self.cutout_region(WCS(header, naxis=2), header, target)
+            data = read_plane(hdul[0], channel=self.channel, stokes=self.stokes, box=box)
+        return None, header, data, box
+
+    def cutout_region(self, wcs, header, target=None):
+        """Caja (y0, y1, x0, x1) a leer del archivo (ver load_cutout)."""
+        shape = (header["NAXIS2"], header["NAXIS1"])
+        if target is not None:
+            box = footprint_box(wcs, shape, *target)
+            if box is None:
+                # Sin superposición: se lee un bloque mínimo (la reproyección queda en NaN)
+                box = (0, min(2, shape[0]), 0, min(2, shape[1]))
+        elif self.cutout_box is not None:
+            box = clip_box(self.cutout_box, shape)
+            if box is None:
+                raise ValueError(f"El recorte {self.cutout_box} queda fuera de la imagen {shape}.")
+        else:
+            box = sky_box(wcs, shape, self.cutout_center, self.cutout_size)
+        return box
+
+    def make_wcs(self, filename, header):
+        """WCS celeste del archivo; con índice se reutiliza el ya construido en este proceso."""
+        if self.index is not None and (self.lazy or self.has_cutout):
+            wcs = self.index.wcs(filename, header)
+            if wcs is not None:
+                return wcs
+        return WCS(header, naxis=2)
+
+    def close(self):
+        """Cierra los archivos FITS que hayan quedado abiertos."""
+        for hdul in (self.hdul_base, self.hdul_contour):
+            if hdul is not None:
+                hdul.close()
+        self.hdul_base = None
+        self.hdul_contour = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_beam_params(self, header, filename=None):
         """
         Extrae los parámetros del beam (BMAJ, BMIN, BPA) de un header FITS.
         Retorna un diccionario con los valores en arcosegundos (para BMAJ y BMIN) y grados para BPA.
+        Si el header no los trae (cubos con un beam por canal) se usa el beam de self.channel y
+        self.stokes en la tabla BEAMS de `filename`.
         """
-        try:
-            bmaj = header['BMAJ'] * 3600  # de grados a arcsec
-            bmin = header['BMIN'] * 3600
-            bpa = header['BPA']
-            return {'bmaj': bmaj, 'bmin': bmin, 'bpa': bpa}
-        except KeyError:
+        beams = Beams.from_header(header)
+        if beams is None and filename:
+            beams = Beams.read(filename)
+        if beams is None:
             return None
+        return beams.beam(self.channel, self.stokes)
 
-    def plot(self, save_as=None, title=""):
-        """Genera la visualización de la imagen FITS con la superposición de contornos (si existen) y beams."""
-        fig, ax = plt.subplots(figsize=(10, 8), subplot_kw={'projection': self.wcs_base})
-
-        # Determinar colores según el tipo de momento
-        if self.moment in ['m0', 'continuo']:
+    def plot_style(self, moment=None):
+        """Colores (cmap base, contornos, estrella) según el tipo de momento (por defecto, self.moment)."""
+        moment = moment or self.moment
+        if moment in ['m0', 'continuo']:
             cmap_base = 'gnuplot2'
             contour_color = 'white'  
             star_color = 'lawngreen'  
-        elif self.moment in ['m1', 'm2']:
+        elif moment in ['m1', 'm2']:
             cmap_base = 'jet'
             contour_color = 'black'  
             star_color = 'fuchsia'  
@@ -92,47 +505,303 @@ class FITSPlotter:
             cmap_base = 'gnuplot2'
             contour_color = 'white'  
             star_color = 'yellow'  
+        if self.cmap:
+            cmap_base = self.cmap
+        return cmap_base, contour_color, star_color
 
-        # Mostrar la imagen base
-        im = ax.imshow(self.data_base, origin='lower', cmap=cmap_base)
+    def get_contour_levels(self, contour_levels=None):
+        """
+        Niveles de contorno: contour_levels * sigma, o los de un esquema de streaming_stats.py
+        ('linear', 'percentile', 'asinh' o 'log') calculados de las estadísticas de la imagen de
+        contornos. Por defecto, 7 niveles lineales entre el mínimo y el máximo.
+        """
+        if contour_levels is not None and not isinstance(contour_levels, str):
+            return np.sort(np.asarray(contour_levels, dtype=float)) * self.sigma
+        from streaming_stats import level_scheme
+        return level_scheme(self.contour_stats(), contour_levels or "linear")
 
-        # Dibujar contornos si existen
-        if self.reprojected_contour is not None:
-            levels = np.linspace(np.nanmin(self.data_contour), np.nanmax(self.data_contour), 7)
-            ax.contour(self.reprojected_contour, levels=levels, colors=contour_color,
-                       linewidths=1, alpha=0.8)
-
-        # Dibujar los beams superpuestos en la esquina inferior izquierda
-        self.plot_beam(ax, self.beam_base, facecolor='gray', edgecolor='black')
-        if self.beam_contour:
-            self.plot_beam(ax, self.beam_contour, facecolor='white', edgecolor='gray')
-
-        # Si ingresé un nombre para la región, mostrarlo en la imagen
-        if self.region_label:
-            ax.text(0.95, 0.95, self.region_label, transform=ax.transAxes, fontsize=14,
-                    color='white', ha='right', va='top',
-                    bbox=dict(facecolor='black', alpha=0.5))
-
-        ############ ESTRELLITA UC1
-        uc1_coords = SkyCoord(ra='18h20m24.82s', dec='-16d11m34.9s', frame='icrs')
-        x_pix, y_pix = self.wcs_base.world_to_pixel(uc1_coords)
-        ax.scatter(x_pix, y_pix, facecolors='none', edgecolors=star_color, marker='*',
-                   s=250, linewidths=1.5, zorder=10)
-        ax.annotate("UC1", (x_pix + 5, y_pix + 5), color=star_color, fontsize=12,
-                    weight='bold', zorder=11)
-        ############
-
-        ax.set_xlabel('Ascensión Recta (RA)')
-        ax.set_ylabel('Declinación (Dec)')
-        plt.colorbar(im, ax=ax, pad=0.05, label=self.colorbar_label)
-        plt.title(title)
+    def contour_stats(self):
+        """
+        Estadísticas de la imagen de contornos en una pasada por bloques (StreamingStats:
+        mínimo, máximo, RMS, NaN y percentiles). Se guardan para los redibujos y, con
+        stats_cache, en disco por archivo y plano (salvo con recorte o suavizado).
+        """
+        from streaming_stats import StreamingStats
+
+        def compute():
+            with stage("levels"):
+                if self.backend == "dask":
+                    from dask_backend import streaming_stats
+                    return streaming_stats(self.data_contour, scheduler=self.scheduler, workers=self.workers)
+                return StreamingStats.from_array(self.data_contour)
+
+        def cached():
+            if self.stats_cache is None or self.has_cutout or self.smooth_beam is not None:
+                return compute()
+            key = self.stats_cache.make_key(self.contour_fits, self.plane_key())
+            return self.stats_cache.get_or_compute(key, compute)
+
+        return self.memo("contour_stats", self.data_key(self.data_contour), cached)
+
+    def plot(self, save_as=None, title="", contour_levels=None, downsample=None):
+        """
+        Genera la visualización de la imagen FITS con la superposición de contornos (si existen) y beams.
+
+        contour_levels (list o str, opcional): Niveles de contorno en unidades de sigma
+            (p. ej. [-3, 3, 5, 10]), o un esquema de streaming_stats.py ('percentile',
+            'asinh', 'log'). Si es None se usan 7 niveles lineales entre el mínimo y el
+            máximo de la imagen de contornos.
+        downsample (int o 'auto', opcional): Promedia (ignorando NaN) bloques de N x N
+            píxeles antes de imshow/contour. Con 'auto' N se elige según el tamaño y dpi
+            de la figura, de modo que no se pierde resolución visible. None grafica la
+            resolución completa.
+
+        Mientras la figura de la llamada anterior siga abierta, plot() la reutiliza y solo
+        recalcula lo que cambió (datos, niveles, estilo o anotaciones).
+        """
+        with stage("plot"):
+            # Si la figura de la llamada anterior sigue abierta se redibuja de forma incremental
+            # (ver draw): solo se rehace lo que cambió desde entonces
+            if self._figure is not None and plt.fignum_exists(self._figure[0].number):
+                fig, ax, artists = self._figure
+            else:
+                with stage("figure"):
+                    fig, ax = plt.subplots(figsize=(10, 8), subplot_kw={'projection': self.wcs_base})
+                artists = None
+            artists = self.draw(ax, title=title, contour_levels=contour_levels, downsample=downsample,
+                                dpi=300 if save_as else fig.dpi, artists=artists)
+            self._figure = (fig, ax, artists)
 
+            if save_as:
+                with stage("savefig", file=save_as, dpi=300):
+                    fig.savefig(save_as, dpi=300, bbox_inches='tight')
         if save_as:
-            plt.savefig(save_as, dpi=300, bbox_inches='tight')
             print(f"Imagen guardada como {save_as}")
 
         plt.show()
 
+    def render(self, title="", contour_levels=None, downsample=None, figsize=(10, 8), dpi=300):
+        """
+        Construye la figura sin mostrarla y la retorna (matplotlib.figure.Figure).
+
+        La figura no se registra en pyplot, por lo que no queda abierta en segundo plano;
+        libérela con release_figure(fig) al terminar. No llama a plt.show().
+        """
+        with stage("render"):
+            with stage("figure"):
+                fig = Figure(figsize=figsize)
+                FigureCanvasAgg(fig)
+                ax = fig.add_subplot(projection=self.wcs_base)
+            self.draw(ax, title=title, contour_levels=contour_levels, downsample=downsample, dpi=dpi)
+        return fig
+
+    def export(self, fmt="png", title="", contour_levels=None, downsample=None, dpi=300):
+        """Genera la figura y retorna su contenido en el formato indicado (png, pdf, svg...) como bytes."""
+        with stage("export", fmt=fmt):
+            fig = self.render(title=title, contour_levels=contour_levels, downsample=downsample, dpi=dpi)
+            try:
+                return figure_bytes(fig, fmt=fmt, dpi=dpi)
+            finally:
+                release_figure(fig)
+
+    def export_pyramid(self, output, fmt="png", contour_levels=None, tile_size=256, vmin=None, vmax=None,
+                       workers=None):
+        """
+        Exporta la imagen base como pirámide de teselas multirresolución (pyramid.py) en el
+        directorio `output`: teselas PNG/WebP con los contornos rasterizados, o un almacén Zarr
+        (fmt='zarr'). Con lazy=True y reproject_tiles, ni la imagen ni los contornos
+        reproyectados se cargan completos en memoria. Retorna los metadatos de la pirámide.
+        """
+        from pyramid import build_pyramid
+        cmap_base, contour_color, _ = self.plot_style()
+        levels = None
+        if self.reprojected_contour is not None:
+            levels = self.get_contour_levels(contour_levels)
+        return build_pyramid(self.data_base, self.wcs_base, output, fmt=fmt, tile_size=tile_size,
+                             contour=self.reprojected_contour, contour_levels=levels, cmap=cmap_base,
+                             contour_color=contour_color, vmin=vmin, vmax=vmax, workers=workers or self.workers,
+                             source=self.image_fits)
+
+    def draw(self, ax, title="", contour_levels=None, downsample=None, dpi=100, artists=None):
+        """
+        Dibuja la imagen, los contornos, los beams y las anotaciones en `ax` (WCSAxes).
+
+        Si se da `artists` (el diccionario retornado por una llamada anterior) la figura se
+        actualiza de forma incremental: artists['inputs'] guarda las entradas de las que
+        depende cada elemento (datos, WCS, niveles, factor, estilo, anotaciones) y solo se
+        rehace el que cambió. Cambiar el título, el colormap o la etiqueta no vuelve a
+        trazar la imagen ni los contornos, y un cambio de color de los contornos solo los
+        recolorea. Retorna el diccionario de artistas.
+        """
+        fig = ax.figure
+        cmap_base, contour_color, star_color = self.plot_style()
+
+        # Factor de reducción (nivel de detalle)
+        if downsample == 'auto':
+            factor = auto_factor(self.data_base.shape, figsize=fig.get_size_inches(), dpi=dpi)
+        else:
+            factor = int(downsample or 1)
+
+        fresh = artists is None
+        if fresh:
+            artists = {}
+        inputs = artists.setdefault('inputs', {})
+
+        def changed(name, key):
+            """True si las entradas del elemento `name` cambiaron desde el dibujo anterior (y las registra)."""
+            if name in inputs and inputs[name] == key:
+                return False
+            inputs[name] = key
+            return True
+
+        ny, nx = self.data_base.shape[-2:]
+        if changed('wcs', (self._token, id(self.wcs_base))):
+            if not fresh and ax.wcs.to_header_string() != self.wcs_base.to_header_string():
+                ax.reset_wcs(self.wcs_base)
+            ax.set_xlabel('Ascensión Recta (RA)')
+            ax.set_ylabel('Declinación (Dec)')
+
+        with stage("imshow", downsample=factor):
+            # Mostrar la imagen base
+            data_image = self.display_image(factor)
+            if factor > 1:
+                # Imagen reducida ubicada en las coordenadas de píxel de la grilla original,
+                # para que el WCS de los ejes, los beams y las anotaciones sigan siendo correctos
+                extent = block_extent(data_image.shape, factor)
+            else:
+                extent = (-0.5, nx - 0.5, -0.5, ny - 0.5)
+
+            image_changed = changed('image', (self._token, self.data_key(data_image), factor))
+            cmap_changed = changed('cmap', cmap_base)
+            if 'image' not in artists:
+                if factor > 1:
+                    im = ax.imshow(data_image, origin='lower', cmap=cmap_base, extent=extent)
+                else:
+                    im = ax.imshow(data_image, origin='lower', cmap=cmap_base)
+                artists['image'] = im
+            else:
+                im = artists['image']
+                if image_changed:
+                    im.set_data(data_image)
+                    im.set_extent(extent)
+                    im.autoscale()
+                if cmap_changed:
+                    im.set_cmap(cmap_base)
+            if changed('limits', (nx, ny)):
+                ax.set_xlim(-0.5, nx - 0.5)
+                ax.set_ylim(-0.5, ny - 0.5)
+
+        with stage("contour"):
+            # Dibujar contornos si existen (solo se vuelven a trazar si cambian los datos o los niveles)
+            levels = None
+            if self.reprojected_contour is not None:
+                levels = self.get_contour_levels(contour_levels)
+            contour_key = (self._token, self.data_key(self.reprojected_contour),
+                           None if levels is None else tuple(levels), factor, self.trace_contours is not False)
+            if changed('contours', contour_key):
+                if artists.get('contours') is not None:
+                    artists['contours'].remove()
+                artists['contours'] = None
+                inputs['contour_color'] = contour_color
+                if levels is None:
+                    pass
+                elif self.trace_contours is not False:
+                    artists['contours'] = self.contour_lines(levels).draw(ax, self.wcs_base, colors=contour_color,
+                                                                          linewidths=1, alpha=0.8)
+                elif factor > 1:
+                    data_contour = self.contour_display(factor)
+                    x, y = block_centers(data_contour.shape, factor)
+                    artists['contours'] = ax.contour(x, y, data_contour, levels=levels, colors=contour_color,
+                                                     linewidths=1, alpha=0.8)
+                else:
+                    artists['contours'] = ax.contour(self.reprojected_contour, levels=levels, colors=contour_color,
+                                                     linewidths=1, alpha=0.8)
+            elif changed('contour_color', contour_color) and artists['contours'] is not None:
+                artists['contours'].set_edgecolor(contour_color)
+
+        with stage("overlays"):
+            # Dibujar los beams superpuestos en la esquina inferior izquierda
+            if changed('beams', (self._token, self.beam_base, self.beam_contour, self.pixel_scale, nx, ny)):
+                for beam in artists.get('beams', []):
+                    beam.remove()
+                artists['beams'] = [self.plot_beam(ax, self.beam_base, facecolor='gray', edgecolor='black')]
+                if self.beam_contour:
+                    artists['beams'].append(self.plot_beam(ax, self.beam_contour, facecolor='white',
+                                                           edgecolor='gray'))
+                artists['beams'] = [beam for beam in artists['beams'] if beam is not None]
+
+            # Si ingresé un nombre para la región, mostrarlo en la imagen
+            if 'label' not in artists:
+                artists['label'] = ax.text(0.95, 0.95, "", transform=ax.transAxes, fontsize=14,
+                                           color='white', ha='right', va='top',
+                                           bbox=dict(facecolor='black', alpha=0.5))
+            if changed('label', self.region_label):
+                artists['label'].set_text(self.region_label or "")
+                artists['label'].set_visible(bool(self.region_label))
+
+            ############ ESTRELLITA UC1
+            uc1_coords = SkyCoord(ra='18h20m24.82s', dec='-16d11m34.9s', frame='icrs')
+            x_pix, y_pix = self.memo("uc1", id(self.wcs_base), lambda: self.wcs_base.world_to_pixel(uc1_coords))
+            star_moved = changed('star', (float(x_pix), float(y_pix)))
+            star_recolored = changed('star_color', star_color)
+            if 'star' not in artists:
+                artists['star'] = ax.scatter(x_pix, y_pix, facecolors='none', edgecolors=star_color, marker='*',
+                                             s=250, linewidths=1.5, zorder=10)
+                artists['star_label'] = ax.annotate("UC1", (x_pix + 5, y_pix + 5), color=star_color, fontsize=12,
+                                                    weight='bold', zorder=11)
+            else:
+                if star_moved:
+                    artists['star'].set_offsets([[x_pix, y_pix]])
+                    artists['star_label'].xy = (x_pix + 5, y_pix + 5)
+                    artists['star_label'].set_position((x_pix + 5, y_pix + 5))
+                if star_recolored:
+                    artists['star'].set_edgecolor(star_color)
+                    artists['star_label'].set_color(star_color)
+            ############
+
+            # Catálogos superpuestos (ver add_catalog)
+            if changed('catalogs', (self._token, id(self.wcs_base),
+                                    [(id(catalog), style) for catalog, style in self.catalogs])):
+                for artist in artists.get('catalogs', []):
+                    artist.remove()
+                artists['catalogs'] = []
+                for catalog, style in self.catalogs:
+                    artists['catalogs'] += overlay_catalog(ax, self.wcs_base, self.data_base.shape, catalog, **style)
+
+            if 'colorbar' not in artists:
+                artists['colorbar'] = fig.colorbar(im, ax=ax, pad=0.05, label=self.colorbar_label)
+                inputs['colorbar'] = self.colorbar_label
+            elif changed('colorbar', self.colorbar_label):
+                artists['colorbar'].set_label(self.colorbar_label)
+        if changed('title', title):
+            ax.set_title(title)
+        return artists
+
+    def contour_lines(self, levels=None):
+        """
+        Polilíneas de los contornos (ContourLines, en coordenadas del cielo) trazadas sobre
+        la grilla original de la imagen de contornos. Se trazan una vez por niveles.
+        `levels` son niveles absolutos; por defecto, los de get_contour_levels().
+        """
+        if levels is None:
+            levels = self.get_contour_levels()
+        key = tuple(np.sort(np.asarray(levels, dtype=np.float64)))
+        if key not in self._contour_lines:
+            cache = None if self.trace_contours in (True, False) else self.trace_contours
+            self._contour_lines[key] = ContourLines.trace(self.materialize(self.data_contour), self.wcs_contour,
+                                                          levels, cache=cache)
+        return self._contour_lines[key]
+
+    def add_catalog(self, catalog, **style):
+        """
+        Agrega un catálogo (catalog.Catalog o archivo CSV/FITS/VOTable) a superponer en la figura.
+        `style` acepta marker, color, size, labels, max_labels y fontsize (ver catalog.overlay_catalog).
+        """
+        if isinstance(catalog, str):
+            catalog = Catalog.read(catalog)
+        self.catalogs.append((catalog, style))
+        return catalog
+
     def plot_beam(self, ax, beam_params, facecolor, edgecolor):
         """Dibuja los beams superpuestos en la esquina inferior izquierda, con tamaño y orientación correctos."""
         if beam_params:
@@ -140,9 +809,11 @@ class FITSPlotter:
             ylim = ax.get_ylim()
             beam_x = xlim[0] + 0.05 * (xlim[1] - xlim[0])  
             beam_y = ylim[0] + 0.05 * (ylim[1] - ylim[0])  
-            width_pix = beam_params['bmin'] / self.pixel_scale
-            height_pix = beam_params['bmaj'] / self.pixel_scale
+            # Elipse en píxeles según el WCS (matrices CD/PC, rotación y píxeles no cuadrados)
+            width_pix, height_pix, angle = beam_pixel_ellipse(beam_params, self.wcs_base)
             beam_ellipse = Ellipse((beam_x, beam_y), width=width_pix, height=height_pix,
-                                   angle=beam_params['bpa'], edgecolor=edgecolor, facecolor=facecolor,
+                                   angle=angle, edgecolor=edgecolor, facecolor=facecolor,
                                    alpha=0.5, lw=1.5)
-            ax.add_patch(beam_ellipse)
\ No newline at end of file
+            ax.add_patch(beam_ellipse)
+            return beam_ellipse
+        return None
\ No newline at end of file
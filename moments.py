@@ -0,0 +1,267 @@
+"""
+Cálculo de mapas de momento (m0, m1, m2) a partir de cubos espectrales, por bloques de canales.
+
+El cubo se recorre en bloques de canales leídos con `hdu.section`, acumulando por píxel
+las sumas ponderadas necesarias para los tres momentos. Nunca se tiene el cubo completo
+en memoria: el uso de memoria es el de los acumuladores (unos pocos mapas 2-D) más un
+bloque de canales, cuyo tamaño se limita con `max_chunk_bytes`. El archivo se abre sin
+memmap a propósito: con memmap, las páginas ya leídas del cubo siguen contando en el RSS
+del proceso y el pico de memoria crecería con el tamaño del cubo.
+
+Definiciones (v en km/s, dv = ancho del canal en km/s, sumas sobre los canales incluidos):
+    m0 = sum(I dv)                                  [BUNIT km/s, p. ej. Jy/beam km/s]
+    m1 = sum(I v dv) / m0                           [km/s]
+    m2 = sqrt(sum(I (v - m1)^2 dv) / m0)            [km/s]
+
+Con `clip` se incluyen solo los píxeles con I >= clip * sigma (como includepix de
+immoments en CASA). Si no se da `sigma`, se estima con la MAD de los canales extremos
+del rango (normalmente libres de emisión).
+
+Los mapas se escriben con el mismo formato que generan CASA (immoments + exportfits):
+el header del cubo con los ejes espectral y Stokes degenerados (longitud 1), de modo que
+FITSPlotter y contcal.py los aceptan directamente.
+
+Uso:
+    python moments.py <cubo.fits> [--moments 0,1,2] [--chans 10:50] [--clip 3] [--sigma 0.002] [--output prefijo]
+
+Ejemplo desde Python:
+    from moments import compute_moments, write_moments
+    maps = compute_moments("cubo.fits", moments=(0, 1), chan_range=(10, 50), clip=3)
+    write_moments(maps, "cubo.fits", "M17SW")  # M17SW_m0.fits, M17SW_m1.fits
+"""
+
+import argparse
+
+import numpy as np
+import astropy.units as u
+from astropy.io import fits
+from astropy.wcs import WCS
+from astropy.constants import c
+
+from noise import mad_sigma
+
+MOMENT_BUNITS = {"m1": "km/s", "m2": "km/s"}
+
+# Tamaño máximo por defecto de cada bloque de canales leído del disco
+DEFAULT_MAX_CHUNK_BYTES = 256 * 1024 ** 2
+
+
+def spectral_axis(header):
+    """Índice (FITS, base 0) del eje espectral del cubo, o None si no tiene."""
+    spec = WCS(header).wcs.spec
+    return spec if spec >= 0 else None
+
+
+def channel_velocities(header):
+    """
+    Velocidad (km/s, convención radio) del centro de cada canal del cubo.
+    Acepta ejes FREQ (requiere RESTFRQ/RESTFREQ) y ejes de velocidad (VRAD, VELO, VOPT).
+    """
+    axis = spectral_axis(header)
+    if axis is None:
+        raise ValueError("El cubo no tiene eje espectral.")
+
+    wcs_spec = WCS(header).sub([axis + 1])  # Las unidades quedan en SI (Hz o m/s)
+    nchan = header[f"NAXIS{axis + 1}"]
+    values = wcs_spec.pixel_to_world_values(np.arange(nchan))
+    ctype = header[f"CTYPE{axis + 1}"].upper()
+
+    if ctype.startswith("FREQ"):
+        rest = header.get("RESTFRQ", header.get("RESTFREQ"))
+        if not rest:
+            raise ValueError("El eje espectral es FREQ pero el header no tiene RESTFRQ/RESTFREQ.")
+        return (c.to(u.km / u.s).value * (1 - values / rest)).astype(np.float64)
+    return (values / 1000.0).astype(np.float64)
+
+
+def cube_index(header, channels, stokes=0):
+    """
+    Índice para hdu.section que selecciona el bloque `channels` (slice) del eje espectral,
+    el plano Stokes indicado y el índice 0 en cualquier otro eje degenerado.
+    """
+    ndim = header["NAXIS"]
+    axis = spectral_axis(header)
+    index = []
+    for np_axis in range(ndim - 2):
+        fits_axis = ndim - np_axis  # 1-based
+        if fits_axis - 1 == axis:
+            index.append(channels)
+        elif str(header.get(f"CTYPE{fits_axis}", "")).upper().startswith("STOKES"):
+            index.append(stokes)
+        else:
+            index.append(0)
+    return tuple(index) + (slice(None), slice(None))
+
+
+def estimate_edge_sigma(hdu, chan_range, stokes=0, nedge=2):
+    """Estima el ruido con la MAD (escalada a sigma) de los canales extremos del rango."""
+    start, stop = chan_range
+    nedge = max(1, min(nedge, (stop - start) // 2))
+    planes = []
+    for chans in (slice(start, start + nedge), slice(stop - nedge, stop)):
+        planes.append(np.asarray(hdu.section[cube_index(hdu.header, chans, stokes)], dtype=np.float64))
+    values = np.concatenate([p.ravel() for p in planes])
+    return mad_sigma(values[np.isfinite(values)])
+
+
+def compute_moments(cube_fits, moments=(0, 1, 2), chan_range=None, clip=None, sigma=None,
+                    stokes=0, max_chunk_bytes=DEFAULT_MAX_CHUNK_BYTES, verbose=False):
+    """
+    Calcula los mapas de momento de un cubo recorriéndolo por bloques de canales.
+
+    Parámetros:
+        cube_fits (str): Archivo FITS del cubo (3-D o 4-D, con eje espectral).
+        moments (iterable, opcional): Momentos a calcular (0, 1 y/o 2).
+        chan_range (tuple, opcional): Rango de canales (inicio, fin) con fin excluido.
+        clip (float, opcional): Incluir solo píxeles con I >= clip * sigma.
+        sigma (float, opcional): Ruido por canal; si es None y hay clip, se estima.
+        stokes (int, opcional): Plano Stokes a usar.
+        max_chunk_bytes (int, opcional): Tamaño máximo (en float64) de cada bloque de canales.
+        verbose (bool, opcional): Imprime el progreso.
+
+    Retorna:
+        Diccionario {'m0': arreglo 2-D, 'm1': ..., 'm2': ...} con los momentos pedidos.
+    """
+    moments = sorted({int(m) for m in moments})
+    with fits.open(cube_fits, memmap=False, lazy_load_hdus=True) as hdul:
+        hdu = hdul[0]
+        header = hdu.header
+        axis = spectral_axis(header)
+        if axis is None:
+            raise ValueError(f"{cube_fits} no tiene eje espectral: no se pueden calcular momentos.")
+
+        nchan = header[f"NAXIS{axis + 1}"]
+        start, stop = chan_range if chan_range else (0, nchan)
+        start, stop = max(0, start), min(nchan, stop)
+        if stop <= start:
+            raise ValueError(f"Rango de canales vacío: {chan_range}")
+
+        velocities = channel_velocities(header)
+        dv = np.abs(np.gradient(velocities)) if nchan > 1 else np.ones(1)
+        v_ref = velocities[start:stop].mean()  # Referencia para reducir la cancelación en m2
+
+        threshold = None
+        if clip is not None:
+            if sigma is None:
+                sigma = estimate_edge_sigma(hdu, (start, stop), stokes=stokes)
+                if verbose:
+                    print(f"Sigma estimado (MAD de canales extremos): {sigma}")
+            threshold = clip * sigma
+
+        ny, nx = header["NAXIS2"], header["NAXIS1"]
+        plane_bytes = ny * nx * 8  # Cada bloque se convierte a float64
+        chunk = max(1, int(max_chunk_bytes // plane_bytes))
+
+        s0 = np.zeros((ny, nx))
+        s1 = np.zeros((ny, nx)) if max(moments) >= 1 else None
+        s2 = np.zeros((ny, nx)) if max(moments) >= 2 else None
+        included = np.zeros((ny, nx), dtype=bool)
+
+        for c0 in range(start, stop, chunk):
+            c1 = min(c0 + chunk, stop)
+            block = np.asarray(hdu.section[cube_index(header, slice(c0, c1), stokes)], dtype=np.float64)
+            mask = np.isfinite(block)
+            if threshold is not None:
+                mask &= block >= threshold
+            weights = np.where(mask, block, 0.0) * dv[c0:c1, None, None]
+
+            s0 += weights.sum(axis=0)
+            included |= mask.any(axis=0)
+            if s1 is not None:
+                offsets = (velocities[c0:c1] - v_ref)[:, None, None]
+                s1 += (weights * offsets).sum(axis=0)
+                if s2 is not None:
+                    s2 += (weights * offsets ** 2).sum(axis=0)
+            if verbose:
+                print(f"Canales {c0}-{c1 - 1} de {start}-{stop - 1} procesados")
+
+    result = {}
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if 0 in moments:
+            result["m0"] = np.where(included, s0, np.nan)
+        if s1 is not None:
+            valid = included & (s0 > 0)
+            mean_offset = np.where(valid, s1 / s0, np.nan)
+            if 1 in moments:
+                result["m1"] = v_ref + mean_offset
+            if 2 in moments:
+                variance = np.where(valid, s2 / s0 - mean_offset ** 2, np.nan)
+                result["m2"] = np.sqrt(np.clip(variance, 0, None))
+    return result
+
+
+def moment_header(cube_header, moment, chan_range=None):
+    """
+    Header del mapa de momento: el del cubo, con los ejes no celestes degenerados
+    (el eje espectral centrado en el rango usado y con su ancho total).
+    """
+    header = cube_header.copy()
+    axis = spectral_axis(header)
+    ndim = header["NAXIS"]
+    nchan = header[f"NAXIS{axis + 1}"] if axis is not None else 1
+    start, stop = chan_range if chan_range else (0, nchan)
+    if axis is not None:
+        n = axis + 1
+        crval = header.get(f"CRVAL{n}", 0.0)
+        cdelt = header.get(f"CDELT{n}", 1.0)
+        crpix = header.get(f"CRPIX{n}", 1.0)
+        center = (start + stop - 1) / 2.0  # Canal central (base 0)
+        header[f"CRVAL{n}"] = crval + (center + 1 - crpix) * cdelt
+        header[f"CDELT{n}"] = cdelt * (stop - start)
+        header[f"CRPIX{n}"] = 1.0
+    for n in range(3, ndim + 1):
+        header[f"NAXIS{n}"] = 1
+
+    bunit = header.get("BUNIT", "")
+    header["BUNIT"] = MOMENT_BUNITS.get(moment, f"{bunit}.km/s" if bunit else "km/s")
+    for key in ("BSCALE", "BZERO", "BLANK", "DATAMIN", "DATAMAX"):
+        header.remove(key, ignore_missing=True)
+    header["HISTORY"] = f"moments.py: {moment} (canales {start}-{stop - 1})"
+    return header
+
+
+def write_moments(maps, cube_fits, output_prefix, chan_range=None):
+    """Escribe cada mapa como <output_prefix>_<momento>.fits. Retorna la lista de archivos."""
+    cube_header = fits.getheader(cube_fits)
+    outputs = []
+    for moment, data in maps.items():
+        header = moment_header(cube_header, moment, chan_range)
+        shape = (1,) * (header["NAXIS"] - 2) + data.shape
+        output = f"{output_prefix}_{moment}.fits"
+        fits.PrimaryHDU(data=data.astype(np.float32).reshape(shape), header=header).writeto(output, overwrite=True)
+        outputs.append(output)
+    return outputs
+
+
+def parse_chan_range(text):
+    """Convierte "10:50" en (10, 50)."""
+    if not text:
+        return None
+    start, stop = text.split(":")
+    return int(start), int(stop)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mapas de momento (m0, m1, m2) por bloques de canales")
+    parser.add_argument("cube", help="Archivo FITS del cubo")
+    parser.add_argument("--moments", default="0,1,2", help="Momentos separados por comas (por defecto 0,1,2)")
+    parser.add_argument("--chans", default=None, help="Rango de canales inicio:fin (fin excluido)")
+    parser.add_argument("--clip", type=float, default=None, help="Incluir solo I >= clip * sigma")
+    parser.add_argument("--sigma", type=float, default=None, help="Ruido por canal (por defecto se estima)")
+    parser.add_argument("--stokes", type=int, default=0, help="Plano Stokes")
+    parser.add_argument("--max-chunk-mb", type=float, default=DEFAULT_MAX_CHUNK_BYTES / 1024 ** 2,
+                        help="Tamaño máximo de cada bloque de canales en MB")
+    parser.add_argument("--output", default=None, help="Prefijo de los archivos de salida")
+    args = parser.parse_args(argv)
+
+    chan_range = parse_chan_range(args.chans)
+    maps = compute_moments(args.cube, moments=[int(m) for m in args.moments.split(",")],
+                           chan_range=chan_range, clip=args.clip, sigma=args.sigma, stokes=args.stokes,
+                           max_chunk_bytes=int(args.max_chunk_mb * 1024 ** 2), verbose=True)
+    prefix = args.output or args.cube.rsplit(".fits", 1)[0]
+    for output in write_moments(maps, args.cube, prefix, chan_range):
+        print(f"Mapa guardado como {output}")
+
+
+if __name__ == "__main__":
+    main()
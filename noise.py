@@ -0,0 +1,188 @@
+"""
+Estimación robusta del ruido (sigma) de imágenes FITS, con submuestreo para imágenes enormes.
+
+Estimadores (parámetro `method` de estimate_sigma):
+    "mad":   1.4826 * mediana(|x - mediana(x)|). Robusto frente a la emisión de la fuente.
+    "clip":  Desviación estándar con recorte iterativo (por defecto 3 sigma, hasta converger).
+    "free":  Ruido de las regiones sin emisión: se calcula la MAD en teselas, se descartan
+             las teselas con sigma anómalamente alto (con emisión) y se toma la mediana de
+             las restantes (o la MAD de una caja dada).
+    "rms":   RMS de todos los píxeles (lo que hacía imstat en contcal.py, incluye la fuente).
+
+En imágenes grandes no se usan todos los píxeles: se toma una muestra de como máximo
+`max_samples` píxeles, con paso fijo ("stride", lee solo algunas filas del archivo
+memory-mapped) o aleatoria ("random"). Con 10^6 muestras, una imagen de 16k x 16k da
+un sigma robusto en una fracción de segundo.
+
+Uso:
+    from noise import estimate_sigma, noise_map
+    sigma = estimate_sigma(data, method="mad")
+    sigmas, tile = noise_map(data, tile=512)   # Mapa de ruido por teselas
+"""
+
+import numpy as np
+
+METHODS = ["mad", "clip", "free", "rms"]
+
+MAD_TO_SIGMA = 1.4826  # Factor para convertir la MAD en sigma de una gaussiana
+DEFAULT_MAX_SAMPLES = 1_000_000
+
+
+def image_plane(data):
+    """
+    Plano 2-D de `data`, indexando los ejes degenerados (longitud 1) sin np.asarray: en
+    arreglos memory-mapped o dask no se lee nada todavía. Con más de un plano (un cubo)
+    lanza ValueError: el canal y el plano Stokes se eligen antes (p. ej. con hdu.section).
+    """
+    if data.ndim == 2:
+        return data
+    if data.ndim < 2 or any(n != 1 for n in data.shape[:-2]):
+        raise ValueError(f"Se esperaba una imagen 2-D y se recibió un arreglo de forma {data.shape}: "
+                         "seleccione un canal y un plano Stokes antes de estimar el ruido.")
+    return data[(0,) * (data.ndim - 2)]
+
+
+def sample_pixels(data, max_samples=DEFAULT_MAX_SAMPLES, sampling="stride", seed=0):
+    """
+    Retorna una muestra 1-D de píxeles finitos de `data` (como máximo ~max_samples).
+
+    sampling="stride" usa un paso regular en filas y columnas (en arreglos memory-mapped
+    solo se leen las filas muestreadas). sampling="random" elige filas y columnas al azar.
+    """
+    # Sin np.asarray(data) al inicio: en arreglos memory-mapped o dask solo se leen las muestras
+    if max_samples is None or data.size <= max_samples:
+        sample = np.asarray(data, dtype=np.float64).ravel()
+    else:
+        data2d = data.reshape(-1, data.shape[-1])
+        ny, nx = data2d.shape
+        step = int(np.ceil(np.sqrt(data2d.size / max_samples)))
+        if sampling == "random":
+            rng = np.random.default_rng(seed)
+            rows = np.sort(rng.choice(ny, size=min(ny, max(1, ny // step)), replace=False))
+            cols = np.sort(rng.choice(nx, size=min(nx, max(1, nx // step)), replace=False))
+            sample = np.asarray(data2d[rows][:, cols], dtype=np.float64).ravel()
+        else:
+            sample = np.asarray(data2d[::step, ::step], dtype=np.float64).ravel()
+    return sample[np.isfinite(sample)]
+
+
+def mad_sigma(values):
+    """Sigma a partir de la desviación absoluta mediana (MAD) de una muestra 1-D."""
+    if values.size == 0:
+        return None
+    return MAD_TO_SIGMA * float(np.median(np.abs(values - np.median(values))))
+
+
+def clipped_sigma(values, nsigma=3.0, maxiters=10, tol=1e-4):
+    """Desviación estándar con recorte iterativo en `nsigma` sigmas alrededor de la mediana."""
+    if values.size == 0:
+        return None
+    for _ in range(maxiters):
+        center = np.median(values)
+        sigma = float(np.std(values))
+        kept = values[np.abs(values - center) <= nsigma * sigma]
+        if kept.size == 0:
+            break
+        new_sigma = float(np.std(kept))
+        values = kept
+        if abs(sigma - new_sigma) <= tol * sigma:
+            break
+    return float(np.std(values))
+
+
+def rms(values):
+    """RMS de todos los valores (incluye la emisión)."""
+    if values.size == 0:
+        return None
+    return float(np.sqrt(np.mean(values ** 2)))
+
+
+def noise_map(data, tile=256, max_samples_per_tile=4096, estimator="mad"):
+    """
+    Sigma por teselas de `tile` x `tile` píxeles (MAD o recorte iterativo en cada tesela).
+
+    Retorna (sigmas, tile): `sigmas` tiene forma (ceil(ny/tile), ceil(nx/tile)); las teselas
+    sin píxeles finitos quedan en NaN. Cada tesela se submuestrea con paso regular hasta
+    ~max_samples_per_tile píxeles.
+    """
+    data2d = image_plane(data)
+    ny, nx = data2d.shape
+    nty, ntx = -(-ny // tile), -(-nx // tile)
+    step = max(1, int(np.sqrt(tile * tile / max_samples_per_tile)))
+    func = clipped_sigma if estimator == "clip" else mad_sigma
+
+    sigmas = np.full((nty, ntx), np.nan)
+    for ty in range(nty):
+        # Se lee una franja de filas por vez (una sola lectura del disco por franja)
+        band = np.asarray(data2d[ty * tile:(ty + 1) * tile:step], dtype=np.float64)
+        for tx in range(ntx):
+            values = band[:, tx * tile:(tx + 1) * tile:step].ravel()
+            values = values[np.isfinite(values)]
+            if values.size:
+                sigmas[ty, tx] = func(values)
+    return sigmas, tile
+
+
+def expand_noise_map(sigmas, tile, shape):
+    """Expande el mapa de ruido por teselas a la forma completa de la imagen."""
+    full = np.repeat(np.repeat(sigmas, tile, axis=0), tile, axis=1)
+    return full[:shape[-2], :shape[-1]]
+
+
+def emission_free_sigma(data, region=None, tile=256, nsigma=3.0, max_samples=DEFAULT_MAX_SAMPLES):
+    """
+    Ruido de las zonas sin emisión.
+
+    Si se da `region` = (y0, y1, x0, x1) se usa la MAD de esa caja. Si no, se calcula
+    el mapa de ruido por teselas, se descartan las teselas cuyo sigma supera la mediana
+    en más de `nsigma` veces la dispersión (MAD) de los sigmas de las teselas (las
+    teselas con emisión tienen un sigma mayor) y se retorna la mediana de las restantes.
+    """
+    data2d = image_plane(data)
+    if region is not None:
+        y0, y1, x0, x1 = region
+        return mad_sigma(sample_pixels(data2d[y0:y1, x0:x1], max_samples=max_samples))
+
+    # Se ajusta el muestreo por tesela para que el total no supere max_samples
+    ntiles = -(-data2d.shape[0] // tile) * -(-data2d.shape[1] // tile)
+    per_tile = max(256, max_samples // max(ntiles, 1))
+    sigmas, _ = noise_map(data2d, tile=tile, max_samples_per_tile=per_tile)
+    sigmas = sigmas[np.isfinite(sigmas)]
+    if sigmas.size == 0:
+        return None
+    median = np.median(sigmas)
+    quiet = sigmas[sigmas <= median + nsigma * mad_sigma(sigmas)]
+    return float(np.median(quiet))
+
+
+def estimate_sigma(data, method="mad", max_samples=DEFAULT_MAX_SAMPLES, sampling="stride",
+                   region=None, tile=256, nsigma=3.0):
+    """
+    Estima el ruido de una imagen con el método indicado (ver METHODS).
+
+    Parámetros:
+        data (array): Imagen 2-D (o arreglo memory-mapped con ejes degenerados). Un cubo
+            con más de un plano lanza ValueError.
+        method (str, opcional): "mad", "clip", "free" o "rms".
+        max_samples (int, opcional): Número máximo de píxeles muestreados (None = todos).
+        sampling (str, opcional): "stride" o "random".
+        region (tuple, opcional): Caja (y0, y1, x0, x1) sin emisión, para el método "free".
+        tile (int, opcional): Tamaño de las teselas del método "free".
+        nsigma (float, opcional): Umbral del recorte iterativo del método "clip".
+
+    Retorna:
+        El sigma estimado (float) o None si no hay píxeles finitos.
+    """
+    method = method.lower()
+    data = image_plane(data)
+    if method == "free":
+        return emission_free_sigma(data, region=region, tile=tile, max_samples=max_samples)
+
+    values = sample_pixels(data, max_samples=max_samples, sampling=sampling)
+    if method == "mad":
+        return mad_sigma(values)
+    if method == "clip":
+        return clipped_sigma(values, nsigma=nsigma)
+    if method == "rms":
+        return rms(values)
+    raise ValueError(f"Método de ruido desconocido '{method}'. Use uno de: {', '.join(METHODS)}")
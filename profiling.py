@@ -0,0 +1,228 @@
+"""
+Instrumentación por etapas de fits_plotter.py y contcal.py: tiempo de reloj, tiempo de CPU
+y pico de memoria (RSS) de cada etapa del flujo (fits.open, WCS, reproyección, niveles,
+imshow, contornos, savefig; importfits, immath, exportfits; etc.).
+
+Desactivada por defecto: stage() retorna un contexto vacío y el costo es una comparación.
+Se activa con la variable de entorno FITS_PLOTTER_PROFILE, con la opción --profile= de
+contcal.py o desde Python con profiling.enable(). El valor elige el formato del reporte:
+    table           Tabla por etapa (llamadas, tiempo total, CPU, pico de RSS) al terminar,
+                    en stderr.
+    jsonl[:archivo] Una línea JSON por etapa apenas termina (stderr si no hay archivo). Los
+                    procesos hijos agregan líneas al mismo archivo, con su pid.
+    chrome:archivo  Archivo de trazas de Chrome (chrome://tracing o https://ui.perfetto.dev)
+                    escrito al terminar.
+
+El pico de RSS de cada etapa se mide reiniciando el máximo de memoria residente del proceso
+(/proc/self/clear_refs, Linux) al entrar en ella; donde no es posible se informa el máximo
+del proceso hasta ese momento (ru_maxrss). Con etapas en varios hilos a la vez el pico y el
+tiempo de CPU son los del proceso completo.
+
+Uso:
+    FITS_PLOTTER_PROFILE=table python batch_plot.py ...
+    python contcal.py imagen.fits 0 sigma auto "3,5,10" salida.fits --profile=chrome:traza.json
+
+    import profiling
+    profiling.enable("table")
+    plotter = FITSPlotter("base.fits", "contornos.fits", moment="m0")
+    plotter.export("png")
+    profiling.report()
+
+    with profiling.stage("mi_etapa", archivo="x.fits"):
+        ...
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import resource
+import threading
+from contextlib import contextmanager, nullcontext
+
+PROFILE_ENV = "FITS_PLOTTER_PROFILE"
+FORMATS = ("table", "jsonl", "chrome")
+
+_profiler = None
+_NULL = nullcontext()
+
+
+def rss_peak_mb():
+    """Máximo de memoria residente (MB) desde el último reinicio (o desde el inicio del proceso)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def reset_rss_peak():
+    """Reinicia el máximo de memoria residente del proceso (Linux). Retorna False si no es posible."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+class Profiler:
+    """Registra las etapas terminadas y genera el reporte en el formato elegido."""
+
+    def __init__(self, fmt="table", output=None):
+        if fmt not in FORMATS:
+            raise ValueError(f"Formato de perfil desconocido '{fmt}'. Use uno de: {', '.join(FORMATS)}")
+        if fmt == "chrome" and not output:
+            raise ValueError("El formato 'chrome' requiere un archivo (chrome:<archivo>).")
+        self.fmt = fmt
+        self.output = output
+        self.records = []
+        self.can_reset = reset_rss_peak()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def stage(self, name, **info):
+        """Mide la etapa `name`; `info` se agrega al registro (p. ej. el archivo o el método)."""
+        stack = self._stack()
+        if stack and self.can_reset:
+            # El pico de la etapa que contiene a esta se conserva antes de reiniciarlo
+            stack[-1]["peak_rss_mb"] = max(stack[-1]["peak_rss_mb"], rss_peak_mb())
+        if self.can_reset:
+            reset_rss_peak()
+        frame = {"peak_rss_mb": 0.0}
+        stack.append(frame)
+        path = "/".join([entry["name"] for entry in stack[:-1]] + [name])
+        frame["name"] = name
+        start_ns = time.time_ns()
+        wall0, cpu0 = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall0, time.process_time() - cpu0
+            peak = max(frame["peak_rss_mb"], rss_peak_mb())
+            stack.pop()
+            if stack:
+                stack[-1]["peak_rss_mb"] = max(stack[-1]["peak_rss_mb"], peak)
+            self.add({"stage": name, "path": path, "depth": len(stack), "pid": os.getpid(),
+                      "tid": threading.get_ident(), "start_us": start_ns // 1000, "wall_s": wall,
+                      "cpu_s": cpu, "peak_rss_mb": peak, **info})
+
+    def add(self, record):
+        with self._lock:
+            self.records.append(record)
+            if self.fmt == "jsonl":
+                line = json.dumps(record, default=str) + "\n"
+                if self.output:
+                    # Una sola escritura en modo append: las líneas de varios procesos no se mezclan
+                    with open(self.output, "a") as f:
+                        f.write(line)
+                else:
+                    sys.stderr.write(line)
+
+    def summary(self):
+        """Totales por etapa (ruta completa), en el orden en que aparecieron por primera vez."""
+        rows = {}
+        for record in sorted(self.records, key=lambda r: r["start_us"]):
+            row = rows.setdefault(record["path"], {"path": record["path"], "stage": record["stage"],
+                                                   "depth": record["depth"], "calls": 0, "wall_s": 0.0,
+                                                   "cpu_s": 0.0, "peak_rss_mb": 0.0})
+            row["calls"] += 1
+            row["wall_s"] += record["wall_s"]
+            row["cpu_s"] += record["cpu_s"]
+            row["peak_rss_mb"] = max(row["peak_rss_mb"], record["peak_rss_mb"])
+        return list(rows.values())
+
+    def table(self):
+        """Tabla de texto con los totales por etapa (las etapas anidadas van indentadas)."""
+        lines = [f"{'etapa':<40} {'llamadas':>8} {'tiempo (s)':>10} {'CPU (s)':>9} {'pico RSS (MB)':>14}"]
+        for row in self.summary():
+            label = "  " * row["depth"] + row["stage"]
+            lines.append(f"{label[:40]:<40} {row['calls']:>8} {row['wall_s']:>10.3f} {row['cpu_s']:>9.3f} "
+                         f"{row['peak_rss_mb']:>14.1f}")
+        if not self.can_reset:
+            lines.append("(pico de RSS acumulado del proceso: no se pudo reiniciar por etapa)")
+        return "\n".join(lines)
+
+    def chrome_trace(self):
+        """Eventos completos ('X') en el formato de trazas de Chrome."""
+        events = []
+        for record in self.records:
+            args = {key: value for key, value in record.items()
+                    if key not in ("stage", "pid", "tid", "start_us", "wall_s", "depth")}
+            events.append({"name": record["stage"], "cat": "fits_plotting_tool", "ph": "X",
+                           "ts": record["start_us"], "dur": record["wall_s"] * 1e6,
+                           "pid": record["pid"], "tid": record["tid"], "args": args})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def report(self, stream=None):
+        """Escribe el reporte final (tabla o traza de Chrome); en formato jsonl ya se escribió todo."""
+        if self.fmt == "table" and self.records:
+            print(self.table(), file=stream or sys.stderr)
+        elif self.fmt == "chrome":
+            with open(self.output, "w") as f:
+                json.dump(self.chrome_trace(), f, default=str)
+            print(f"Traza de Chrome guardada en {self.output}", file=stream or sys.stderr)
+
+
+def parse_spec(spec):
+    """'table', 'jsonl', 'jsonl:archivo' o 'chrome:archivo' -> (formato, archivo). '1' equivale a 'table'."""
+    fmt, _, output = str(spec).partition(":")
+    fmt = fmt.strip().lower()
+    if fmt in ("1", "true", "yes", ""):
+        fmt = "table"
+    return fmt, output or None
+
+
+def enable(spec="table"):
+    """Activa la instrumentación en este proceso y retorna el Profiler. El reporte se escribe al salir."""
+    global _profiler
+    fmt, output = parse_spec(spec)
+    if _profiler is None:
+        atexit.register(_report_at_exit)
+    _profiler = Profiler(fmt, output)
+    return _profiler
+
+
+def disable():
+    """Desactiva la instrumentación (sin escribir el reporte)."""
+    global _profiler
+    _profiler = None
+
+
+def active():
+    """Profiler activo o None."""
+    return _profiler
+
+
+def stage(name, **info):
+    """Contexto que mide una etapa si la instrumentación está activa (si no, no hace nada)."""
+    if _profiler is None:
+        return _NULL
+    return _profiler.stage(name, **info)
+
+
+def report(stream=None):
+    """Escribe el reporte del Profiler activo y vacía sus registros."""
+    if _profiler is not None:
+        _profiler.report(stream)
+        _profiler.records = []
+
+
+def _report_at_exit():
+    if _profiler is not None and _profiler.records:
+        report()
+
+
+if os.environ.get(PROFILE_ENV):
+    enable(os.environ[PROFILE_ENV])
@@ -0,0 +1,408 @@
+"""
+Pirámide de teselas multirresolución de una imagen FITS, para recorrer mapas enormes
+(30k x 30k o más) con zoom y desplazamiento cargando solo las teselas visibles.
+
+El nivel 0 es la resolución completa y el nivel k el promedio por bloques de 2^k x 2^k
+píxeles que ignora los NaN (como downsample.block_average). La imagen se lee una sola vez,
+por franjas de filas: de cada franja se obtienen todos los niveles sumando bloques de 2 x 2
+(sumas y cuentas de píxeles válidos), y cada nivel se escribe apenas completa una fila de
+teselas, de modo que la memoria no depende del tamaño de la imagen.
+
+Formatos (parámetro `fmt`):
+    "png", "webp": Teselas RGBA de tile_size x tile_size en <salida>/<z>/<x>/<y>.<fmt>
+                   (z = 0 es el nivel más reducido, y = 0 la fila de arriba, como en los
+                   visores XYZ). Los NaN son transparentes y los contornos, si se dan, se
+                   rasterizan como líneas de 1 píxel donde cambia el nivel. Las teselas
+                   vacías no se escriben.
+    "zarr":        Un arreglo float32 por nivel ("0", "1", ...) en bloques de tile_size,
+                   con las filas en el orden del FITS (fila 0 abajo), y el mapa de índice de
+                   nivel de los contornos en "contours/<k>" (requiere zarr).
+
+En todos los casos <salida>/pyramid.json describe la pirámide: forma y número de teselas de
+cada nivel, el WCS de cada nivel (header FITS), la escala de colores y los niveles de
+contorno. En las teselas la imagen queda anclada abajo a la izquierda de la grilla: la fila
+de teselas superior y la columna derecha pueden tener relleno transparente.
+
+Uso:
+    python pyramid.py mosaico.fits mosaico_teselas/ --contour=contornos.fits --levels=3,5,10 --sigma=mad
+
+    plotter = FITSPlotter("mosaico.fits", "contornos.fits", moment="m0", lazy=True, reproject_tiles=True)
+    plotter.export_pyramid("mosaico_teselas", contour_levels=[3, 5, 10])
+
+    from pyramid import build_pyramid, read_region
+    build_pyramid(data, wcs, "mosaico.zarr", fmt="zarr")
+    view = read_region("mosaico_teselas", level=2, x0=0, x1=1024, y0=0, y1=768)
+"""
+
+import os
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+from matplotlib import colormaps, colors
+
+from noise import sample_pixels
+from profiling import stage
+
+FORMATS = ["png", "webp", "zarr"]
+TILE_SIZE = 256
+METADATA_FILE = "pyramid.json"
+CONTOUR_ALPHA = 0.8  # Opacidad de las líneas de contorno (como en FITSPlotter.draw)
+NAN_INDEX = 255  # Índice de nivel de los píxeles sin datos
+
+
+def pyramid_levels(shape, tile_size=TILE_SIZE):
+    """Número de niveles: el más reducido (factor 2^(n-1)) cabe en una sola tesela."""
+    size = max(shape[-2:])
+    levels = 1
+    while size > tile_size:
+        size = -(-size // 2)
+        levels += 1
+    return levels
+
+
+def level_shape(shape, level):
+    """Forma (ny, nx) del nivel `level` (bloques de 2^level, los bordes parciales cuentan)."""
+    factor = 2 ** level
+    return -(-shape[-2] // factor), -(-shape[-1] // factor)
+
+
+def contour_mask(index, previous=None):
+    """
+    Líneas de contorno de 1 píxel: píxeles cuyo índice de nivel difiere del vecino izquierdo
+    o del inferior (`previous` es la fila inmediatamente debajo de `index`, si existe).
+    """
+    below = np.concatenate([index[:1] if previous is None else previous[None], index[:-1]])
+    valid = index != NAN_INDEX
+    mask = valid & (below != NAN_INDEX) & (index != below)
+    mask[:, 1:] |= valid[:, 1:] & valid[:, :-1] & (index[:, 1:] != index[:, :-1])
+    return mask
+
+
+class _Level:
+    """Filas pendientes de un nivel de la pirámide; se entregan de a una fila de teselas."""
+
+    def __init__(self, level, shape, tile_size):
+        self.level = level
+        self.shape = shape
+        self.tile_size = tile_size
+        self.values = []
+        self.index = []
+        self.pending = 0
+        self.tile_row = 0
+        self.previous = None  # Última fila del índice de nivel ya entregada
+
+    def add(self, values, index):
+        self.values.append(values)
+        self.index.append(index)
+        self.pending += values.shape[0]
+
+    def take(self, final=False):
+        """Filas de teselas completas (o la última, si final) como (fila, valores, índice, máscara)."""
+        while self.pending >= self.tile_size or (final and self.pending):
+            values = np.concatenate(self.values)
+            rows = min(self.tile_size, self.pending)
+            self.values = [values[rows:]]
+            index = mask = None
+            if self.index[0] is None:
+                self.index = [None]
+            else:
+                all_index = np.concatenate(self.index)
+                self.index = [all_index[rows:]]
+                index = all_index[:rows]
+                mask = contour_mask(index, self.previous)
+                self.previous = index[-1]
+            self.pending -= rows
+            yield self.tile_row, values[:rows], index, mask
+            self.tile_row += 1
+
+
+class TileWriter:
+    """Escribe teselas PNG o WebP coloreadas, con los NaN transparentes y los contornos rasterizados."""
+
+    def __init__(self, output, fmt, tile_size, shapes, cmap, vmin, vmax, contour_color):
+        from PIL import Image
+        self.image = Image
+        self.output = output
+        self.fmt = fmt
+        self.tile_size = tile_size
+        self.shapes = shapes
+        self.cmap = colormaps[cmap] if isinstance(cmap, str) else cmap
+        self.norm = colors.Normalize(vmin, vmax, clip=True)
+        self.contour_rgb = np.array(colors.to_rgb(contour_color)) * 255
+
+    def path(self, level, tile_row, tile_col):
+        """Archivo de la tesela (fila de teselas contada desde abajo, como en el FITS)."""
+        ntiles_y = -(-self.shapes[level][0] // self.tile_size)
+        z = len(self.shapes) - 1 - level
+        return os.path.join(self.output, str(z), str(tile_col), f"{ntiles_y - 1 - tile_row}.{self.fmt}")
+
+    def write(self, level, tile_row, tile_col, values, index, mask):
+        valid = np.isfinite(values)
+        lines = mask is not None and mask.any()
+        if not valid.any() and not lines:
+            return
+        rgba = self.cmap(self.norm(values), bytes=True)
+        rgba[..., 3] = np.where(valid, 255, 0)
+        if lines:
+            rgba[mask, :3] = (CONTOUR_ALPHA * self.contour_rgb + (1 - CONTOUR_ALPHA) * rgba[mask, :3]).astype(np.uint8)
+            rgba[mask, 3] = 255
+
+        # Imagen anclada abajo a la izquierda; la tesela se guarda con la fila de arriba primero
+        tile = np.zeros((self.tile_size, self.tile_size, 4), dtype=np.uint8)
+        height, width = values.shape
+        tile[self.tile_size - height:, :width] = rgba[::-1]
+        path = self.path(level, tile_row, tile_col)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        options = {"quality": 90} if self.fmt == "webp" else {}
+        self.image.fromarray(tile, "RGBA").save(path, format=self.fmt.upper(), **options)
+
+    def close(self, metadata):
+        pass
+
+
+class ZarrWriter:
+    """Escribe cada nivel como un arreglo float32 de Zarr, en bloques del tamaño de las teselas."""
+
+    def __init__(self, output, tile_size, shapes, contours):
+        try:
+            import zarr
+        except ImportError:
+            raise ValueError("El formato 'zarr' requiere zarr (pip install zarr).")
+        self.group = zarr.open_group(output, mode="w")
+        create = getattr(self.group, "create_array", None) or self.group.create_dataset
+        chunks = (tile_size, tile_size)
+        self.tile_size = tile_size
+        self.arrays = [create(str(k), shape=shape, chunks=chunks, dtype="f4", fill_value=np.nan)
+                       for k, shape in enumerate(shapes)]
+        self.index = None
+        if contours:
+            self.index = [create(f"contours/{k}", shape=shape, chunks=chunks, dtype="u1", fill_value=NAN_INDEX)
+                          for k, shape in enumerate(shapes)]
+
+    def write(self, level, tile_row, tile_col, values, index, mask):
+        y0, x0 = tile_row * self.tile_size, tile_col * self.tile_size
+        height, width = values.shape
+        self.arrays[level][y0:y0 + height, x0:x0 + width] = values.astype(np.float32)
+        if self.index is not None:
+            self.index[level][y0:y0 + height, x0:x0 + width] = index
+
+    def close(self, metadata):
+        # Metadatos multiescala (estilo OME-NGFF) y la descripción completa de la pirámide
+        datasets = [{"path": str(entry["level"]),
+                     "coordinateTransformations": [
+                         {"type": "scale", "scale": [entry["factor"]] * 2},
+                         {"type": "translation", "translation": [(entry["factor"] - 1) / 2] * 2}]}
+                    for entry in metadata["levels"]]
+        self.group.attrs["multiscales"] = [{"version": "0.4", "name": metadata["source"] or "",
+                                            "axes": [{"name": "y", "type": "space"},
+                                                     {"name": "x", "type": "space"}],
+                                            "datasets": datasets}]
+        self.group.attrs["pyramid"] = metadata
+
+
+def _band_sums(data, y0, rows, width):
+    """Sumas y cuentas de píxeles válidos de las filas [y0, y0 + rows), con relleno hasta `width` columnas."""
+    block = np.asarray(data[y0:y0 + rows], dtype=np.float64)
+    pad_y, pad_x = rows - block.shape[0], width - block.shape[1]
+    if pad_y or pad_x:
+        block = np.pad(block, ((0, pad_y), (0, pad_x)), constant_values=np.nan)
+    valid = np.isfinite(block)
+    return np.where(valid, block, 0.0), valid.astype(np.int32)
+
+
+def _halve(sums, counts):
+    """Suma de bloques de 2 x 2."""
+    ny, nx = sums.shape
+    return (sums.reshape(ny // 2, 2, nx // 2, 2).sum(axis=(1, 3)),
+            counts.reshape(ny // 2, 2, nx // 2, 2).sum(axis=(1, 3)))
+
+
+def _means(sums, counts):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def build_pyramid(data, wcs, output, fmt="png", tile_size=TILE_SIZE, contour=None, contour_levels=None,
+                  cmap="gnuplot2", contour_color="white", vmin=None, vmax=None, workers=None, source=None):
+    """
+    Construye la pirámide de `data` (2-D; puede ser memory-mapped o dask) en el directorio
+    `output` y retorna sus metadatos (también guardados en <output>/pyramid.json).
+
+    Parámetros:
+        wcs (WCS): WCS celeste de `data`; se guarda el de cada nivel.
+        fmt (str): 'png', 'webp' o 'zarr'.
+        contour (array, opcional): Imagen de contornos en la misma grilla que `data` (p. ej.
+            los contornos reproyectados de FITSPlotter) y contour_levels, sus niveles.
+        cmap, contour_color: Colores de las teselas PNG/WebP.
+        vmin, vmax (float, opcional): Escala de colores común a todas las teselas; por defecto
+            el mínimo y el máximo de una muestra de píxeles (noise.sample_pixels).
+        workers (int, opcional): Hilos para codificar y escribir las teselas.
+        source (str, opcional): Archivo de origen, para los metadatos.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato de pirámide desconocido '{fmt}'. Use uno de: {', '.join(FORMATS)}")
+    if data.ndim > 2:
+        data = data.reshape(data.shape[-2:])
+    if contour is not None and contour.ndim > 2:
+        contour = contour.reshape(contour.shape[-2:])
+    ny, nx = data.shape
+    nlevels = pyramid_levels((ny, nx), tile_size)
+    shapes = [level_shape((ny, nx), k) for k in range(nlevels)]
+    sorted_levels = None
+    if contour is not None and contour_levels is not None and len(contour_levels):
+        sorted_levels = np.sort(np.asarray(contour_levels, dtype=float))
+
+    if vmin is None or vmax is None:
+        sample = sample_pixels(data)
+        if vmin is None:
+            vmin = float(sample.min()) if sample.size else 0.0
+        if vmax is None:
+            vmax = float(sample.max()) if sample.size else 1.0
+
+    os.makedirs(output, exist_ok=True)
+    if fmt == "zarr":
+        writer = ZarrWriter(output, tile_size, shapes, sorted_levels is not None)
+    else:
+        writer = TileWriter(output, fmt, tile_size, shapes, cmap, vmin, vmax, contour_color)
+
+    # Franjas de 2^(n-1) filas: cada una aporta un número entero de filas a todos los niveles
+    band = 2 ** (nlevels - 1)
+    width = -(-nx // band) * band
+    levels = [_Level(k, shape, tile_size) for k, shape in enumerate(shapes)]
+    workers = workers or os.cpu_count() or 1
+    pending = set()
+
+    def emit(pool, level, final=False):
+        """Envía a escribir las filas de teselas completas del nivel (a lo más 4 x workers en vuelo)."""
+        for tile_row, values, index, mask in level.take(final):
+            for x0 in range(0, level.shape[1], tile_size):
+                pending.add(pool.submit(writer.write, level.level, tile_row, x0 // tile_size,
+                                        values[:, x0:x0 + tile_size],
+                                        None if index is None else index[:, x0:x0 + tile_size],
+                                        None if mask is None else mask[:, x0:x0 + tile_size]))
+                if len(pending) >= 4 * workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        pending.discard(future)
+                        future.result()
+
+    with stage("pyramid", fmt=fmt, levels=nlevels), ThreadPoolExecutor(workers) as pool:
+        for y0 in range(0, ny, band):
+            sums, counts = _band_sums(data, y0, band, width)
+            if sorted_levels is not None:
+                contour_sums, contour_counts = _band_sums(contour, y0, band, width)
+            for level in levels:
+                if level.level:
+                    sums, counts = _halve(sums, counts)
+                    if sorted_levels is not None:
+                        contour_sums, contour_counts = _halve(contour_sums, contour_counts)
+                rows = min(sums.shape[0], level.shape[0] - y0 // 2 ** level.level)
+                values = _means(sums[:rows], counts[:rows])[:, :level.shape[1]]
+                index = None
+                if sorted_levels is not None:
+                    contour_values = _means(contour_sums[:rows], contour_counts[:rows])[:, :level.shape[1]]
+                    index = np.searchsorted(sorted_levels, contour_values, side='left').astype(np.uint8)
+                    index[~np.isfinite(contour_values)] = NAN_INDEX
+                level.add(values, index)
+                emit(pool, level)
+        for level in levels:
+            emit(pool, level, final=True)
+        for future in pending:
+            future.result()
+
+    metadata = {
+        "format": fmt,
+        "source": source,
+        "shape": [ny, nx],
+        "tile_size": tile_size,
+        "tiles": None if fmt == "zarr" else "{z}/{x}/{y}." + fmt,
+        "anchor": "bottom-left",
+        "vmin": vmin,
+        "vmax": vmax,
+        "cmap": getattr(cmap, "name", cmap),
+        "contour_levels": None if sorted_levels is None else sorted_levels.tolist(),
+        "contour_color": contour_color if sorted_levels is not None else None,
+        "levels": [{"level": k, "z": nlevels - 1 - k, "factor": 2 ** k, "shape": list(shape),
+                    "tiles": [-(-shape[0] // tile_size), -(-shape[1] // tile_size)],
+                    "wcs": (wcs if k == 0 else wcs[::2 ** k, ::2 ** k]).to_header_string(relax=True)}
+                   for k, shape in enumerate(shapes)],
+    }
+    writer.close(metadata)
+    with open(os.path.join(output, METADATA_FILE), "w") as f:
+        json.dump(metadata, f, indent=2)
+    return metadata
+
+
+def read_metadata(path):
+    """Metadatos de una pirámide escrita por build_pyramid."""
+    with open(os.path.join(path, METADATA_FILE)) as f:
+        return json.load(f)
+
+
+def read_region(path, level, x0, x1, y0, y1):
+    """
+    Región [y0:y1, x0:x1] del nivel `level` (píxeles del nivel, fila 0 abajo como en el FITS),
+    leyendo solo las teselas que la cubren. Retorna los valores (Zarr) o la imagen RGBA
+    (PNG/WebP); en ambos casos con la fila 0 abajo, para imshow(..., origin='lower').
+    """
+    metadata = read_metadata(path)
+    if metadata["format"] == "zarr":
+        import zarr
+        return zarr.open_group(path, mode="r")[str(level)][y0:y1, x0:x1]
+
+    from PIL import Image
+    tile_size = metadata["tile_size"]
+    entry = metadata["levels"][level]
+    ny, nx = entry["shape"]
+    y1, x1 = min(y1, ny), min(x1, nx)
+    region = np.zeros((max(y1 - y0, 0), max(x1 - x0, 0), 4), dtype=np.uint8)
+    for tile_row in range(y0 // tile_size, -(-y1 // tile_size)):
+        for tile_col in range(x0 // tile_size, -(-x1 // tile_size)):
+            name = metadata["tiles"].format(z=entry["z"], x=tile_col, y=entry["tiles"][0] - 1 - tile_row)
+            file = os.path.join(path, name)
+            if not os.path.exists(file):
+                continue  # Tesela vacía (sin datos)
+            with Image.open(file) as image:
+                tile = np.asarray(image.convert("RGBA"))[::-1]
+            ty0, tx0 = tile_row * tile_size, tile_col * tile_size
+            sy = slice(max(y0, ty0), min(y1, ty0 + tile_size))
+            sx = slice(max(x0, tx0), min(x1, tx0 + tile_size))
+            region[sy.start - y0:sy.stop - y0, sx.start - x0:sx.stop - x0] = \
+                tile[sy.start - ty0:sy.stop - ty0, sx.start - tx0:sx.stop - tx0]
+    return region
+
+
+def main(argv=None):
+    from fits_plotter import FITSPlotter
+
+    parser = argparse.ArgumentParser(description="Pirámide de teselas multirresolución de una imagen FITS")
+    parser.add_argument("fits_file", help="Archivo FITS de la imagen base")
+    parser.add_argument("output", help="Directorio de salida (teselas o almacén Zarr)")
+    parser.add_argument("--contour", help="Archivo FITS de contornos a rasterizar en las teselas")
+    parser.add_argument("--levels", help="Niveles de contorno en unidades de sigma, separados por comas")
+    parser.add_argument("--sigma", default="3e-3", help="Sigma de los contornos o un estimador de noise.py")
+    parser.add_argument("--moment", help="Tipo de momento (m0, m1, m2, continuo), elige los colores")
+    parser.add_argument("--format", choices=FORMATS, default="png", help="Formato de la pirámide")
+    parser.add_argument("--tile", type=int, default=TILE_SIZE, help="Lado de las teselas (px)")
+    parser.add_argument("--workers", type=int, help="Hilos para reproyectar y escribir las teselas")
+    args = parser.parse_args(argv)
+
+    try:
+        sigma = float(args.sigma)
+    except ValueError:
+        sigma = args.sigma
+    levels = [float(value) for value in args.levels.split(",")] if args.levels else None
+    with FITSPlotter(args.fits_file, args.contour, sigma=sigma, moment=args.moment, lazy=True,
+                     reproject_tiles=True, workers=args.workers) as plotter:
+        metadata = plotter.export_pyramid(args.output, fmt=args.format, contour_levels=levels,
+                                          tile_size=args.tile, workers=args.workers)
+    for entry in metadata["levels"]:
+        print(f"Nivel {entry['level']} (x{entry['factor']}): {entry['shape'][1]}x{entry['shape'][0]} px, "
+              f"{entry['tiles'][1]}x{entry['tiles'][0]} teselas")
+    print(f"Pirámide guardada en {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,464 @@
+"""
+Servidor de render persistente con cachés calientes, para notebooks y la línea de comandos.
+
+Cada celda de Fits_visualizer.ipynb (o cada ejecución de un script) vuelve a importar
+astropy/reproject/matplotlib, a abrir los FITS y a reproyectar los contornos, aunque solo
+cambie sigma, los niveles o el mapa de colores. Este módulo mantiene un proceso de larga
+duración que guarda en una caché LRU, por imagen/contornos:
+    - el FITSPlotter (HDUs abiertos, WCS y contornos reproyectados),
+    - las polilíneas de contornos ya trazadas por cada conjunto de niveles (contour_lines.py),
+    - las estimaciones de ruido (noise.py) por estimador,
+    - una figura reutilizable por tamaño/dpi (export.FigureTemplate),
+y responde pedidos de render por un socket local (Unix). Tras el primer pedido, cambiar
+sigma, niveles, momento, título o colormap solo actualiza la figura existente.
+
+Uso (línea de comandos):
+    python render_server.py serve                       # Inicia el servidor (primer plano)
+    python render_server.py render base.fits contornos.fits -o mapa.png --moment m0 --sigma mad --levels 3,5,10
+    python render_server.py stats
+    python render_server.py stop
+
+Uso (notebook):
+    from render_server import RenderClient
+    client = RenderClient()                # Inicia el servidor si no está corriendo
+    png = client.render("base.fits", "contornos.fits", moment="m0", sigma=3e-3,
+                        contour_levels=[3, 5, 10], dpi=100)
+    client.image("base.fits", "contornos.fits", moment="m0", cmap="inferno")   # IPython Image
+
+El socket está en ~/.cache/fits_plotting_tool/server/render.sock (variable FITS_PLOTTER_SOCKET),
+dentro de un directorio accesible solo por el usuario: el servidor lo crea con permisos 0700
+si no existe y, si existe, no arranca a menos que ya sea privado. Además, cada servidor escribe una
+clave aleatoria en render.sock.key (solo legible por el usuario) y rechaza las conexiones
+que no se autentican con ella antes de recibir ningún pedido.
+"""
+
+import os
+import sys
+import time
+import argparse
+import threading
+import subprocess
+from collections import OrderedDict
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+
+DEFAULT_SOCKET = os.path.join(os.path.expanduser("~"), ".cache", "fits_plotting_tool", "server", "render.sock")
+DEFAULT_MAX_ENTRIES = 8
+STARTUP_TIMEOUT = 60.0  # Segundos de espera a que el servidor recién iniciado acepte conexiones
+
+# Opciones del pedido que definen el FITSPlotter (cambiarlas abre y reproyecta de nuevo)
+PLOTTER_OPTIONS = ("lazy", "channel", "stokes", "reproject_method", "cutout_center", "cutout_size", "cutout_box")
+# Opciones del pedido que solo cambian la figura (se aplican sobre el FITSPlotter en caché)
+RENDER_OPTIONS = ("sigma", "moment", "region_label", "cmap", "title", "contour_levels", "downsample",
+                  "figsize", "dpi", "fmt")
+
+
+def default_socket():
+    """Ruta del socket: variable FITS_PLOTTER_SOCKET o ~/.cache/fits_plotting_tool/server/render.sock."""
+    return os.environ.get("FITS_PLOTTER_SOCKET", DEFAULT_SOCKET)
+
+
+def check_socket_dir(directory):
+    """
+    Crea el directorio del socket con permisos 0700 si no existe. Si ya existe no se cambian
+    sus permisos: se lanza RuntimeError si no pertenece al usuario o si otros pueden acceder.
+    """
+    directory = directory or "."
+    if not os.path.isdir(directory):
+        os.makedirs(directory, mode=0o700)
+    info = os.stat(directory)
+    if info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise RuntimeError(f"El directorio del socket {os.path.abspath(directory)} debe pertenecer al usuario y "
+                           f"tener permisos 0700 (tiene {oct(info.st_mode & 0o777)}). Use un directorio privado "
+                           f"(--socket o FITS_PLOTTER_SOCKET), p. ej. {DEFAULT_SOCKET}.")
+
+
+def key_file(address):
+    """Archivo con la clave de autenticación del servidor que escucha en `address`."""
+    return address + ".key"
+
+
+def read_authkey(address):
+    """Clave del servidor en `address` (FileNotFoundError si no hay un servidor iniciado)."""
+    with open(key_file(address), "rb") as f:
+        return f.read()
+
+
+def write_authkey(address):
+    """Genera una clave aleatoria nueva para el servidor y la guarda legible solo por el usuario."""
+    authkey = os.urandom(32)
+    fd = os.open(key_file(address), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.fchmod(fd, 0o600)  # Por si el archivo ya existía con otros permisos
+    with os.fdopen(fd, "wb") as f:
+        f.write(authkey)
+    return authkey
+
+
+def file_version(filename):
+    """(ruta absoluta, tamaño, mtime) de un archivo; cambia si el archivo se reescribe."""
+    if filename is None:
+        return None
+    stat = os.stat(filename)
+    return os.path.abspath(filename), stat.st_size, stat.st_mtime_ns
+
+
+class PlotterEntry:
+    """FITSPlotter en caché con sus estimaciones de ruido y sus figuras reutilizables."""
+
+    def __init__(self, plotter):
+        self.plotter = plotter
+        self.noise = {}
+        self.templates = {}
+        self.hits = 0
+
+    def sigma(self, sigma):
+        """Sigma numérico; los estimadores de noise.py se calculan una vez por entrada."""
+        if not isinstance(sigma, str):
+            return float(sigma)
+        if sigma not in self.noise:
+            from noise import estimate_sigma
+            plotter = self.plotter
+            data = plotter.data_contour if plotter.contour_fits else plotter.data_base
+            self.noise[sigma] = estimate_sigma(data, method=sigma)
+        return self.noise[sigma]
+
+    def template(self, figsize, dpi):
+        """Figura reutilizable para el tamaño y dpi pedidos."""
+        from export import FigureTemplate
+        key = (tuple(figsize), dpi)
+        if key not in self.templates:
+            self.templates[key] = FigureTemplate(figsize=figsize, dpi=dpi)
+        return self.templates[key]
+
+    def close(self):
+        for template in self.templates.values():
+            template.close()
+        self.templates.clear()
+        self.plotter.close()
+
+
+class RenderServer:
+    def __init__(self, address=None, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        Parámetros:
+            address (str, opcional): Ruta del socket Unix (por defecto, default_socket()).
+            max_entries (int, opcional): Número de pares imagen/contornos en la caché LRU.
+        """
+        self.address = address or default_socket()
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()  # matplotlib no es thread-safe: un render a la vez
+        self.listener = None
+        self.authkey = None
+        self.running = False
+        self.misses = 0
+
+    def get_entry(self, image_fits, contour_fits, options):
+        """FITSPlotter en caché para los archivos y opciones dados (lo crea si no existe)."""
+        from fits_plotter import FITSPlotter
+        key = (file_version(image_fits), file_version(contour_fits), tuple(sorted(options.items())))
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            entry.hits += 1
+            return entry
+
+        self.misses += 1
+        entry = PlotterEntry(FITSPlotter(image_fits, contour_fits, trace_contours=True, **options))
+        self.entries[key] = entry
+        while len(self.entries) > self.max_entries:
+            _, evicted = self.entries.popitem(last=False)
+            evicted.close()
+        return entry
+
+    def render(self, request):
+        """Renderiza un pedido y retorna el contenido de la figura en bytes."""
+        from fits_plotter import MOMENT_LABELS
+        options = {name: request[name] for name in PLOTTER_OPTIONS if request.get(name) is not None}
+        entry = self.get_entry(request["image_fits"], request.get("contour_fits"), options)
+        plotter = entry.plotter
+
+        # Parámetros que solo cambian la figura: se aplican sobre el FITSPlotter en caché
+        plotter.sigma = entry.sigma(request.get("sigma", 3e-3))
+        plotter.moment = request.get("moment")
+        plotter.colorbar_label = MOMENT_LABELS.get(plotter.moment, "Intensidad (Jy/beam)")
+        plotter.region_label = request.get("region_label")
+        plotter.cmap = request.get("cmap")
+
+        template = entry.template(request.get("figsize", (10, 8)), request.get("dpi", 100))
+        template.update(plotter, title=request.get("title", ""), contour_levels=request.get("contour_levels"),
+                        downsample=request.get("downsample"))
+        return template.to_bytes(request.get("fmt", "png"))
+
+    def handle(self, request):
+        """Atiende un pedido ({'op': ...}) y retorna la respuesta."""
+        op = request.get("op")
+        start = time.perf_counter()
+        with self.lock:
+            if op == "render":
+                content = self.render(request)
+                return {"ok": True, "content": content, "time_s": time.perf_counter() - start}
+            if op == "ping":
+                return {"ok": True, "pid": os.getpid()}
+            if op == "stats":
+                entries = [{"image_fits": key[0][0], "contour_fits": key[1][0] if key[1] else None,
+                            "options": dict(key[2]), "hits": entry.hits,
+                            "levels_traced": len(entry.plotter._contour_lines),
+                            "figures": len(entry.templates)}
+                           for key, entry in self.entries.items()]
+                return {"ok": True, "entries": entries, "misses": self.misses}
+            if op == "clear":
+                for entry in self.entries.values():
+                    entry.close()
+                self.entries.clear()
+                return {"ok": True}
+            if op == "shutdown":
+                self.running = False
+                return {"ok": True}
+        return {"ok": False, "error": f"Operación desconocida: {op}"}
+
+    def serve_connection(self, conn):
+        """Atiende todos los pedidos de una conexión (el cliente puede reutilizarla)."""
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    response = self.handle(request)
+                except Exception as error:
+                    response = {"ok": False, "error": f"{type(error).__name__}: {error}"}
+                conn.send(response)
+                if not self.running:
+                    # Despierta el accept() del hilo principal para que termine
+                    try:
+                        Client(self.address, family="AF_UNIX", authkey=self.authkey).close()
+                    except OSError:
+                        pass
+                    return
+
+    def serve_forever(self):
+        """Escucha en el socket hasta recibir 'shutdown'."""
+        import matplotlib
+        matplotlib.use("Agg")
+
+        check_socket_dir(os.path.dirname(self.address))
+        if os.path.exists(self.address):
+            try:
+                Client(self.address, family="AF_UNIX", authkey=read_authkey(self.address)).close()
+                raise RuntimeError(f"Ya hay un servidor escuchando en {self.address}")
+            except AuthenticationError:
+                raise RuntimeError(f"Ya hay un servidor escuchando en {self.address}")
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.unlink(self.address)  # Socket de un servidor que terminó sin limpiar
+
+        self.authkey = write_authkey(self.address)
+        self.listener = Listener(self.address, family="AF_UNIX", authkey=self.authkey)
+        os.chmod(self.address, 0o600)
+        self.running = True
+        print(f"Servidor de render escuchando en {self.address} (pid {os.getpid()})")
+        try:
+            while self.running:
+                try:
+                    conn = self.listener.accept()
+                except (AuthenticationError, EOFError, ConnectionResetError):
+                    continue  # Cliente sin la clave: se descarta sin leer nada de la conexión
+                if not self.running:
+                    conn.close()
+                    break
+                threading.Thread(target=self.serve_connection, args=(conn,), daemon=True).start()
+        finally:
+            self.listener.close()
+            try:
+                os.unlink(key_file(self.address))
+            except FileNotFoundError:
+                pass
+            for entry in self.entries.values():
+                entry.close()
+            self.entries.clear()
+            print("Servidor de render detenido.")
+
+
+class RenderClient:
+    def __init__(self, address=None, autostart=True, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        Cliente del servidor de render. La conexión se abre una vez y se reutiliza.
+
+        Parámetros:
+            address (str, opcional): Ruta del socket (por defecto, default_socket()).
+            autostart (bool, opcional): Inicia el servidor en segundo plano si no está corriendo.
+            max_entries (int, opcional): Tamaño de la caché del servidor, si se inicia aquí.
+        """
+        self.address = address or default_socket()
+        self.autostart = autostart
+        self.max_entries = max_entries
+        self.conn = None
+
+    def connect(self):
+        if self.conn is not None:
+            return self.conn
+        try:
+            self.conn = Client(self.address, family="AF_UNIX", authkey=read_authkey(self.address))
+        except (ConnectionRefusedError, FileNotFoundError):
+            if not self.autostart:
+                raise
+            self.start_server()
+        return self.conn
+
+    def start_server(self):
+        """Inicia el servidor en un proceso independiente y espera a que acepte conexiones."""
+        check_socket_dir(os.path.dirname(self.address))  # El error se ve aquí y no como un tiempo agotado
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), "--socket", self.address, "serve",
+                          "--max-entries", str(self.max_entries)],
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True,
+                         cwd=os.path.dirname(os.path.abspath(__file__)))
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while True:
+            try:
+                self.conn = Client(self.address, family="AF_UNIX", authkey=read_authkey(self.address))
+                return
+            except (ConnectionRefusedError, FileNotFoundError, AuthenticationError):
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"El servidor de render no respondió en {self.address}")
+                time.sleep(0.1)
+
+    def request(self, op, **fields):
+        """Envía un pedido y retorna la respuesta (RuntimeError si el servidor reporta un error)."""
+        for attempt in range(2):
+            conn = self.connect()
+            try:
+                conn.send(dict(fields, op=op))
+                response = conn.recv()
+                break
+            except (EOFError, OSError):
+                # El servidor se reinició: se reconecta una vez
+                self.close()
+                if attempt:
+                    raise
+        if not response.get("ok"):
+            raise RuntimeError(response.get("error", "Error desconocido del servidor de render"))
+        return response
+
+    def render(self, image_fits, contour_fits=None, **options):
+        """
+        Renderiza la imagen en el servidor y retorna el contenido (bytes, PNG por defecto).
+
+        Opciones del FITSPlotter: lazy, channel, stokes, reproject_method, cutout_center,
+        cutout_size, cutout_box. Opciones de la figura (no reabren ni reproyectan): sigma
+        (valor o estimador de noise.py), moment, region_label, cmap, title, contour_levels,
+        downsample, figsize, dpi (100 por defecto) y fmt.
+        """
+        unknown = set(options) - set(PLOTTER_OPTIONS) - set(RENDER_OPTIONS)
+        if unknown:
+            raise TypeError(f"Opciones desconocidas: {sorted(unknown)}")
+        image_fits = os.path.abspath(image_fits)
+        contour_fits = os.path.abspath(contour_fits) if contour_fits else None
+        return self.request("render", image_fits=image_fits, contour_fits=contour_fits, **options)["content"]
+
+    def image(self, image_fits, contour_fits=None, **options):
+        """Como render(), pero retorna un IPython.display.Image para mostrar en un notebook."""
+        from IPython.display import Image
+        return Image(data=self.render(image_fits, contour_fits, **dict(options, fmt="png")))
+
+    def ping(self):
+        """Verifica que el servidor responda; retorna su pid."""
+        return self.request("ping")["pid"]
+
+    def stats(self):
+        """Contenido de la caché del servidor."""
+        return self.request("stats")
+
+    def clear(self):
+        """Vacía la caché del servidor."""
+        self.request("clear")
+
+    def shutdown(self):
+        """Detiene el servidor."""
+        self.request("shutdown")
+        self.close()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+        self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def parse_sigma(value):
+    """Sigma numérico o nombre de un estimador de noise.py."""
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor de render persistente de FITSPlotter")
+    parser.add_argument("--socket", default=None, help="Ruta del socket (por defecto, FITS_PLOTTER_SOCKET)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve = subparsers.add_parser("serve", help="Inicia el servidor en primer plano")
+    serve.add_argument("--max-entries", type=int, default=DEFAULT_MAX_ENTRIES,
+                       help="Número de pares imagen/contornos en la caché")
+
+    render = subparsers.add_parser("render", help="Renderiza una imagen usando el servidor")
+    render.add_argument("image_fits", help="Imagen base")
+    render.add_argument("contour_fits", nargs="?", default=None, help="Imagen de contornos")
+    render.add_argument("-o", "--output", required=True, help="Archivo de salida")
+    render.add_argument("--moment", default=None, help="Tipo de momento ('m0', 'm1', 'm2', 'continuo')")
+    render.add_argument("--sigma", type=parse_sigma, default=3e-3, help="Sigma o estimador de noise.py")
+    render.add_argument("--levels", default=None, help="Niveles en unidades de sigma, separados por comas")
+    render.add_argument("--title", default="", help="Título de la figura")
+    render.add_argument("--label", default=None, help="Nombre de la región")
+    render.add_argument("--cmap", default=None, help="Mapa de colores")
+    render.add_argument("--dpi", type=int, default=100, help="Resolución de la figura")
+    render.add_argument("--downsample", default=None, help="Factor de reducción o 'auto'")
+
+    subparsers.add_parser("stats", help="Muestra el contenido de la caché del servidor")
+    subparsers.add_parser("clear", help="Vacía la caché del servidor")
+    subparsers.add_parser("stop", help="Detiene el servidor")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        RenderServer(args.socket, max_entries=args.max_entries).serve_forever()
+        return
+
+    with RenderClient(args.socket, autostart=args.command == "render") as client:
+        if args.command == "render":
+            levels = [float(v) for v in args.levels.split(",")] if args.levels else None
+            downsample = args.downsample if args.downsample in (None, "auto") else int(args.downsample)
+            start = time.perf_counter()
+            content = client.render(args.image_fits, args.contour_fits, moment=args.moment, sigma=args.sigma,
+                                    contour_levels=levels, title=args.title, region_label=args.label,
+                                    cmap=args.cmap, dpi=args.dpi, downsample=downsample,
+                                    fmt=os.path.splitext(args.output)[1].lstrip(".") or "png")
+            with open(args.output, "wb") as f:
+                f.write(content)
+            print(f"Imagen guardada como {args.output} ({time.perf_counter() - start:.3f} s)")
+            return
+        try:
+            client.connect()
+        except (ConnectionRefusedError, FileNotFoundError):
+            parser.exit(1, f"No hay un servidor de render escuchando en {client.address}\n")
+        if args.command == "stats":
+            stats = client.stats()
+            print(f"{len(stats['entries'])} entradas en caché, {stats['misses']} aperturas")
+            for entry in stats["entries"]:
+                print(f"  {entry['image_fits']} + {entry['contour_fits']}: {entry['hits']} usos, "
+                      f"{entry['levels_traced']} conjuntos de niveles, {entry['figures']} figuras")
+        elif args.command == "clear":
+            client.clear()
+            print("Caché del servidor vaciada.")
+        else:
+            client.shutdown()
+            print("Servidor de render detenido.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Caché persistente en disco de contornos reproyectados para FITSPlotter.
+
+Cada entrada guarda el arreglo reproyectado y su footprint, con una clave formada por:
+    - el hash (SHA-256) del contenido del archivo FITS de contornos,
+    - el plano leído (canal/Stokes),
+    - el WCS de destino (header completo) y el tamaño de la grilla de salida,
+    - el algoritmo de reproyección.
+Si cambia cualquiera de las entradas cambia la clave, por lo que las entradas viejas
+nunca se reutilizan y terminan desalojándose por LRU cuando se supera el tamaño máximo.
+
+Para no recalcular el hash de archivos grandes en cada ejecución, el hash del contenido
+se guarda en un índice por (ruta, tamaño, mtime): solo se vuelve a leer el archivo si
+este fue modificado.
+
+Uso:
+    from reproject_cache import ReprojectionCache
+    cache = ReprojectionCache(max_bytes=2 * 1024**3)
+    plotter = FITSPlotter("base.fits", "contornos.fits", reproject_cache=cache)
+
+El directorio por defecto es ~/.cache/fits_plotting_tool/reproject, o el indicado en la
+variable de entorno FITS_PLOTTER_CACHE.
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "fits_plotting_tool", "reproject")
+DEFAULT_MAX_BYTES = 4 * 1024 ** 3  # 4 GB
+
+HASH_CHUNK = 16 * 1024 ** 2  # Lectura por bloques de 16 MB al calcular el hash
+
+
+def default_cache_dir():
+    """Directorio de caché: variable FITS_PLOTTER_CACHE o ~/.cache/fits_plotting_tool/reproject."""
+    return os.environ.get("FITS_PLOTTER_CACHE", DEFAULT_CACHE_DIR)
+
+
+class ReprojectionCache:
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Parámetros:
+            cache_dir (str, opcional): Directorio donde se guardan las entradas.
+            max_bytes (int, opcional): Tamaño máximo total; al superarlo se eliminan
+                las entradas usadas menos recientemente (LRU).
+        """
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.hash_index_file = os.path.join(self.cache_dir, "file_hashes.json")
+
+    def file_hash(self, filename):
+        """
+        Hash SHA-256 del contenido de un archivo. Se reutiliza el valor guardado mientras
+        la ruta, el tamaño y el mtime del archivo no cambien.
+        """
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        signature = [stat.st_size, stat.st_mtime_ns]
+
+        index = self._read_hash_index()
+        entry = index.get(path)
+        if entry and entry["signature"] == signature:
+            return entry["sha256"]
+
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(HASH_CHUNK), b""):
+                sha.update(block)
+        digest = sha.hexdigest()
+
+        index = self._read_hash_index()  # Releer por si otro proceso lo actualizó
+        index[path] = {"signature": signature, "sha256": digest}
+        self._atomic_write(self.hash_index_file, json.dumps(index).encode())
+        return digest
+
+    def make_key(self, contour_fits, wcs_out, shape_out, plane=None, method="interp"):
+        """Clave de la entrada: contenido del archivo + plano + WCS/grilla de destino + método."""
+        sha = hashlib.sha256()
+        sha.update(self.file_hash(contour_fits).encode())
+        sha.update(repr(plane).encode())
+        sha.update(wcs_out.to_header_string(relax=True).encode())
+        sha.update(repr(tuple(int(n) for n in shape_out)).encode())
+        sha.update(method.encode())
+        return sha.hexdigest()
+
+    def get(self, key):
+        """Retorna (reprojected, footprint) si la clave está en caché, o None."""
+        path = self._entry_path(key)
+        try:
+            with np.load(path) as entry:
+                result = entry["reprojected"], entry["footprint"]
+        except (FileNotFoundError, OSError, ValueError, KeyError):
+            return None
+        os.utime(path)  # Marca la entrada como usada recientemente (LRU)
+        return result
+
+    def put(self, key, reprojected, footprint):
+        """Guarda una entrada y desaloja las menos usadas si se supera max_bytes."""
+        with tempfile.NamedTemporaryFile(dir=self.cache_dir, suffix=".tmp", delete=False) as tmp:
+            np.savez(tmp, reprojected=reprojected, footprint=footprint)
+        os.replace(tmp.name, self._entry_path(key))
+        self.evict()
+
+    def get_or_compute(self, key, compute):
+        """Retorna la entrada en caché o la calcula con `compute()` y la guarda."""
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        reprojected, footprint = compute()
+        self.put(key, reprojected, footprint)
+        return reprojected, footprint
+
+    def evict(self):
+        """Elimina las entradas usadas menos recientemente hasta quedar bajo max_bytes."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npz"):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        """Elimina todas las entradas y el índice de hashes."""
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npz") or name == os.path.basename(self.hash_index_file):
+                os.remove(os.path.join(self.cache_dir, name))
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def _read_hash_index(self):
+        try:
+            with open(self.hash_index_file) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _atomic_write(self, path, content):
+        with tempfile.NamedTemporaryFile(dir=self.cache_dir, suffix=".tmp", delete=False) as tmp:
+            tmp.write(content)
+        os.replace(tmp.name, path)
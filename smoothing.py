@@ -0,0 +1,266 @@
+"""
+Convolución de imágenes y cubos FITS a una resolución común (un beam objetivo) por FFT, sin CASA.
+
+Para llevar un beam B a un beam objetivo T se convoluciona con la gaussiana de matriz T - B
+(ver beams.py: convolucionar gaussianas es sumar sus matrices), que debe ser semidefinida
+positiva (T debe contener a B). El núcleo no se construye como imagen: su transformada de
+Fourier es analítica, exp(-2 pi^2 k^T C k) con C la covarianza en píxeles del núcleo, así que
+la convolución es rfft2 -> producto -> irfft2, sin truncar el núcleo.
+
+    - FFT real a real (scipy.fft.rfft2/irfft2), en float32 si la entrada lo es.
+    - La imagen se rellena con ceros hasta un tamaño rápido para la FFT (next_fast_len) con
+      un margen de KERNEL_SIGMAS sigmas del núcleo, para que la convolución no se "enrolle".
+    - `workers` hilos en la FFT (scipy.fft).
+    - Los cubos se recorren por bloques de canales (cada canal con su beam de la tabla BEAMS)
+      y se escriben a medida que se procesan, sin tener el cubo completo en memoria.
+
+Como imsmooth de CASA, los píxeles NaN cuentan como 0 en la convolución (y siguen siendo NaN
+en la salida), los bordes se tratan como 0 y, si las unidades son por beam (Jy/beam), el
+resultado se multiplica por el cociente de áreas de los beams para conservar las unidades.
+
+Uso:
+    python smoothing.py cubo.fits cubo_suavizado.fits [--beam 2.0,1.5,30] [--workers 4] [--max-chunk-mb 256]
+
+Ejemplo desde Python:
+    from smoothing import smooth_plane, smooth_cube, common_target
+    target = common_target(plotter.beam_base, plotter.beam_contour)
+    smoothed = smooth_plane(data, plotter.beam_contour, target, wcs)
+    smooth_cube("cubo.fits", "cubo_suavizado.fits")   # al beam común de todos los canales
+"""
+
+import argparse
+
+import numpy as np
+import scipy.fft
+from astropy.io import fits
+from astropy.wcs import WCS
+
+from beams import Beams, beam_matrices, common_beam, beam_dict, max_ratio, sky_to_pixel_matrix, COMMON_BEAM_TOL
+from moments import cube_index, spectral_axis, DEFAULT_MAX_CHUNK_BYTES
+
+KERNEL_SIGMAS = 4  # Margen de relleno, en sigmas del núcleo (la gaussiana cae a e^-8)
+FWHM_TO_SIGMA2 = 1 / (8 * np.log(2))  # (sigma / FWHM)^2
+
+
+def as_tuple(beam):
+    """(bmaj, bmin, bpa) de un beam dado como diccionario o secuencia."""
+    if isinstance(beam, dict):
+        return beam['bmaj'], beam['bmin'], beam['bpa']
+    bmaj, bmin, bpa = beam
+    return bmaj, bmin, bpa
+
+
+def common_target(*beams):
+    """Beam común (ver beams.common_beam) de los beams dados; los None se ignoran."""
+    beams = [as_tuple(beam) for beam in beams if beam is not None]
+    if not beams:
+        raise ValueError("No hay beams para calcular el beam común.")
+    bmaj, bmin, bpa = np.array(beams, dtype=float).T
+    return beam_dict(*common_beam(bmaj, bmin, bpa))
+
+
+def kernel_matrices(beams, target):
+    """
+    Matrices (este, norte) de los núcleos que llevan cada beam al beam objetivo (target - beam).
+    `beams` es una matriz (2, 2) o un arreglo (n, 2, 2); lanza ValueError si el objetivo no
+    contiene a algún beam (no se puede deconvolucionar).
+    """
+    target = beam_matrices(*as_tuple(target))
+    if np.any(max_ratio(target, beams) > 1 + COMMON_BEAM_TOL):
+        raise ValueError("El beam objetivo no contiene a todos los beams: no se puede convolucionar a él.")
+    kernels = target - beams
+    # Los núcleos nulos (beam == objetivo) pueden quedar levemente negativos por redondeo
+    eigenvalues, eigenvectors = np.linalg.eigh(kernels)
+    return (eigenvectors * np.maximum(eigenvalues, 0.0)[..., None, :]) @ np.swapaxes(eigenvectors, -1, -2)
+
+
+def pixel_covariances(kernels, wcs):
+    """Covarianzas (x, y) en píxeles^2 de los núcleos gaussianos (FWHM -> sigma)."""
+    transform = sky_to_pixel_matrix(wcs)
+    return transform @ kernels @ transform.T * (4 * FWHM_TO_SIGMA2)
+
+
+def fft_shape(shape, covariances):
+    """Tamaño rápido para la FFT de `shape` más el margen del núcleo más ancho."""
+    sigma = np.sqrt(np.max(np.linalg.eigvalsh(covariances), initial=0.0))
+    margin = int(np.ceil(KERNEL_SIGMAS * sigma))
+    return tuple(scipy.fft.next_fast_len(int(n) + margin, real=True) for n in shape)
+
+
+def transfer_functions(covariances, shape, dtype=np.float32):
+    """
+    Transformadas (n, ny, nx // 2 + 1) de los núcleos gaussianos normalizados de covarianzas
+    (n, 2, 2) en la grilla de rfft2 de `shape`: exp(-2 pi^2 k^T C k).
+    """
+    ky = scipy.fft.fftfreq(shape[0]).astype(dtype)[:, None]
+    kx = scipy.fft.rfftfreq(shape[1]).astype(dtype)[None, :]
+    cov = np.asarray(covariances, dtype=dtype).reshape(-1, 2, 2)
+    quadratic = (cov[:, 0, 0, None, None] * kx ** 2 + 2 * cov[:, 0, 1, None, None] * kx * ky
+                 + cov[:, 1, 1, None, None] * ky ** 2)
+    return np.exp(dtype(-2 * np.pi ** 2) * quadratic)
+
+
+def area_ratios(beams, target):
+    """Cociente de áreas objetivo / beam (factor para conservar unidades por beam)."""
+    target = beam_matrices(*as_tuple(target))
+    return np.sqrt(np.linalg.det(target) / np.linalg.det(beams))
+
+
+def per_beam(bunit):
+    """True si las unidades son por beam (p. ej. Jy/beam): se reescalan al convolucionar."""
+    return "beam" in str(bunit or "").lower()
+
+
+def convolve_planes(planes, covariances, scales=None, workers=None):
+    """
+    Convoluciona un bloque de planos (n, ny, nx) con núcleos gaussianos de covarianzas
+    (n, 2, 2) en píxeles (ver pixel_covariances). Los NaN cuentan como 0 y se conservan;
+    `scales` multiplica cada plano convolucionado.
+    """
+    planes = np.asarray(planes)
+    dtype = np.float32 if planes.dtype == np.float32 else np.float64
+    ny, nx = planes.shape[-2:]
+    invalid = ~np.isfinite(planes)
+    filled = np.where(invalid, 0, planes).astype(dtype, copy=False)
+    shape = fft_shape((ny, nx), covariances)
+    spectrum = scipy.fft.rfft2(filled, s=shape, workers=workers)
+    del filled
+    spectrum *= transfer_functions(covariances, shape, dtype=dtype)
+    result = scipy.fft.irfft2(spectrum, s=shape, workers=workers)[..., :ny, :nx]
+    if scales is not None:
+        result *= np.asarray(scales, dtype=dtype)[:, None, None]
+    result[invalid] = np.nan
+    return result
+
+
+def smooth_plane(data, beam, target, wcs, bunit="Jy/beam", workers=None):
+    """
+    Convoluciona una imagen 2-D de beam `beam` al beam `target` (diccionarios o tuplas
+    (bmaj, bmin, bpa) en arcsec y grados). `wcs` es el WCS celeste de la imagen (acepta
+    matrices CD/PC y píxeles no cuadrados). Si el núcleo es nulo retorna `data` sin copiar.
+    """
+    beams = beam_matrices(*as_tuple(beam))
+    kernel = kernel_matrices(beams, target)
+    if not np.any(kernel):
+        return data
+    scales = area_ratios(beams, target)[None] if per_beam(bunit) else None
+    covariance = pixel_covariances(kernel, wcs)[None]
+    return convolve_planes(np.asarray(data)[None], covariance, scales=scales, workers=workers)[0]
+
+
+def smoothed_header(header, target, stokes_axis=None):
+    """Header de la salida: beam objetivo, float32 y el eje Stokes degenerado (longitud 1)."""
+    header = header.copy()
+    for key in ("BSCALE", "BZERO", "BLANK", "CASAMBM"):
+        header.remove(key, ignore_missing=True)
+    header["BITPIX"] = -32
+    if stokes_axis is not None:
+        header[f"NAXIS{stokes_axis}"] = 1
+    header["BMAJ"] = target['bmaj'] / 3600
+    header["BMIN"] = target['bmin'] / 3600
+    header["BPA"] = target['bpa']
+    return header
+
+
+def smooth_cube(cube_fits, output_fits, target=None, stokes=0, workers=None,
+                max_chunk_bytes=DEFAULT_MAX_CHUNK_BYTES, verbose=False):
+    """
+    Convoluciona un cubo (o imagen) FITS al beam `target` recorriéndolo por bloques de canales.
+
+    Parámetros:
+        cube_fits (str): Archivo FITS de entrada (2-D, 3-D o 4-D).
+        output_fits (str): Archivo FITS de salida (float32, con el beam objetivo en el header).
+        target (dict o tuple, opcional): Beam objetivo; por defecto, el beam común de todos
+            los canales (tabla BEAMS o beam del header).
+        stokes (int, opcional): Plano Stokes a suavizar (la salida tiene un solo plano Stokes).
+        workers (int, opcional): Hilos de la FFT.
+        max_chunk_bytes (int, opcional): Tamaño máximo de cada bloque de canales (planos
+            rellenados, en la precisión de la FFT).
+        verbose (bool, opcional): Imprime el progreso.
+
+    Retorna:
+        El beam objetivo como diccionario {'bmaj', 'bmin', 'bpa'}.
+    """
+    with fits.open(cube_fits, memmap=True, lazy_load_hdus=True) as hdul:
+        hdu = hdul[0]
+        header = hdu.header
+        beams = Beams.from_hdul(hdul)
+        if beams is None:
+            raise ValueError(f"{cube_fits} no tiene beam (BMAJ/BMIN/BPA ni tabla BEAMS).")
+        if target is None:
+            target = beams.common(stokes=stokes)
+        target = beam_dict(*as_tuple(target))
+
+        ndim = header["NAXIS"]
+        axis = spectral_axis(header)
+        nchan = header[f"NAXIS{axis + 1}"] if axis is not None else 1
+        stokes_axis = next((k for k in range(3, ndim + 1)
+                            if str(header.get(f"CTYPE{k}", "")).upper().startswith("STOKES")), None)
+        ny, nx = header["NAXIS2"], header["NAXIS1"]
+        wcs = WCS(header, naxis=2)
+        scale = per_beam(header.get("BUNIT"))
+
+        # Núcleo, covarianza en píxeles y factor de unidades de cada canal (vectorizado)
+        if beams.single:
+            matrices = np.repeat(beams.matrices()[:1], nchan, axis=0)
+        else:
+            rows = beams.select(stokes=stokes)
+            order = np.argsort(beams.chan[rows])
+            matrices = beams.matrices()[rows][order]
+            if len(matrices) != nchan:
+                raise ValueError(f"La tabla BEAMS tiene {len(matrices)} beams para {nchan} canales.")
+        covariances = pixel_covariances(kernel_matrices(matrices, target), wcs)
+        scales = area_ratios(matrices, target) if scale else None
+
+        dtype_bytes = 4 if hdu.header["BITPIX"] in (8, 16, -32) else 8
+        padded = fft_shape((ny, nx), covariances)
+        plane_bytes = padded[0] * padded[1] * dtype_bytes * 3  # Plano rellenado + espectro complejo
+        chunk = max(1, int(max_chunk_bytes // plane_bytes))
+
+        output = fits.StreamingHDU(output_fits, smoothed_header(header, target, stokes_axis))
+        try:
+            for c0 in range(0, nchan, chunk):
+                c1 = min(c0 + chunk, nchan)
+                block = np.asarray(hdu.section[cube_index(header, slice(c0, c1), stokes)]).reshape(-1, ny, nx)
+                if not block.dtype.isnative:
+                    block = block.astype(block.dtype.newbyteorder('='))
+                smoothed = convolve_planes(block, covariances[c0:c1],
+                                           scales=None if scales is None else scales[c0:c1], workers=workers)
+                output.write(smoothed.astype(np.float32, copy=False))
+                if verbose:
+                    print(f"Canales {c0}-{c1 - 1} de {nchan} suavizados")
+        finally:
+            output.close()
+    return target
+
+
+def parse_beam(text):
+    """Convierte "2.0,1.5,30" (bmaj y bmin en arcsec, bpa en grados) en un diccionario."""
+    if not text:
+        return None
+    values = [float(value) for value in text.split(",")]
+    if len(values) == 1:
+        values = [values[0], values[0], 0.0]
+    return beam_dict(*values)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convolución por FFT de imágenes y cubos FITS a un beam común")
+    parser.add_argument("input", help="Archivo FITS de entrada")
+    parser.add_argument("output", help="Archivo FITS de salida")
+    parser.add_argument("--beam", default=None,
+                        help="Beam objetivo bmaj,bmin,bpa (arcsec, arcsec, grados); por defecto, el común")
+    parser.add_argument("--stokes", type=int, default=0, help="Plano Stokes")
+    parser.add_argument("--workers", type=int, default=None, help="Hilos de la FFT")
+    parser.add_argument("--max-chunk-mb", type=float, default=DEFAULT_MAX_CHUNK_BYTES / 1024 ** 2,
+                        help="Tamaño máximo de cada bloque de canales en MB")
+    args = parser.parse_args(argv)
+
+    target = smooth_cube(args.input, args.output, target=parse_beam(args.beam), stokes=args.stokes,
+                         workers=args.workers, max_chunk_bytes=int(args.max_chunk_mb * 1024 ** 2), verbose=True)
+    print(f"Beam objetivo: {target['bmaj']:.4f}\" x {target['bmin']:.4f}\", BPA {target['bpa']:.2f} deg")
+    print(f"Cubo guardado como {args.output}")
+
+
+if __name__ == "__main__":
+    main()
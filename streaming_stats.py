@@ -0,0 +1,337 @@
+"""
+Estadísticas de imágenes FITS en una sola pasada por bloques, con caché en disco por archivo.
+
+StreamingStats acumula bloque a bloque el número de píxeles finitos y no finitos (NaN/inf),
+la suma y la suma de cuadrados (en float64), el mínimo, el máximo y un histograma que permite
+calcular percentiles. El histograma no necesita conocer el rango de los datos: cada bin son
+los HISTOGRAM_BITS bits más significativos del valor en float32 (signo, exponente y 8 bits de
+mantisa), así que:
+    - el índice del bin se obtiene con un desplazamiento de bits, sin logaritmos;
+    - el ancho relativo de cada bin es 2^-8 (~0,4%) en cualquier escala, de 1e-30 a 1e30;
+    - dos resúmenes se combinan sumando sus histogramas (merge), por lo que se pueden
+      calcular por bloques en paralelo (dask) y unir al final.
+Los percentiles se interpolan dentro del bin y se acotan al mínimo y máximo exactos.
+
+StatsCache guarda los resúmenes en disco por (ruta, tamaño, mtime, plano): después del primer
+recorrido, las estadísticas y los niveles de contorno de un archivo se obtienen sin leer datos.
+
+level_scheme calcula niveles de contorno a partir de un resumen:
+    - 'linear': N niveles lineales entre el mínimo y el máximo (el criterio por defecto de
+      FITSPlotter);
+    - 'percentile': niveles en percentiles cada vez más cercanos a 100 (50, 80, 95, ... 99.99);
+    - 'asinh' y 'log': niveles entre la mediana y el máximo espaciados como los stretch
+      AsinhStretch y LogStretch de astropy (más densos cerca de la mediana).
+
+Uso:
+    python streaming_stats.py imagen.fits [--channel 0] [--stokes 0] [--scheme asinh] [--nlevels 7] [--cache]
+
+Ejemplo desde Python:
+    from streaming_stats import StatsCache, file_stats, level_scheme
+    stats = file_stats("mosaico.fits", cache=StatsCache())   # un recorrido; luego O(1)
+    stats.min, stats.max, stats.rms, stats.nan_count, stats.percentile([50, 99])
+    levels = level_scheme(stats, "asinh", n=7)
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+from astropy.io import fits
+
+from moments import cube_index
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "fits_plotting_tool", "stats")
+
+# Bloques chicos: la pasada es una reducción y no gana nada con bloques grandes
+DEFAULT_MAX_CHUNK_BYTES = 16 * 1024 ** 2
+
+HISTOGRAM_BITS = 17  # Signo + 8 bits de exponente + 8 bits de mantisa del float32
+HISTOGRAM_SHIFT = 32 - HISTOGRAM_BITS
+NBINS = 1 << HISTOGRAM_BITS
+FLOAT32_MAX = np.finfo(np.float32).max
+
+LEVEL_SCHEMES = ("linear", "percentile", "asinh", "log")
+NLEVELS = 7
+PERCENTILE_RANGE = (50.0, 99.99)  # Percentiles extremos del esquema 'percentile'
+ASINH_A = 0.1  # Parámetro de AsinhStretch (astropy)
+LOG_A = 1000.0  # Parámetro de LogStretch (astropy)
+
+
+def _bin_order():
+    """Índices de los bins ordenados por valor: negativos (de mayor a menor magnitud) y positivos."""
+    half = NBINS // 2
+    return np.concatenate([np.arange(NBINS - 1, half - 1, -1), np.arange(half)])
+
+
+def _bin_edges(bins):
+    """Bordes (inferior, superior) en valor de los bins `bins`."""
+    bins = np.asarray(bins, dtype=np.uint32)
+    sign = bins >> (HISTOGRAM_BITS - 1)
+    magnitude = bins & ((1 << (HISTOGRAM_BITS - 1)) - 1)
+    low = (magnitude << HISTOGRAM_SHIFT).astype(np.uint32).view(np.float32).astype(np.float64)
+    high = ((magnitude + 1) << HISTOGRAM_SHIFT).astype(np.uint32).view(np.float32).astype(np.float64)
+    high = np.where(np.isfinite(high), high, FLOAT32_MAX)
+    return np.where(sign == 1, -high, low), np.where(sign == 1, -low, high)
+
+
+class StreamingStats:
+    def __init__(self):
+        """Resumen vacío; se alimenta con update() y se combina con merge()."""
+        self.count = 0  # Píxeles finitos
+        self.nan_count = 0  # Píxeles NaN o infinitos
+        self.sum = 0.0
+        self.sum_sq = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.histogram = np.zeros(NBINS, dtype=np.int64)
+
+    @classmethod
+    def from_array(cls, data, max_chunk_bytes=DEFAULT_MAX_CHUNK_BYTES):
+        """Resumen de un arreglo (o memmap) recorrido por bloques del primer eje."""
+        data = np.asarray(data)
+        stats = cls()
+        if data.ndim == 0 or data.size == 0:
+            return stats.update(data)
+        row_bytes = max(1, data[0].size * 8)
+        rows = max(1, int(max_chunk_bytes // row_bytes))
+        for y0 in range(0, data.shape[0], rows):
+            stats.update(data[y0:y0 + rows])
+        return stats
+
+    @classmethod
+    def merge_all(cls, parts):
+        """Unión de varios resúmenes (p. ej. uno por bloque de un arreglo dask)."""
+        stats = cls()
+        for part in parts:
+            stats.merge(part)
+        return stats
+
+    def update(self, block):
+        """Agrega los valores de un bloque (cualquier forma) y retorna el resumen."""
+        values = np.asarray(block).ravel()
+        finite = np.isfinite(values)
+        count = int(np.count_nonzero(finite))
+        self.nan_count += values.size - count
+        if count == 0:
+            return self
+        if count < values.size:
+            values = values[finite]
+        wide = values.astype(np.float64, copy=False)
+        self.count += count
+        self.sum += float(wide.sum())
+        self.sum_sq += float(np.dot(wide, wide))
+        self.min = min(self.min, float(wide.min()))
+        self.max = max(self.max, float(wide.max()))
+        if values.dtype.kind != "f" or values.dtype.itemsize > 4:
+            values = np.clip(wide, -FLOAT32_MAX, FLOAT32_MAX)
+        bins = values.astype(np.float32, copy=False).view(np.uint32) >> HISTOGRAM_SHIFT
+        self.histogram += np.bincount(bins, minlength=NBINS)
+        return self
+
+    def merge(self, other):
+        """Agrega otro resumen (de otros píxeles) y retorna este."""
+        self.count += other.count
+        self.nan_count += other.nan_count
+        self.sum += other.sum
+        self.sum_sq += other.sum_sq
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.histogram += other.histogram
+        return self
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+    @property
+    def rms(self):
+        return float(np.sqrt(self.sum_sq / self.count)) if self.count else None
+
+    @property
+    def std(self):
+        if not self.count:
+            return None
+        return float(np.sqrt(max(self.sum_sq / self.count - self.mean ** 2, 0.0)))
+
+    def percentile(self, q):
+        """
+        Percentiles `q` (0-100, escalar o arreglo) de los píxeles finitos, con un error relativo
+        de a lo sumo el ancho de un bin (~0,4%); el 0 y el 100 son el mínimo y el máximo exactos.
+        """
+        q = np.asarray(q, dtype=np.float64)
+        if not self.count:
+            return np.full(q.shape, np.nan) if q.ndim else np.nan
+        order = _bin_order()
+        counts = self.histogram[order]
+        used = np.flatnonzero(counts)
+        counts, bins = counts[used], order[used]
+        cumulative = np.cumsum(counts)
+        rank = np.clip(q, 0, 100) / 100 * (self.count - 1)
+        j = np.searchsorted(cumulative, rank, side="right")
+        j = np.minimum(j, len(bins) - 1)
+        before = np.where(j > 0, cumulative[j - 1], 0)
+        fraction = (rank - before + 0.5) / counts[j]
+        low, high = _bin_edges(bins[j])
+        low, high = np.maximum(low, self.min), np.minimum(high, self.max)
+        value = np.clip(low + np.clip(fraction, 0, 1) * (high - low), self.min, self.max)
+        value = np.where(q <= 0, self.min, np.where(q >= 100, self.max, value))
+        return float(value) if value.ndim == 0 else value
+
+    def image_stats(self):
+        """Diccionario {'rms', 'max', 'min'} como contour_engine.image_stats."""
+        if not self.count:
+            return {'rms': None, 'max': None, 'min': None}
+        return {'rms': self.rms, 'max': self.max, 'min': self.min}
+
+    def summary(self):
+        """Resumen legible: conteos, mínimo, máximo, media, RMS, desviación y percentiles."""
+        percentiles = (1, 5, 25, 50, 75, 95, 99, 99.9)
+        values = self.percentile(percentiles) if self.count else [None] * len(percentiles)
+        return {'count': self.count, 'nan_count': self.nan_count, 'min': self.min if self.count else None,
+                'max': self.max if self.count else None, 'mean': self.mean, 'rms': self.rms, 'std': self.std,
+                'percentiles': {str(p): None if v is None else float(v) for p, v in zip(percentiles, values)}}
+
+    def save(self, path):
+        """Guarda el resumen en un .npz (histograma disperso: solo los bins usados)."""
+        used = np.flatnonzero(self.histogram)
+        np.savez(path, scalars=np.array([self.count, self.nan_count, self.sum, self.sum_sq, self.min, self.max]),
+                 bins=used.astype(np.uint32), counts=self.histogram[used])
+
+    @classmethod
+    def load(cls, path):
+        """Resumen guardado con save()."""
+        stats = cls()
+        with np.load(path) as entry:
+            count, nan_count, stats.sum, stats.sum_sq, stats.min, stats.max = entry["scalars"].tolist()
+            stats.count, stats.nan_count = int(count), int(nan_count)
+            stats.histogram[entry["bins"]] = entry["counts"]
+        return stats
+
+
+def plane_stats(hdu, channel=0, stokes=0, max_chunk_bytes=DEFAULT_MAX_CHUNK_BYTES):
+    """Resumen de un plano (canal, Stokes) de `hdu` leído por bloques de filas con hdu.section."""
+    header = hdu.header
+    ny, nx = header["NAXIS2"], header["NAXIS1"]
+    rows = max(1, int(max_chunk_bytes // (nx * 8)))
+    stats = StreamingStats()
+    for y0 in range(0, ny, rows):
+        index = cube_index(header, channel, stokes)[:-2] + (slice(y0, min(ny, y0 + rows)), slice(None))
+        stats.update(hdu.section[index])
+    return stats
+
+
+def default_cache_dir():
+    """Directorio de caché: variable FITS_PLOTTER_STATS_CACHE o ~/.cache/fits_plotting_tool/stats."""
+    return os.environ.get("FITS_PLOTTER_STATS_CACHE", DEFAULT_CACHE_DIR)
+
+
+class StatsCache:
+    def __init__(self, cache_dir=None):
+        """
+        Parámetros:
+            cache_dir (str, opcional): Directorio donde se guardan los resúmenes (unos pocos
+                KB por archivo y plano).
+        """
+        self.cache_dir = cache_dir or default_cache_dir()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def make_key(self, filename, plane=None):
+        """Clave: ruta absoluta, tamaño y mtime del archivo (cambia si se modifica) + plano."""
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        return hashlib.sha256(repr((path, stat.st_size, stat.st_mtime_ns, plane)).encode()).hexdigest()
+
+    def get(self, key):
+        """Resumen guardado con la clave `key`, o None."""
+        try:
+            return StreamingStats.load(self._entry_path(key))
+        except (FileNotFoundError, OSError, ValueError, KeyError):
+            return None
+
+    def put(self, key, stats):
+        with tempfile.NamedTemporaryFile(dir=self.cache_dir, suffix=".tmp", delete=False) as tmp:
+            stats.save(tmp)
+        os.replace(tmp.name, self._entry_path(key))
+
+    def get_or_compute(self, key, compute):
+        """Retorna el resumen en caché o lo calcula con `compute()` y lo guarda."""
+        stats = self.get(key)
+        if stats is None:
+            stats = compute()
+            self.put(key, stats)
+        return stats
+
+    def clear(self):
+        """Elimina todos los resúmenes."""
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npz"):
+                os.remove(os.path.join(self.cache_dir, name))
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+
+def file_stats(filename, channel=0, stokes=0, cache=None, max_chunk_bytes=DEFAULT_MAX_CHUNK_BYTES):
+    """
+    Resumen de un plano de un archivo FITS, en una pasada por bloques de filas. Con `cache`
+    (StatsCache, o True para el directorio por defecto) se recorre solo la primera vez.
+    """
+    def compute():
+        with fits.open(filename, memmap=False, lazy_load_hdus=True) as hdul:
+            return plane_stats(hdul[0], channel, stokes, max_chunk_bytes)
+
+    if cache is True:
+        cache = StatsCache()
+    if not cache:
+        return compute()
+    return cache.get_or_compute(cache.make_key(filename, (channel, stokes)), compute)
+
+
+def level_scheme(stats, scheme="linear", n=NLEVELS, percentiles=PERCENTILE_RANGE):
+    """
+    Niveles de contorno absolutos (crecientes) de un resumen según `scheme` (ver LEVEL_SCHEMES).
+    `percentiles` = (inferior, superior) solo se usa en el esquema 'percentile'.
+    """
+    if scheme not in LEVEL_SCHEMES:
+        raise ValueError(f"Esquema de niveles desconocido: {scheme!r}. Use {', '.join(LEVEL_SCHEMES)}.")
+    if not stats.count:
+        raise ValueError("La imagen no tiene píxeles finitos: no se pueden calcular niveles.")
+    if scheme == "linear":
+        return np.linspace(stats.min, stats.max, n)
+    if scheme == "percentile":
+        # Espaciados en log(100 - p): 50, 80, 95, ... 99.99 se acercan al pico
+        low, high = percentiles
+        tails = np.geomspace(100 - low, 100 - high, n)
+        return np.unique(stats.percentile(100 - tails))  # Sin niveles repetidos (datos discretos)
+
+    low, high = stats.percentile(50), stats.max
+    y = np.linspace(0, 1, n)
+    if scheme == "asinh":
+        x = ASINH_A * np.sinh(y * np.arcsinh(1 / ASINH_A))
+    else:
+        x = ((LOG_A + 1) ** y - 1) / LOG_A
+    return low + x * (high - low)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Estadísticas en una pasada y niveles de contorno de una imagen FITS")
+    parser.add_argument("fits_file", help="Archivo FITS")
+    parser.add_argument("--channel", type=int, default=0, help="Canal espectral")
+    parser.add_argument("--stokes", type=int, default=0, help="Plano Stokes")
+    parser.add_argument("--scheme", choices=LEVEL_SCHEMES, default=None, help="Esquema de niveles a imprimir")
+    parser.add_argument("--nlevels", type=int, default=NLEVELS, help="Número de niveles")
+    parser.add_argument("--cache", action="store_true", help="Usa la caché de estadísticas (StatsCache)")
+    args = parser.parse_args(argv)
+
+    stats = file_stats(args.fits_file, args.channel, args.stokes, cache=args.cache)
+    print(json.dumps(stats.summary(), indent=2))
+    if args.scheme:
+        levels = level_scheme(stats, args.scheme, n=args.nlevels)
+        print(f"Niveles ({args.scheme}): {', '.join(f'{level:.6g}' for level in levels)}")
+
+
+if __name__ == "__main__":
+    main()